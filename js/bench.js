@@ -0,0 +1,127 @@
+// Frame-time bench for the dashboard chart layer (served at /bench).
+const BENCH_FRAMES = 300;
+const BENCH_HISTORY_POINTS = 24 * 60;
+const BENCH_DATASETS = 4;
+
+function synthValue(i, k) {
+  return 15 + 10 * Math.sin((i + k * 97) / 180) + Math.random();
+}
+
+function pct(sorted, p) {
+  if (!sorted.length) return 0;
+  return sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * p))];
+}
+
+function summary(xs) {
+  const sorted = Float64Array.from(xs).sort();
+  const avg = xs.reduce((a, b) => a + b, 0) / (xs.length || 1);
+  return { avg, p95: pct(sorted, 0.95), max: sorted.length ? sorted[sorted.length - 1] : 0 };
+}
+
+let chart = null;
+
+function newChart(options) {
+  if (chart) chart.destroy();
+  const datasets = [];
+  for (let k = 0; k < BENCH_DATASETS; k++) datasets.push({ label: `series ${k}`, data: [], borderWidth: 2, tension: 0.25 });
+  chart = new Chart(document.getElementById("benchChart"), {
+    type: "line",
+    data: { datasets },
+    options
+  });
+  return chart;
+}
+
+// previous dashboard data layer: objects, shift(), full re-map per refresh
+function legacyMode() {
+  const opts = fastLineOptions({ x: { type: "linear" }, y: { type: "linear" } });
+  opts.plugins.decimation = { enabled: false };
+  opts.normalized = false;
+  const c = newChart(opts);
+  const t0 = Math.floor(Date.now() / 1000) - BENCH_HISTORY_POINTS * 60;
+  const raw = [];
+  for (let k = 0; k < BENCH_DATASETS; k++) {
+    const h = [];
+    for (let i = 0; i < BENCH_HISTORY_POINTS; i++) h.push([t0 + i * 60, synthValue(i, k)]);
+    raw.push(h);
+  }
+  let n = 0;
+  return () => {
+    n++;
+    for (let k = 0; k < BENCH_DATASETS; k++) {
+      raw[k].shift();
+      raw[k].push([t0 + (BENCH_HISTORY_POINTS + n) * 60, synthValue(BENCH_HISTORY_POINTS + n, k)]);
+      c.data.datasets[k].data = raw[k].map(([x, y]) => ({ x, y }));
+    }
+    c.update("none");
+  };
+}
+
+function ringMode() {
+  const c = newChart(fastLineOptions({ x: { type: "linear" }, y: { type: "linear" } }));
+  const t0 = Math.floor(Date.now() / 1000) - BENCH_HISTORY_POINTS * 60;
+  const series = [];
+  for (let k = 0; k < BENCH_DATASETS; k++) {
+    const s = new RingSeries(BENCH_HISTORY_POINTS);
+    for (let i = 0; i < BENCH_HISTORY_POINTS; i++) s.push(t0 + i * 60, synthValue(i, k));
+    s.sync();
+    c.data.datasets[k].data = s.points;
+    series.push(s);
+  }
+  c.update("none");
+  let n = 0;
+  return () => {
+    n++;
+    let changed = false;
+    for (const [k, s] of series.entries()) {
+      s.push(t0 + (BENCH_HISTORY_POINTS + n) * 60, synthValue(BENCH_HISTORY_POINTS + n, k));
+      changed = s.sync() || changed;
+    }
+    if (changed) c.update("none");
+  };
+}
+
+function runMode(name, makeStep) {
+  return new Promise(resolve => {
+    const step = makeStep();
+    const updates = [];
+    const frames = [];
+    let last = performance.now();
+    let count = 0;
+    setText("benchStatus", `running ${name}...`);
+    function frame(now) {
+      frames.push(now - last);
+      last = now;
+      const t = performance.now();
+      step();
+      updates.push(performance.now() - t);
+      if (++count < BENCH_FRAMES) requestAnimationFrame(frame);
+      else resolve({ name, updates: summary(updates), frames: summary(frames.slice(1)) });
+    }
+    requestAnimationFrame(frame);
+  });
+}
+
+function setText(id, txt) {
+  const el = document.getElementById(id);
+  if (el) el.innerText = txt;
+}
+
+function report(r) {
+  const tr = document.createElement("tr");
+  for (const v of [r.name, BENCH_FRAMES, r.updates.avg, r.updates.p95, r.frames.avg, r.frames.p95, r.frames.max]) {
+    const td = document.createElement("td");
+    td.innerText = typeof v === "number" && !Number.isInteger(v) ? v.toFixed(2) : v;
+    tr.appendChild(td);
+  }
+  document.getElementById("benchResults").appendChild(tr);
+}
+
+async function run(modes) {
+  for (const [name, make] of modes) report(await runMode(name, make));
+  setText("benchStatus", "done");
+}
+
+document.getElementById("runLegacy").onclick = () => run([["legacy", legacyMode]]);
+document.getElementById("runRing").onclick = () => run([["ring", ringMode]]);
+document.getElementById("runBoth").onclick = () => run([["legacy", legacyMode], ["ring", ringMode]]);
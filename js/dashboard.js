@@ -1,6 +1,8 @@
 const REFRESH_MS = 5000;
 const HISTORY_REFRESH_MS = 60000;
 const MAX_LIVE_POINTS = 240;
+const HISTORY_HOURS = 24;
+const MAX_HISTORY_POINTS = HISTORY_HOURS * 60 + 2;
 
 function nowSec() { return Math.floor(Date.now() / 1000); }
 function fmtTime(ts) {
@@ -8,11 +10,6 @@ function fmtTime(ts) {
   return d.toLocaleTimeString([], { hour: "2-digit", minute: "2-digit" });
 }
 
-function pushPoint(arr, x, y, maxLen) {
-  arr.push({ x, y });
-  if (arr.length > maxLen) arr.shift();
-}
-
 function setText(id, txt) {
   const el = document.getElementById(id);
   if (el) el.innerText = txt;
@@ -64,69 +61,74 @@ function badgeColorPressure(p) {
   return "bg-danger text-light";
 }
 
-let history = null;
 let historyFetchedAt = 0;
+let historyCursor = null;
+let historyRev = null;
+
+// 24h series (minute buckets from /api/history), one ring per key
+const history = {};
+for (const key of [
+  "temperature", "humidity", "windspeed", "winddir", "solarradiation", "uv",
+  "rainrate_mm", "event_mm", "hourly_mm", "last24h_mm", "daily_mm", "weekly_mm", "monthly_mm", "yearly_mm",
+]) history[key] = new RingSeries(MAX_HISTORY_POINTS);
+
+// full response or delta from /api/history?since=&rev=: buckets >= since
+// replace the tail (the last one may have been provisional, late uploads may
+// move since back), older ones fall out of the window
+function mergeHistory(h, full) {
+  for (const key in history) {
+    const s = history[key];
+    if (full) s.clear();
+    else s.truncateFrom(h.since);
+    for (const [ts, v] of (h[key] || [])) s.push(ts, v);
+    s.dropBefore(h.window_start);
+  }
+}
 
-async function fetchHistory(hours = 24) {
+async function fetchHistory(hours = HISTORY_HOURS) {
   const now = Date.now();
-  if (history && (now - historyFetchedAt) < HISTORY_REFRESH_MS) return history;
-  const r = await fetch(`/api/history?hours=${hours}`, { cache: "no-store" });
-  history = await r.json();
+  if (historyCursor !== null && (now - historyFetchedAt) < HISTORY_REFRESH_MS) return;
+  const since = historyCursor !== null ? `&since=${historyCursor}&rev=${historyRev}` : "";
+  const r = await fetch(`/api/history?hours=${hours}${since}`, { cache: "no-store" });
+  const h = await r.json();
+  mergeHistory(h, !since || h.since === null);
+  historyCursor = h.cursor;
+  historyRev = h.rev;
   historyFetchedAt = now;
-  return history;
-}
-
-function seriesFromHistory(key) {
-  if (!history || !history[key]) return [];
-  return history[key].map(([ts, v]) => ({ x: ts, y: v }));
 }
 
 // live buffers
 const live = {
-  temp: [],
-  hum: [],
-  ws: [],
-  wd: [],
-  sr: [],
-  uv: [],
+  temp: new RingSeries(MAX_LIVE_POINTS),
+  hum: new RingSeries(MAX_LIVE_POINTS),
+  ws: new RingSeries(MAX_LIVE_POINTS),
+  wd: new RingSeries(MAX_LIVE_POINTS),
+  sr: new RingSeries(MAX_LIVE_POINTS),
+  uv: new RingSeries(MAX_LIVE_POINTS),
 };
 
+// datasets point at series.points once; refreshes only mutate those arrays
+function syncChart(chart, series) {
+  let changed = false;
+  for (const s of series) changed = s.sync() || changed;
+  if (changed) chart.update("none");
+}
+
 function makeLineChart(canvasId, datasets, scales) {
   return new Chart(document.getElementById(canvasId), {
     type: "line",
     data: { datasets },
-/* Dots yes */
-/*     options: {
-      responsive: true,
-      maintainAspectRatio: false,
-      animation: false,
-      parsing: false,
-      plugins: { legend: { labels: { color: "#eee" } } },
-      scales
-    } */
-/* Dots no */
-    options: {
-      responsive: true,
-      maintainAspectRatio: false,
-      animation: false,
-      parsing: false,
-      elements: {
-        point: { radius: 0, hoverRadius: 0 },
-        line: { borderWidth: 3 }
-      },
-      plugins: { legend: { labels: { color: "#eee" } } },
-      scales
-    }
+    options: fastLineOptions(scales)
   });
 }
 
 // TEMP chart: live + 24h
 const tempChart = makeLineChart("tempChart",
   [
-    { label: "Temp (live) °C", data: [], borderWidth: 2, tension: 0.25, yAxisID: "yT" },
-    { label: "Temp (24h) °C", data: [], borderWidth: 2, tension: 0.25, yAxisID: "yT" },
-    { label: "Hum (live) %", data: [], borderWidth: 2, tension: 0.25, yAxisID: "yH" },
-    { label: "Hum (24h) %", data: [], borderWidth: 2, tension: 0.25, yAxisID: "yH" },
+    { label: "Temp (live) °C", data: live.temp.points, borderWidth: 2, tension: 0.25, yAxisID: "yT" },
+    { label: "Temp (24h) °C", data: history.temperature.points, borderWidth: 2, tension: 0.25, yAxisID: "yT" },
+    { label: "Hum (live) %", data: live.hum.points, borderWidth: 2, tension: 0.25, yAxisID: "yH" },
+    { label: "Hum (24h) %", data: history.humidity.points, borderWidth: 2, tension: 0.25, yAxisID: "yH" },
   ],
   {
     x: { type: "linear", ticks: { color: "#eee", callback: v => fmtTime(v) } },
@@ -138,10 +140,10 @@ const tempChart = makeLineChart("tempChart",
 // WIND chart: live + 24h
 const windChart = makeLineChart("windChart",
   [
-    { label: "Wind (live) km/h", data: [], borderWidth: 2, tension: 0.25, yAxisID: "yW" },
-    { label: "Wind (24h) km/h", data: [], borderWidth: 2, tension: 0.25, yAxisID: "yW" },
-    { label: "Dir (live) °", data: [], borderWidth: 2, tension: 0.25, yAxisID: "yD" },
-    { label: "Dir (24h) °", data: [], borderWidth: 2, tension: 0.25, yAxisID: "yD" },
+    { label: "Wind (live) km/h", data: live.ws.points, borderWidth: 2, tension: 0.25, yAxisID: "yW" },
+    { label: "Wind (24h) km/h", data: history.windspeed.points, borderWidth: 2, tension: 0.25, yAxisID: "yW" },
+    { label: "Dir (live) °", data: live.wd.points, borderWidth: 2, tension: 0.25, yAxisID: "yD" },
+    { label: "Dir (24h) °", data: history.winddir.points, borderWidth: 2, tension: 0.25, yAxisID: "yD" },
   ],
   {
     x: { type: "linear", ticks: { color: "#eee", callback: v => fmtTime(v) } },
@@ -153,14 +155,14 @@ const windChart = makeLineChart("windChart",
 // RAIN chart: default rainrate + yearly, but series contains all
 const rainChart = makeLineChart("rainChart",
   [
-    { label: "rainrate (mm/h)", data: [], borderWidth: 2, tension: 0.25 },
-    { label: "yearly (mm)", data: [], borderWidth: 2, tension: 0.25 },
-    { label: "event (mm)", data: [], borderWidth: 2, tension: 0.25, hidden: true },
-    { label: "hourly (mm)", data: [], borderWidth: 2, tension: 0.25, hidden: true },
-    { label: "last24h (mm)", data: [], borderWidth: 2, tension: 0.25, hidden: true },
-    { label: "daily (mm)", data: [], borderWidth: 2, tension: 0.25, hidden: true },
-    { label: "weekly (mm)", data: [], borderWidth: 2, tension: 0.25, hidden: true },
-    { label: "monthly (mm)", data: [], borderWidth: 2, tension: 0.25, hidden: true },
+    { label: "rainrate (mm/h)", data: history.rainrate_mm.points, borderWidth: 2, tension: 0.25 },
+    { label: "yearly (mm)", data: history.yearly_mm.points, borderWidth: 2, tension: 0.25 },
+    { label: "event (mm)", data: history.event_mm.points, borderWidth: 2, tension: 0.25, hidden: true },
+    { label: "hourly (mm)", data: history.hourly_mm.points, borderWidth: 2, tension: 0.25, hidden: true },
+    { label: "last24h (mm)", data: history.last24h_mm.points, borderWidth: 2, tension: 0.25, hidden: true },
+    { label: "daily (mm)", data: history.daily_mm.points, borderWidth: 2, tension: 0.25, hidden: true },
+    { label: "weekly (mm)", data: history.weekly_mm.points, borderWidth: 2, tension: 0.25, hidden: true },
+    { label: "monthly (mm)", data: history.monthly_mm.points, borderWidth: 2, tension: 0.25, hidden: true },
   ],
   {
     x: { type: "linear", ticks: { color: "#eee", callback: v => fmtTime(v) } },
@@ -171,10 +173,10 @@ const rainChart = makeLineChart("rainChart",
 // SOLAR/UV: live solar + live uv + 24h uv
 const sunChart = makeLineChart("sunChart",
   [
-    { label: "Solar (live) W/m²", data: [], borderWidth: 2, tension: 0.25, yAxisID: "yS" },
-    { label: "Solar (24h) W/m²", data: [], borderWidth: 2, tension: 0.25, yAxisID: "yS" },
-    { label: "UV (live)", data: [], borderWidth: 2, tension: 0.25, yAxisID: "yU" },
-    { label: "UV (24h)", data: [], borderWidth: 2, tension: 0.25, yAxisID: "yU" },
+    { label: "Solar (live) W/m²", data: live.sr.points, borderWidth: 2, tension: 0.25, yAxisID: "yS" },
+    { label: "Solar (24h) W/m²", data: history.solarradiation.points, borderWidth: 2, tension: 0.25, yAxisID: "yS" },
+    { label: "UV (live)", data: live.uv.points, borderWidth: 2, tension: 0.25, yAxisID: "yU" },
+    { label: "UV (24h)", data: history.uv.points, borderWidth: 2, tension: 0.25, yAxisID: "yU" },
   ],
   {
     x: { type: "linear", ticks: { color: "#eee", callback: v => fmtTime(v) } },
@@ -262,49 +264,24 @@ async function refresh() {
     setText("monthlyrainin", `${(mm.monthlyrain ?? 0).toFixed(2)} mm`);
     setText("yearlyrainin", `${(mm.yearlyrain ?? 0).toFixed(2)} mm`);
 
-    // update live arrays
-    pushPoint(live.temp, t, temp, MAX_LIVE_POINTS);
-    pushPoint(live.hum, t, hum, MAX_LIVE_POINTS);
-    pushPoint(live.ws, t, ws, MAX_LIVE_POINTS);
-    pushPoint(live.wd, t, wd, MAX_LIVE_POINTS);
-    pushPoint(live.sr, t, sr, MAX_LIVE_POINTS);
-    pushPoint(live.uv, t, uv, MAX_LIVE_POINTS);
-
-    // fetch 24h history (downsampled)
-    await fetchHistory(24);
-
-    // Temp chart datasets
-    tempChart.data.datasets[0].data = live.temp;
-    tempChart.data.datasets[1].data = seriesFromHistory("temperature");
-    tempChart.data.datasets[2].data = live.hum;
-    tempChart.data.datasets[3].data = seriesFromHistory("humidity");
-
-    // Wind chart datasets
-    windChart.data.datasets[0].data = live.ws;
-    windChart.data.datasets[1].data = seriesFromHistory("windspeed");
-    windChart.data.datasets[2].data = live.wd;
-    windChart.data.datasets[3].data = seriesFromHistory("winddir");
-
-    // Rain chart datasets (24h)
-    rainChart.data.datasets[0].data = seriesFromHistory("rainrate_mm");
-    rainChart.data.datasets[1].data = seriesFromHistory("yearly_mm");
-    rainChart.data.datasets[2].data = seriesFromHistory("event_mm");
-    rainChart.data.datasets[3].data = seriesFromHistory("hourly_mm");
-    rainChart.data.datasets[4].data = seriesFromHistory("last24h_mm");
-    rainChart.data.datasets[5].data = seriesFromHistory("daily_mm");
-    rainChart.data.datasets[6].data = seriesFromHistory("weekly_mm");
-    rainChart.data.datasets[7].data = seriesFromHistory("monthly_mm");
-
-    // Solar chart datasets
-    sunChart.data.datasets[0].data = live.sr;
-    sunChart.data.datasets[1].data = seriesFromHistory("solarradiation");
-    sunChart.data.datasets[2].data = live.uv;
-    sunChart.data.datasets[3].data = seriesFromHistory("uv");
-
-    tempChart.update("none");
-    windChart.update("none");
-    rainChart.update("none");
-    sunChart.update("none");
+    // update live rings
+    live.temp.push(t, temp);
+    live.hum.push(t, hum);
+    live.ws.push(t, ws);
+    live.wd.push(t, wd);
+    live.sr.push(t, sr);
+    live.uv.push(t, uv);
+
+    // 24h history (downsampled), merged incrementally
+    await fetchHistory(HISTORY_HOURS);
+
+    syncChart(tempChart, [live.temp, history.temperature, live.hum, history.humidity]);
+    syncChart(windChart, [live.ws, history.windspeed, live.wd, history.winddir]);
+    syncChart(rainChart, [
+      history.rainrate_mm, history.yearly_mm, history.event_mm, history.hourly_mm,
+      history.last24h_mm, history.daily_mm, history.weekly_mm, history.monthly_mm,
+    ]);
+    syncChart(sunChart, [live.sr, history.solarradiation, live.uv, history.uv]);
 
   } catch (e) {
     console.error("refresh error:", e);
@@ -0,0 +1,91 @@
+// Fixed-size time series backed by Float64Array ring buffers.
+// Chart.js (parsing: false) wants an array of {x, y}: `points` is that array,
+// rebuilt in place by sync() from a pool of objects allocated once, so a
+// refresh costs no allocations and push() is O(1) instead of arr.shift().
+class RingSeries {
+  constructor(capacity) {
+    this.capacity = capacity;
+    this.xs = new Float64Array(capacity);
+    this.ys = new Float64Array(capacity);
+    this.start = 0;
+    this.length = 0;
+    this.pool = Array.from({ length: capacity }, () => ({ x: 0, y: 0 }));
+    this.points = [];
+    this.dirty = false;
+  }
+
+  _idx(i) { return (this.start + i) % this.capacity; }
+
+  push(x, y) {
+    if (this.length === this.capacity) {
+      this.start = (this.start + 1) % this.capacity;
+      this.length--;
+    }
+    const i = this._idx(this.length);
+    this.xs[i] = x;
+    this.ys[i] = y;
+    this.length++;
+    this.dirty = true;
+  }
+
+  // drop points with x >= minX from the tail (used to replace updated buckets)
+  truncateFrom(minX) {
+    while (this.length && this.xs[this._idx(this.length - 1)] >= minX) {
+      this.length--;
+      this.dirty = true;
+    }
+  }
+
+  // drop points with x < minX from the head (sliding window)
+  dropBefore(minX) {
+    while (this.length && this.xs[this.start] < minX) {
+      this.start = (this.start + 1) % this.capacity;
+      this.length--;
+      this.dirty = true;
+    }
+  }
+
+  clear() {
+    this.start = 0;
+    this.length = 0;
+    this.dirty = true;
+  }
+
+  // copy the ring into `points` (same array, same objects); true if changed
+  sync() {
+    if (!this.dirty) return false;
+    const pts = this.points;
+    for (let i = 0; i < this.length; i++) {
+      const p = this.pool[i];
+      const j = this._idx(i);
+      p.x = this.xs[j];
+      p.y = this.ys[j];
+      pts[i] = p;
+    }
+    pts.length = this.length;
+    this.dirty = false;
+    return true;
+  }
+}
+
+// Chart.js options shared by the dashboard and bench.html: no parsing, sorted
+// x values, min-max decimation (keeps gust/rain peaks, unlike lttb averaging)
+function fastLineOptions(scales) {
+  return {
+    responsive: true,
+    maintainAspectRatio: false,
+    animation: false,
+    parsing: false,
+    normalized: true,
+    spanGaps: true,
+    elements: {
+      point: { radius: 0, hoverRadius: 0 },
+      line: { borderWidth: 3 }
+    },
+    plugins: {
+      legend: { labels: { color: "#eee" } },
+      decimation: { enabled: true, algorithm: "min-max" },
+    },
+    scales
+  };
+}
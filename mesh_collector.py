@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+# mesh_collector.py
+# Lato ricezione di sender_telemetry_once.py: ascolta i pacchetti di un nodo
+# Meshtastic (pubsub "meshtastic.receive"), decodifica
+#   - TELEMETRY_APP   protobuf Telemetry (environment metrics)
+#   - PRIVATE_APP     JSON compatto (t_c, h_pct, p_hpa, ws_kmh, wd_deg, rg_mmph, uv, sr_wm2)
+# e scrive le letture delle stazioni remote in `readings` (stesso DB del
+# server) con location = id del nodo ("!a1b2c3d4").
+#
+# La callback di ricezione gira nel thread di lettura della libreria: fa solo
+# dedup (from, id) e accodamento. Un thread writer decodifica e inserisce a
+# blocchi, in una transazione per blocco. La coda non ha limite: i pacchetti
+# non vengono mai scartati, al massimo si accumulano (warning oltre QUEUE_WARN).
+#
+# Il collector tiene la porta aperta per sempre: usare una radio dedicata
+# (SERIAL_PORT) o un nodo via rete, non la porta degli script di invio da
+# cron (SENDER_PORTS), che altrimenti fallirebbero tutti.
+#
+#   ./mesh_collector.py                          # nodo su SERIAL_PORT
+#   ./mesh_collector.py --tcp 192.168.1.50       # nodo via rete
+#   ./mesh_collector.py --record capture.jsonl   # salva anche i pacchetti ricevuti
+#   ./mesh_collector.py --replay capture.jsonl   # nessuna radio: riproduce una cattura
+import argparse
+import base64
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import sys
+import time
+from collections import OrderedDict
+from logging.handlers import RotatingFileHandler
+
+# registro dei campi (python/fields.py): colonne di `readings`
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "python"))
+import fields  # noqa: E402
+
+# =========================
+# CONFIG
+# =========================
+SERIAL_PORT = "/dev/ttyUSB1"       # seconda radio, solo ricezione
+SENDER_PORTS = {"/dev/ttyUSB0"}    # SERIAL_PORT di send_meshtastic_once / sender_telemetry_once / TARGETS
+LOGFILE = "./mesh_collector.log"
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+DB_PATH = os.path.join(BASE_DIR, "data", "ecowitt.db")
+
+# pacchetti dello stesso nodo nello stesso slot (telemetry + JSON inviati
+# insieme) finiscono nella stessa riga
+TS_QUANTUM = 30
+BATCH_ROWS = 500          # righe max per transazione
+BATCH_WAIT_SEC = 1.0      # attesa max per completare un blocco
+DEDUP_SIZE = 4096         # (from, id) ricordati
+QUEUE_WARN = 5000
+STATS_EVERY_SEC = 300
+
+# =========================
+# LOGGING
+# =========================
+logger = logging.getLogger("mesh_collector")
+logger.setLevel(logging.INFO)
+
+handler = RotatingFileHandler(LOGFILE, maxBytes=1_000_000, backupCount=5)
+formatter = logging.Formatter("[%(asctime)s] %(levelname)s - %(message)s")
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+console = logging.StreamHandler()
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+# =========================
+# DECODING
+# =========================
+# tutte le colonne valore: quelle che un pacchetto non porta restano NULL
+# (righe nuove) o invariate (COALESCE sulle righe gia' presenti)
+COLUMNS = list(fields.CORE)
+
+# chiave JSON (PRIVATE_APP) -> (colonna readings, fattore)
+PRIVATE_KEYS = {
+    "t_c": ("temperature", 1.0),
+    "h_pct": ("humidity", 1.0),
+    "p_hpa": ("pressure", 1.0),
+    "ws_kmh": ("windspeed", 1.0),
+    "wd_deg": ("winddir", 1.0),
+    "rg_mmph": ("rainratein", 1 / 25.4),
+    "uv": ("uv", 1.0),
+    "sr_wm2": ("solarradiation", 1.0),
+}
+
+# colonna -> [(nomi possibili del campo protobuf, fattore)], come in
+# mesh_reports.try_set_env_fields: i nomi cambiano tra versioni
+TELEMETRY_FIELDS = {
+    "temperature": [(["temperature", "temperature_c", "temp_c", "temp"], 1.0)],
+    "humidity": [(["relative_humidity", "humidity", "humidity_pct"], 1.0)],
+    "pressure": [(["barometric_pressure", "pressure_hpa", "pressure"], 1.0)],
+    "windspeed": [(["wind_speed_kmh", "windspeed", "windspeed_kmh"], 1.0),
+                  (["wind_speed", "windSpeed", "wind_speed_m_s", "wind_speed_ms", "wind_m_s",
+                    "windspeed_mps", "windSpeedMps"], 3.6)],
+    "winddir": [(["wind_direction", "windDirection", "wind_direction_deg", "wind_direction_degrees",
+                  "winddir", "wind_dir", "wind_bearing", "wind_bearing_deg"], 1.0)],
+    "hourlyrainin": [(["rainfall_1h"], 1 / 25.4)],
+    "last24hrainin": [(["rainfall_24h"], 1 / 25.4)],
+}
+
+
+class TelemetryDecoder:
+    """
+    Decoder TELEMETRY_APP: importa i protobuf una volta e, per ogni tipo di
+    sotto-messaggio incontrato, calcola una sola volta il piano
+    [(campo, colonna, fattore, ha_presenza)]; poi ogni pacchetto e' solo
+    FromString + getattr.
+    """
+
+    def __init__(self):
+        self._telemetry = None
+        self._failed = False
+        self._plans = {}
+
+    def _load(self):
+        if self._telemetry is None and not self._failed:
+            try:
+                from meshtastic_imports import load_meshtastic_protos
+                _, telemetry_pb2 = load_meshtastic_protos()
+                self._telemetry = telemetry_pb2.Telemetry
+            except ImportError as e:
+                self._failed = True
+                logger.warning(f"TELEMETRY_APP not decodable (protobufs missing): {e}")
+        return self._telemetry
+
+    def _plan(self, sub):
+        desc = sub.DESCRIPTOR
+        plan = self._plans.get(desc.full_name)
+        if plan is None:
+            plan = []
+            for col, groups in TELEMETRY_FIELDS.items():
+                for names, factor in groups:
+                    fd = next((desc.fields_by_name[n] for n in names if n in desc.fields_by_name), None)
+                    if fd is not None:
+                        plan.append((fd.name, col, factor, getattr(fd, "has_presence", False)))
+                        break
+            self._plans[desc.full_name] = plan
+        return plan
+
+    def _submessage(self, t):
+        try:
+            name = t.WhichOneof("variant")
+        except ValueError:
+            name = None
+        if name is None:
+            # protobuf senza oneof "variant": primo sotto-messaggio "environment-like" presente
+            for fd in t.DESCRIPTOR.fields:
+                n = fd.name.lower()
+                if fd.message_type is not None and ("env" in n or "sensor" in n) and t.HasField(fd.name):
+                    name = fd.name
+                    break
+        return getattr(t, name) if name else None
+
+    def decode(self, payload):
+        """bytes -> ({colonna: valore}, ts del mittente o None); None se non e' meteo."""
+        Telemetry = self._load()
+        if Telemetry is None:
+            return None
+        t = Telemetry.FromString(payload)
+        sub = self._submessage(t)
+        if sub is None:
+            return None
+        plan = self._plan(sub)
+        if not plan:
+            return None
+        values = {}
+        for name, col, factor, presence in plan:
+            if presence and not sub.HasField(name):
+                continue
+            values[col] = round(float(getattr(sub, name)) * factor, 4)
+        sender_ts = int(getattr(t, "time", 0)) or None
+        return values, sender_ts
+
+
+def decode_private(payload):
+    """JSON compatto di mesh_reports.build_custom_weather_payload -> {colonna: valore}; None se non e' nostro."""
+    try:
+        d = json.loads(bytes(payload).decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(d, dict):
+        return None
+    values = {}
+    for key, (col, factor) in PRIVATE_KEYS.items():
+        v = d.get(key)
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            values[col] = round(float(v) * factor, 4)
+    return values or None
+
+
+# =========================
+# COLLECTOR
+# =========================
+_UPSERT_SQL = (
+    f"INSERT INTO readings (ts, location, {', '.join(COLUMNS)}) "
+    f"VALUES ({','.join('?' * (len(COLUMNS) + 2))}) "
+    f"ON CONFLICT(location, ts) DO UPDATE SET "
+    + ", ".join(f"{c} = COALESCE(excluded.{c}, {c})" for c in COLUMNS)
+)
+
+
+def _node_id(packet):
+    node = packet.get("fromId")
+    if node:
+        return node
+    return f"!{int(packet.get('from', 0)) & 0xFFFFFFFF:08x}"
+
+
+def _portnum(packet):
+    p = (packet.get("decoded") or {}).get("portnum")
+    return p if isinstance(p, str) else None
+
+
+class Collector:
+    """
+    on_receive(packet, interface) e' la callback pubsub; start()/stop()
+    gestiscono il thread writer. `recorder` (file aperto) riceve una riga
+    JSON per pacchetto accettato, nello stesso formato letto da ReplayInterface.
+    """
+
+    def __init__(self, db_path=DB_PATH, recorder=None):
+        self.db_path = db_path
+        self.recorder = recorder
+        self.telemetry = TelemetryDecoder()
+        self._q = queue.SimpleQueue()
+        self._seen = OrderedDict()
+        self._seen_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"received": 0, "duplicates": 0, "ignored": 0, "undecodable": 0, "rows": 0, "batches": 0}
+
+    # -------- thread di ricezione --------
+    def on_receive(self, packet, interface=None):
+        port = _portnum(packet)
+        if port not in ("TELEMETRY_APP", "PRIVATE_APP", "TEXT_MESSAGE_APP"):
+            self.stats["ignored"] += 1
+            return
+        # senza id (0/None) non c'e' modo di riconoscere un duplicato
+        if packet.get("id"):
+            key = (packet.get("from"), packet.get("id"))
+            with self._seen_lock:
+                if key in self._seen:
+                    self._seen.move_to_end(key)
+                    self.stats["duplicates"] += 1
+                    return
+                self._seen[key] = True
+                if len(self._seen) > DEDUP_SIZE:
+                    self._seen.popitem(last=False)
+        self.stats["received"] += 1
+        rx = int(packet.get("rxTime") or time.time())
+        self._q.put((_node_id(packet), rx, port, bytes(packet["decoded"].get("payload") or b"")))
+        if self.recorder is not None:
+            self._record(packet, port, rx)
+
+    def _record(self, packet, port, rx):
+        self.recorder.write(json.dumps({
+            "from": packet.get("from"), "fromId": packet.get("fromId"), "id": packet.get("id"),
+            "rxTime": rx, "portnum": port,
+            "payload": base64.b64encode(bytes(packet["decoded"].get("payload") or b"")).decode("ascii"),
+        }, separators=(",", ":")) + "\n")
+        self.recorder.flush()
+
+    # -------- writer --------
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="mesh-writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=10.0):
+        """Svuota la coda e ferma il writer."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _decode(self, node, rx, port, payload):
+        sender_ts = None
+        if port == "TELEMETRY_APP":
+            res = self.telemetry.decode(payload)
+            if res is None:
+                return None
+            values, sender_ts = res
+        else:
+            # TEXT_MESSAGE_APP: il sender ci ripiega se PRIVATE_APP non esiste
+            values = decode_private(payload)
+            if values is None:
+                return None
+        ts = sender_ts if sender_ts and abs(sender_ts - rx) < 3600 else rx
+        return (ts // TS_QUANTUM) * TS_QUANTUM, values
+
+    def _take_batch(self):
+        try:
+            first = self._q.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + BATCH_WAIT_SEC
+        while len(batch) < BATCH_ROWS:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                batch.append(self._q.get(timeout=left))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, conn, batch):
+        # stesso nodo e slot nello stesso blocco: una riga sola
+        rows = {}
+        for item in batch:
+            try:
+                res = self._decode(*item)
+            except Exception as e:
+                logger.warning(f"Decode failed from {item[0]} ({item[2]}): {e}")
+                res = None
+            if res is None:
+                self.stats["undecodable"] += 1
+                continue
+            ts, values = res
+            rows.setdefault((item[0], ts), {}).update(values)
+        if not rows:
+            return
+        conn.executemany(_UPSERT_SQL, [
+            (ts, node, *(v.get(c) for c in COLUMNS)) for (node, ts), v in rows.items()
+        ])
+        conn.commit()
+        self.stats["rows"] += len(rows)
+        self.stats["batches"] += 1
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        last_stats = time.monotonic()
+        try:
+            while True:
+                batch = self._take_batch()
+                if not batch and self._stop.is_set():
+                    return
+                if batch:
+                    try:
+                        self._write(conn, batch)
+                    except sqlite3.Error as e:
+                        # DB occupato/bloccato: rimette in coda e riprova
+                        logger.error(f"DB write failed ({len(batch)} packets requeued): {e}")
+                        conn.rollback()
+                        for item in batch:
+                            self._q.put(item)
+                        time.sleep(1.0)
+                    backlog = self._q.qsize()
+                    if backlog > QUEUE_WARN:
+                        logger.warning(f"Writer behind: {backlog} packets queued")
+                if time.monotonic() - last_stats >= STATS_EVERY_SEC:
+                    last_stats = time.monotonic()
+                    logger.info(f"Stats: {self.stats}")
+        finally:
+            conn.close()
+
+
+def check_db(db_path):
+    """Il DB lo crea il server: serve `readings` con il vincolo unico (location, ts)."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        ok = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='index' AND name='ux_readings_location_ts'"
+        ).fetchone()
+    finally:
+        conn.close()
+    if not ok:
+        raise RuntimeError(f"{db_path}: readings/ux_readings_location_ts missing, start python/server.py once")
+
+
+# =========================
+# INTERFACES
+# =========================
+class ReplayInterface:
+    """
+    Interfaccia finta: rilegge una cattura JSONL (--record) e consegna i
+    pacchetti alla callback come farebbe pubsub. speed=0 -> senza pause,
+    speed=1 -> tempi originali.
+    """
+
+    def __init__(self, path, speed=0.0):
+        self.path = path
+        self.speed = speed
+
+    def packets(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                p = json.loads(line)
+                yield {
+                    "from": p.get("from"), "fromId": p.get("fromId"), "id": p.get("id"),
+                    "rxTime": p.get("rxTime"),
+                    "decoded": {"portnum": p.get("portnum"), "payload": base64.b64decode(p.get("payload") or "")},
+                }
+
+    def run(self, callback):
+        prev = None
+        n = 0
+        for packet in self.packets():
+            if self.speed and prev is not None and packet["rxTime"]:
+                time.sleep(max(0.0, (packet["rxTime"] - prev) / self.speed))
+            prev = packet["rxTime"] or prev
+            callback(packet, self)
+            n += 1
+        return n
+
+    def close(self):
+        pass
+
+
+def open_interface(args):
+    if args.tcp:
+        import meshtastic.tcp_interface
+        return meshtastic.tcp_interface.TCPInterface(hostname=args.tcp)
+    import meshtastic.serial_interface
+    return meshtastic.serial_interface.SerialInterface(devPath=args.port)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Raccoglie le letture meteo delle stazioni remote dalla mesh Meshtastic")
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--port", default=SERIAL_PORT, help=f"porta seriale del nodo (default {SERIAL_PORT})")
+    ap.add_argument("--tcp", help="host del nodo via rete invece della seriale")
+    ap.add_argument("--record", help="salva i pacchetti accettati in questo file JSONL")
+    ap.add_argument("--replay", help="riproduce una cattura JSONL invece di usare la radio")
+    ap.add_argument("--speed", type=float, default=0.0, help="replay: 0 = massima velocita', 1 = tempo reale")
+    args = ap.parse_args(argv)
+    if not (args.tcp or args.replay) and args.port in SENDER_PORTS:
+        ap.error(f"{args.port} is used by the senders (cron): use a separate radio (--port) or a network node (--tcp)")
+
+    check_db(args.db)
+    recorder = open(args.record, "a", encoding="utf-8") if args.record else None
+    collector = Collector(args.db, recorder).start()
+    try:
+        if args.replay:
+            n = ReplayInterface(args.replay, args.speed).run(collector.on_receive)
+            logger.info(f"Replayed {n} packets from {args.replay}")
+            return
+        from pubsub import pub
+        pub.subscribe(collector.on_receive, "meshtastic.receive")
+        iface = open_interface(args)
+        logger.info("Listening for mesh packets (Ctrl-C to stop)")
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            iface.close()
+    finally:
+        collector.stop()
+        logger.info(f"Stats: {collector.stats}")
+        if recorder is not None:
+            recorder.close()
+
+
+if __name__ == "__main__":
+    main()
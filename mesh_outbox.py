@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# mesh_outbox.py
+# Outbox persistente (SQLite, data/mesh_outbox.db) per gli invii Meshtastic:
+# se la radio e' occupata, scollegata o si sta riavviando il messaggio resta
+# in coda invece di andare perso.
+#  - priorita' (piu' alta = prima) e scadenza per messaggio
+#  - collapse_key: un nuovo report per lo stesso target e chiave sostituisce
+#    quelli ancora in coda (il meteo vecchio non serve)
+#  - i report ("report:*") scadono dopo REPORT_TTL_SEC; un report testo
+#    inviato in ritardo porta l'eta' sulla prima riga ("[+25m]")
+#  - drain con backoff esponenziale per messaggio
+#  - con want_ack registra l'esito (ack / nak / timeout) dal nodo
+#
+#   ./mesh_outbox.py --drain            # un passaggio (cron)
+#   ./mesh_outbox.py --drain --loop 60  # servizio: un passaggio al minuto
+#   ./mesh_outbox.py --status [--json]  # profondita' coda ed eta' dei messaggi
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+# =========================
+# CONFIG
+# =========================
+LOGFILE = "./mesh_outbox.log"
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+OUTBOX_DB = os.path.join(BASE_DIR, "data", "mesh_outbox.db")
+
+DEFAULT_TTL_SEC = 3 * 3600     # messaggi senza collapse_key "report:*"
+REPORT_TTL_SEC = 30 * 60       # un report meteo piu' vecchio non ha senso
+DELAY_MARK_SEC = 5 * 60        # report testo in coda da piu' tempo: marcati con l'eta'
+BACKOFF_MIN_SEC = 30
+BACKOFF_MAX_SEC = 30 * 60
+ACK_WAIT_SEC = 30              # attesa degli ack prima di chiudere la radio
+KEEP_DONE_DAYS = 7             # righe concluse conservate per --status
+
+PRIORITY_REPORT = 0
+PRIORITY_ALERT = 10
+
+# =========================
+# LOGGING
+# =========================
+logger = logging.getLogger("mesh_outbox")
+logger.setLevel(logging.INFO)
+
+handler = RotatingFileHandler(LOGFILE, maxBytes=1_000_000, backupCount=5)
+formatter = logging.Formatter("[%(asctime)s] %(levelname)s - %(message)s")
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+console = logging.StreamHandler()
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+# =========================
+# DB
+# =========================
+# status: pending -> sent | failed (scaduto dopo errori) | expired | superseded
+# ack:    NULL (non richiesto) | waiting | ack | nak | timeout
+def connect(path=OUTBOX_DB):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY,
+        created INTEGER NOT NULL,
+        target TEXT NOT NULL,
+        interface TEXT NOT NULL,        -- serial | tcp
+        device TEXT NOT NULL,
+        channel INTEGER NOT NULL,
+        portnum INTEGER,                -- NULL = testo (sendText)
+        payload BLOB NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0,
+        expires INTEGER NOT NULL,
+        collapse_key TEXT,
+        want_ack INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_try INTEGER NOT NULL,
+        last_error TEXT,
+        sent_ts INTEGER,
+        packet_id INTEGER,
+        ack TEXT,
+        ack_ts INTEGER
+    );
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(next_try) WHERE status = 'pending';")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_collapse ON outbox(target, collapse_key) WHERE status = 'pending';")
+    conn.commit()
+    return conn
+
+
+def enqueue(conn, target, portnum, payload, priority=PRIORITY_REPORT, ttl=None,
+            collapse_key=None, want_ack=False, now=None):
+    """
+    Accoda un messaggio per `target` (dict name/interface/device/channel come
+    in send_fanout). `payload` str per il testo, bytes con `portnum`.
+    Con collapse_key i messaggi in coda con la stessa chiave per lo stesso
+    target diventano 'superseded'. Senza `ttl`: REPORT_TTL_SEC per i report
+    ("report:*"), DEFAULT_TTL_SEC per il resto. Ritorna l'id.
+    """
+    now = int(now or time.time())
+    if ttl is None:
+        ttl = REPORT_TTL_SEC if _is_report(collapse_key) else DEFAULT_TTL_SEC
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    with conn:
+        if collapse_key is not None:
+            supersede(conn, target["name"], collapse_key)
+        cur = conn.execute("""
+          INSERT INTO outbox (created, target, interface, device, channel, portnum, payload,
+                              priority, expires, collapse_key, want_ack, next_try)
+          VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+        """, (now, target["name"], target.get("interface", "serial"), target["device"],
+              int(target.get("channel", 0)), portnum, payload, int(priority), now + int(ttl),
+              collapse_key, 1 if want_ack else 0, now))
+    return cur.lastrowid
+
+
+def _is_report(collapse_key):
+    return collapse_key is not None and collapse_key.startswith("report:")
+
+
+def _mark_delayed(text, age):
+    # l'eta' in coda sulla prima riga: chi legge sa che il meteo non e' di adesso
+    first, sep, rest = text.partition("\n")
+    return f"{first} [+{age // 60}m]{sep}{rest}"
+
+
+def supersede(conn, target_name, collapse_key):
+    """Scarta i messaggi in coda con questa chiave (es. dopo un invio diretto riuscito)."""
+    return conn.execute("""
+      UPDATE outbox SET status = 'superseded'
+      WHERE status = 'pending' AND target = ? AND collapse_key = ?
+    """, (target_name, collapse_key)).rowcount
+
+
+def after_direct_send(target, sent_keys, unsent, want_ack=False, path=OUTBOX_DB):
+    """
+    Per gli script che inviano direttamente: i report consegnati (`sent_keys`,
+    collapse_key) scartano quelli vecchi in coda, quelli non consegnati
+    (`unsent` = [(collapse_key, portnum, payload)]) vengono accodati.
+    Ritorna il numero di messaggi accodati.
+    """
+    conn = connect(path)
+    try:
+        with conn:
+            for key in sent_keys:
+                supersede(conn, target["name"], key)
+        for key, portnum, payload in unsent:
+            enqueue(conn, target, portnum, payload, collapse_key=key, want_ack=want_ack)
+    finally:
+        conn.close()
+    return len(unsent)
+
+
+def target_name(interface, device, channel):
+    # stesso nome di default di send_fanout.load_targets
+    return f"{interface}:{device}:ch{channel}"
+
+
+def _backoff(attempts):
+    return min(BACKOFF_MAX_SEC, BACKOFF_MIN_SEC * 2 ** max(0, attempts - 1))
+
+
+def _fail(conn, row, error, now):
+    attempts = row["attempts"] + 1
+    conn.execute("""
+      UPDATE outbox SET attempts = ?, next_try = ?, last_error = ? WHERE id = ?
+    """, (attempts, now + _backoff(attempts), str(error)[:500], row["id"]))
+
+
+# =========================
+# DRAIN
+# =========================
+def _ack_callback(acks, lock, msg_id):
+    # gira nel thread della libreria: niente SQLite qui, solo il risultato
+    def cb(packet):
+        decoded = packet.get("decoded") or {}
+        reason = (decoded.get("routing") or {}).get("errorReason", "NONE")
+        with lock:
+            acks[msg_id] = ("ack" if reason == "NONE" else "nak", reason)
+    return cb
+
+
+def drain(conn, opener=None, now=None, ack_wait=ACK_WAIT_SEC):
+    """
+    Un passaggio: scade/espelle, poi invia i messaggi dovuti raggruppati per
+    radio (una connessione ciascuna), in ordine di priorita'. Se una radio
+    fallisce i suoi messaggi restanti aspettano il prossimo tentativo.
+    Ritorna {"sent": n, "failed": n, "expired": n}.
+    """
+    if opener is None:
+        from mesh_reports import open_interface as opener
+    from mesh_reports import send_payload
+
+    now = int(now or time.time())
+    stats = {"sent": 0, "failed": 0, "expired": 0}
+    with conn:
+        stats["expired"] = conn.execute("""
+          UPDATE outbox SET status = CASE WHEN attempts > 0 THEN 'failed' ELSE 'expired' END
+          WHERE status = 'pending' AND expires <= ?
+        """, (now,)).rowcount
+        conn.execute("""
+          DELETE FROM outbox WHERE status != 'pending' AND created < ?
+        """, (now - KEEP_DONE_DAYS * 86400,))
+
+    due = conn.execute("""
+      SELECT * FROM outbox WHERE status = 'pending' AND next_try <= ?
+      ORDER BY priority DESC, created ASC, id ASC
+    """, (now,)).fetchall()
+    by_device = {}
+    for row in due:
+        by_device.setdefault((row["interface"], row["device"]), []).append(row)
+
+    for (kind, device), rows in by_device.items():
+        try:
+            iface = opener(kind, device)
+        except Exception as e:
+            logger.warning(f"[{device}] connect failed: {e}; {len(rows)} message(s) deferred")
+            with conn:
+                for row in rows:
+                    _fail(conn, row, f"connect: {e}", now)
+            stats["failed"] += len(rows)
+            continue
+
+        acks, lock, waiting = {}, threading.Lock(), []
+        try:
+            for row in rows:
+                data = bytes(row["payload"])
+                if row["portnum"] is None:
+                    data = data.decode("utf-8")
+                    age = now - row["created"]
+                    if _is_report(row["collapse_key"]) and age >= DELAY_MARK_SEC:
+                        data = _mark_delayed(data, age)
+                cb = _ack_callback(acks, lock, row["id"]) if row["want_ack"] else None
+                try:
+                    pkt = send_payload(iface, row["portnum"], data, row["channel"],
+                                       want_ack=bool(row["want_ack"]), on_response=cb)
+                except Exception as e:
+                    logger.warning(f"[{row['target']}] send #{row['id']} failed: {e}")
+                    with conn:
+                        _fail(conn, row, e, now)
+                    stats["failed"] += 1
+                    break   # radio in errore: il resto al prossimo passaggio
+                with conn:
+                    conn.execute("""
+                      UPDATE outbox SET status = 'sent', sent_ts = ?, attempts = attempts + 1,
+                                        packet_id = ?, ack = ?
+                      WHERE id = ?
+                    """, (now, getattr(pkt, "id", None),
+                          "waiting" if row["want_ack"] else None, row["id"]))
+                stats["sent"] += 1
+                if row["want_ack"]:
+                    waiting.append(row)
+                logger.info(f"[{row['target']}] sent #{row['id']} (ch {row['channel']}, "
+                            f"{len(row['payload'])} B, queued {now - row['created']}s)")
+
+            # ack: la radio deve restare aperta finche' arrivano
+            deadline = time.monotonic() + ack_wait
+            while waiting and time.monotonic() < deadline:
+                with lock:
+                    if all(r["id"] in acks for r in waiting):
+                        break
+                time.sleep(0.2)
+            _record_acks(conn, waiting, acks, lock, now)
+        finally:
+            try:
+                iface.close()
+            except Exception:
+                pass
+    return stats
+
+
+def _record_acks(conn, waiting, acks, lock, now):
+    with lock:
+        got = dict(acks)
+    with conn:
+        for row in waiting:
+            res, reason = got.get(row["id"], ("timeout", None))
+            if res == "nak":
+                # consegna fallita: torna in coda con backoff (se non scaduto)
+                conn.execute("""
+                  UPDATE outbox SET status = 'pending', ack = 'nak', ack_ts = ?, last_error = ?,
+                                    next_try = ?
+                  WHERE id = ?
+                """, (now, f"nak: {reason}", now + _backoff(row["attempts"] + 1), row["id"]))
+                logger.warning(f"[{row['target']}] #{row['id']} NAK ({reason}), requeued")
+            else:
+                conn.execute("UPDATE outbox SET ack = ?, ack_ts = ? WHERE id = ?",
+                             (res, now if res == "ack" else None, row["id"]))
+
+
+# =========================
+# STATUS
+# =========================
+def status(conn, now=None):
+    """Profondita' per stato/target ed eta' dei messaggi in coda."""
+    now = int(now or time.time())
+    by_status = {r["status"]: r["n"] for r in conn.execute(
+        "SELECT status, COUNT(*) AS n FROM outbox GROUP BY status")}
+    pending = [{
+        "target": r["target"], "depth": r["n"],
+        "oldest_age_sec": now - r["oldest"], "newest_age_sec": now - r["newest"],
+        "max_attempts": r["max_attempts"], "next_try_in_sec": max(0, r["next_try"] - now),
+        "last_error": r["last_error"],
+    } for r in conn.execute("""
+      SELECT target, COUNT(*) AS n, MIN(created) AS oldest, MAX(created) AS newest,
+             MAX(attempts) AS max_attempts, MIN(next_try) AS next_try, MAX(last_error) AS last_error
+      FROM outbox WHERE status = 'pending' GROUP BY target ORDER BY target
+    """)]
+    acks = {r["ack"]: r["n"] for r in conn.execute(
+        "SELECT ack, COUNT(*) AS n FROM outbox WHERE ack IS NOT NULL GROUP BY ack")}
+    return {"by_status": by_status, "pending": pending, "acks": acks}
+
+
+def _print_status(st):
+    print("status: " + (", ".join(f"{k}={v}" for k, v in sorted(st["by_status"].items())) or "empty"))
+    if st["acks"]:
+        print("acks:   " + ", ".join(f"{k}={v}" for k, v in sorted(st["acks"].items())))
+    for p in st["pending"]:
+        print(f"  {p['target']:<20} depth {p['depth']:>3}  oldest {p['oldest_age_sec']:>6}s  "
+              f"attempts {p['max_attempts']}  next in {p['next_try_in_sec']}s  {p['last_error'] or ''}")
+
+
+# =========================
+# MAIN
+# =========================
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Outbox persistente degli invii Meshtastic")
+    ap.add_argument("--db", default=OUTBOX_DB)
+    ap.add_argument("--drain", action="store_true", help="invia i messaggi dovuti")
+    ap.add_argument("--loop", type=float, metavar="SEC", help="con --drain: ripete ogni SEC secondi")
+    ap.add_argument("--status", action="store_true", help="profondita' ed eta' della coda")
+    ap.add_argument("--json", action="store_true", help="con --status: output JSON")
+    args = ap.parse_args(argv)
+
+    conn = connect(args.db)
+    try:
+        if args.drain:
+            while True:
+                st = drain(conn)
+                if any(st.values()):
+                    logger.info(f"Drain: {st}")
+                if not args.loop:
+                    break
+                time.sleep(args.loop)
+        if args.status or not args.drain:
+            st = status(conn)
+            if args.json:
+                print(json.dumps(st, indent=2))
+            else:
+                _print_status(st)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
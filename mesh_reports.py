@@ -0,0 +1,347 @@
+# mesh_reports.py
+# Costruzione dei report Meshtastic a partire da /api/latest, condivisa da
+# send_meshtastic_once.py, sender_telemetry_once.py, send_fanout.py e
+# mesh_outbox.py (che usano anche open_interface/send_payload).
+# Formati:
+#   text       report testo 4 righe (sendText)
+#   telemetry  protobuf Telemetry con environment metrics (TELEMETRY_APP)
+#   compact    JSON compatto con meteo extra + anemometro (PRIVATE_APP)
+import json
+import logging
+
+import requests
+
+SERVER_API = "http://127.0.0.1:8080/api/latest"
+FORMATS = ("text", "telemetry", "compact")
+
+logger = logging.getLogger("meshtastic_sender")
+
+# =========================
+# UTILS
+# =========================
+def safe_float(val):
+    try:
+        return float(val)
+    except Exception:
+        return 0.0
+
+def safe_int(val):
+    try:
+        return int(round(float(val), 0))
+    except Exception:
+        return 0
+
+def deg_to_cardinal_16(deg):
+    dirs = ["N","NNE","NE","ENE","E","ESE","SE","SSE",
+            "S","SSW","SW","WSW","W","WNW","NW","NNW"]
+    try:
+        return dirs[int((float(deg) + 11.25) / 22.5) % 16]
+    except Exception:
+        return "--"
+
+def fetch_latest(url=SERVER_API):
+    r = requests.get(url, timeout=5)
+    r.raise_for_status()
+    return r.json()
+
+# =========================
+# TEXT
+# =========================
+def build_report(d):
+
+    location = d.get("location", "UNKNOWN")
+    t = d.get("time", "--:--:--")
+
+    temperature = safe_float(d.get("temperature"))
+    humidity = safe_int(d.get("humidity"))
+    windspeed = safe_float(d.get("windspeed"))       # km/h
+    winddir = safe_float(d.get("winddir"))           # deg
+    pressure = safe_float(d.get("pressure"))         # hPa
+
+    solarradiation = safe_float(d.get("solarradiation"))  # W/m²
+    uv = safe_float(d.get("uv"))                           # UV index
+
+    rain_mm = d.get("rain_mm") or {}
+    rainrate = safe_float(rain_mm.get("rainrate"))         # mm/h (già convertito nel server)
+
+    wind_cardinal = deg_to_cardinal_16(winddir)
+
+    # 4 righe
+    report = (
+        f"Map:{location}  {t}\n"
+        f"T: {temperature:.1f}°C  H: {humidity:d}%  P: {pressure:.0f} hPa\n"
+        f"W: {windspeed:.1f} km/h ({wind_cardinal})  R: {rainrate:.2f} mm/h\n"
+        f"SR: {solarradiation:.0f}  W/m² UV: {uv:.1f}"
+    )
+    return report
+
+# =========================
+# TELEMETRY (protobuf)
+# =========================
+def _set_first_field(obj, candidates, value):
+    """
+    Setta il primo campo disponibile in `candidates`.
+    Ritorna True se è riuscito.
+    """
+    for name in candidates:
+        if hasattr(obj, name):
+            try:
+                setattr(obj, name, value)
+                return True
+            except Exception:
+                try:
+                    setattr(obj, name, int(round(float(value), 0)))
+                    return True
+                except Exception:
+                    try:
+                        setattr(obj, name, float(value))
+                        return True
+                    except Exception:
+                        pass
+    return False
+
+def try_set_env_fields(env_obj, d):
+    """
+    Prova a impostare meteo base + anemometro su un oggetto env-like.
+    Tenta alias multipli perché i nomi cambiano tra versioni protobuf.
+    Ritorna True se almeno un campo viene impostato con successo.
+    """
+    ok = False
+
+    # temperatura
+    ok = _set_first_field(
+        env_obj,
+        ["temperature", "temperature_c", "temp_c", "temp"],
+        safe_float(d.get("temperature")),
+    ) or ok
+
+    # umidità
+    ok = _set_first_field(
+        env_obj,
+        ["relative_humidity", "humidity", "humidity_pct"],
+        safe_float(d.get("humidity")),
+    ) or ok
+
+    # pressione
+    ok = _set_first_field(
+        env_obj,
+        ["barometric_pressure", "pressure_hpa", "pressure"],
+        safe_float(d.get("pressure")),
+    ) or ok
+
+    # anemometro: velocità, direzione, raffica
+    windspeed_kmh = safe_float(d.get("windspeed"))
+    windspeed_mps = windspeed_kmh / 3.6
+    windgust_kmh = safe_float(d.get("windgust"))
+    windgust_mps = windgust_kmh / 3.6
+
+    # velocità vento
+    ok = _set_first_field(
+        env_obj,
+        [
+            "wind_speed_kmh", "windspeed", "windspeed_kmh",
+        ],
+        windspeed_kmh,
+    ) or ok
+    ok = _set_first_field(
+        env_obj,
+        [
+            "wind_speed", "windSpeed",
+            "wind_speed_m_s", "wind_speed_ms", "wind_m_s",
+            "windspeed_mps", "windSpeedMps",
+        ],
+        windspeed_mps,
+    ) or ok
+
+    # direzione vento in gradi
+    ok = _set_first_field(
+        env_obj,
+        [
+            "wind_direction", "windDirection",
+            "wind_direction_deg", "wind_direction_degrees",
+            "winddir", "wind_dir",
+            "wind_bearing", "wind_bearing_deg",
+        ],
+        safe_float(d.get("winddir")),
+    ) or ok
+
+    # raffica vento
+    ok = _set_first_field(
+        env_obj,
+        ["wind_gust_kmh", "gust", "gust_kmh"],
+        windgust_kmh,
+    ) or ok
+    ok = _set_first_field(
+        env_obj,
+        [
+            "wind_gust", "windGust",
+            "wind_gust_m_s", "wind_gust_ms",
+            "gust_mps", "gust_m_s",
+        ],
+        windgust_mps,
+    ) or ok
+
+    return ok
+
+def build_telemetry_payload_if_possible(d, telemetry_pb2):
+    """
+    Ritorna bytes protobuf se riesce a trovare un submessage 'environment-like'.
+    Se non possibile, ritorna None.
+    """
+    t = telemetry_pb2.Telemetry()
+
+    # caso classico
+    if hasattr(t, "environment"):
+        try:
+            if try_set_env_fields(t.environment, d):
+                logger.info("Telemetry: using t.environment")
+                return t.SerializeToString()
+        except Exception as e:
+            logger.warning(f"Telemetry: t.environment present but failed: {e}")
+
+    # fallback: cerca altri submessage potenzialmente corretti
+    for attr in dir(t):
+        if attr.startswith("_"):
+            continue
+        name = attr.lower()
+        if ("env" in name) or ("environment" in name) or ("sensor" in name):
+            try:
+                sub = getattr(t, attr)
+                if try_set_env_fields(sub, d):
+                    logger.info(f"Telemetry: using t.{attr}")
+                    return t.SerializeToString()
+            except Exception:
+                pass
+
+    logger.warning("Telemetry: no environment-like fields found; skipping TELEMETRY_APP send")
+    return None
+
+# =========================
+# COMPACT (JSON su PRIVATE_APP)
+# =========================
+def pick_custom_port(portnums_pb2):
+    """
+    Usa PRIVATE_APP se esiste, altrimenti ricade su TEXT_MESSAGE_APP.
+    """
+    if hasattr(portnums_pb2.PortNum, "PRIVATE_APP"):
+        return portnums_pb2.PortNum.PRIVATE_APP, "PRIVATE_APP"
+    return portnums_pb2.PortNum.TEXT_MESSAGE_APP, "TEXT_MESSAGE_APP"
+
+def build_custom_weather_payload(d):
+    """
+    Payload custom (JSON compatto) con meteo extra + anemometro:
+      - rain rate (mm/h)
+      - UV index
+      - solar W/m²
+      - T/H/P + ts
+      - vento (velocità/direzione/raffica)
+    """
+    rainrate = safe_float((d.get("rain_mm") or {}).get("rainrate"))  # mm/h
+    windspeed = safe_float(d.get("windspeed"))                       # km/h
+    winddir = safe_float(d.get("winddir"))                           # deg
+    windgust = safe_float(d.get("windgust"))                         # km/h
+
+    payload = {
+        "rg_mmph": rainrate,
+        "uv": safe_float(d.get("uv")),
+        "sr_wm2": safe_float(d.get("solarradiation")),
+
+        # opzionali utili per debug
+        "t_c": safe_float(d.get("temperature")),
+        "h_pct": safe_float(d.get("humidity")),
+        "p_hpa": safe_float(d.get("pressure")),
+        "ws_kmh": windspeed,
+        "wd_deg": winddir,
+        "wg_kmh": windgust,
+        "ts": d.get("time", "--:--:--"),
+    }
+
+    # JSON compatto
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8"), payload
+
+def build_debug_text(payload_dict):
+    # Debug testo con anemometro
+    return (
+        f"WX | R {payload_dict['rg_mmph']:.2f}mm/h "
+        f"UV {payload_dict['uv']:.1f} "
+        f"SR {payload_dict['sr_wm2']:.0f}W/m² "
+        f"T {payload_dict['t_c']:.1f}C H {payload_dict['h_pct']:.0f}% P {payload_dict['p_hpa']:.0f}hPa "
+        f"W {payload_dict['ws_kmh']:.1f}km/h {payload_dict['wd_deg']:.0f}deg G {payload_dict['wg_kmh']:.1f}km/h"
+    )
+
+# =========================
+# REPORT (costruito una volta, tutti i formati)
+# =========================
+class Reports:
+    """
+    Una lettura di /api/latest -> payload per formato, calcolati alla prima
+    richiesta e poi riusati da tutti i target. Thread-safe in lettura dopo
+    prepare().
+    """
+
+    def __init__(self, d, protos=None):
+        self.d = d
+        self.protos = protos      # (portnums_pb2, telemetry_pb2) o None
+        self._cache = {}
+
+    def prepare(self, formats):
+        for fmt in formats:
+            self.payload(fmt)
+        return self
+
+    def payload(self, fmt):
+        """
+        (portnum, bytes|str) per `fmt`; portnum None = sendText.
+        None se il formato non e' disponibile (es. protobuf senza environment).
+        """
+        if fmt not in self._cache:
+            self._cache[fmt] = self._build(fmt)
+        return self._cache[fmt]
+
+    def _build(self, fmt):
+        if fmt == "text":
+            return None, build_report(self.d)
+        if self.protos is None:
+            raise RuntimeError(f"format {fmt} needs the Meshtastic protobufs")
+        portnums_pb2, telemetry_pb2 = self.protos
+        if fmt == "telemetry":
+            if not hasattr(portnums_pb2.PortNum, "TELEMETRY_APP"):
+                return None
+            data = build_telemetry_payload_if_possible(self.d, telemetry_pb2)
+            return None if data is None else (portnums_pb2.PortNum.TELEMETRY_APP, data)
+        if fmt == "compact":
+            data, _ = build_custom_weather_payload(self.d)
+            return pick_custom_port(portnums_pb2)[0], data
+        raise ValueError(f"unknown format: {fmt}")
+
+
+# =========================
+# INTERFACES
+# =========================
+def open_interface(kind, device):
+    """kind "serial" (device = porta) | "tcp" (device = host)."""
+    if kind == "tcp":
+        import meshtastic.tcp_interface
+        return meshtastic.tcp_interface.TCPInterface(hostname=device)
+    import meshtastic.serial_interface
+    return meshtastic.serial_interface.SerialInterface(devPath=device)
+
+
+def send_payload(iface, portnum, data, channel, want_ack=False, on_response=None):
+    """portnum None = testo (sendText). Ritorna il MeshPacket inviato (ha .id)."""
+    kwargs = {"channelIndex": channel, "wantAck": want_ack}
+    if on_response is not None:
+        kwargs["onResponse"] = on_response
+        # le versioni recenti passano l'ACK a onResponse solo se richiesto
+        kwargs["onResponseAckPermitted"] = True
+    try:
+        if portnum is None:
+            return iface.sendText(data, **kwargs)
+        return iface.sendData(data, portNum=portnum, **kwargs)
+    except TypeError:
+        if "onResponseAckPermitted" not in kwargs:
+            raise
+        del kwargs["onResponseAckPermitted"]
+        if portnum is None:
+            return iface.sendText(data, **kwargs)
+        return iface.sendData(data, portNum=portnum, **kwargs)
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# backfill.py
+# Import massivo di letture con il loro timestamp originale:
+#  - timestamp del gateway (`dateutc` del POST GW1100, usato anche dal server)
+#  - CSV esportati da ecowitt.net / scheda SD della console, oppure CSV con le
+#    chiavi native del gateway (tempf, baromrelin, dailyrainin, dateutc, ...)
+# Le righe vanno in `readings` con INSERT OR IGNORE sotto il vincolo unico
+# (location, ts): reimportare lo stesso file non crea duplicati. Alla fine i
+# giorni toccati di rain_rollup_daily e daily_stats vengono ricalcolati in un
+# solo passaggio.
+#
+#   python3 python/backfill.py export_2025.csv [altri.csv ...] [--station 8FHJVFRR+3W]
+import argparse
+import calendar
+import csv
+import os
+import re
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+import daily_stats
+import fields
+import history_engine
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, "data", "ecowitt.db")
+
+BATCH_ROWS = 50_000
+
+# colonne di `readings` nell'ordine usato per gli insert
+READINGS_COLUMNS = ["ts", "location", *fields.CORE]
+VALUE_COLUMNS = READINGS_COLUMNS[2:]
+RAIN_COLUMNS = list(fields.RAIN)
+
+_INSERT_SQL = (
+    f"INSERT OR IGNORE INTO readings ({', '.join(READINGS_COLUMNS)}) "
+    f"VALUES ({','.join('?' * len(READINGS_COLUMNS))})"
+)
+
+_DAY_SQL = "CAST(strftime('%Y%m%d', ts, 'unixepoch', 'localtime') AS INTEGER)"
+
+
+# =========================
+# SCHEMA
+# =========================
+def ensure_unique_index(conn):
+    """Vincolo (location, ts); i duplicati gia' presenti vengono rimossi una volta."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='index' AND name='ux_readings_location_ts'"
+    ).fetchone()
+    if exists:
+        return
+    conn.execute("""
+      DELETE FROM readings WHERE rowid NOT IN (
+        SELECT MIN(rowid) FROM readings GROUP BY location, ts
+      )
+    """)
+    conn.execute("CREATE UNIQUE INDEX ux_readings_location_ts ON readings(location, ts);")
+    conn.commit()
+
+
+# =========================
+# TIMESTAMPS
+# =========================
+def parse_dateutc(value):
+    """`dateutc` del GW1100 ("2026-10-19 12:34:56", '+' come separatore) -> epoch, o None."""
+    if not value:
+        return None
+    value = str(value).strip().replace("+", " ").replace("%20", " ").replace("%3A", ":")
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
+        try:
+            return calendar.timegm(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    return None
+
+
+_TS_RE = re.compile(r"^\s*(\d{4})[-/](\d{1,2})[-/](\d{1,2})[ T](\d{1,2}):(\d{2})(?::(\d{2}))?")
+
+
+class _TimeParser:
+    """
+    Parser veloce per "YYYY-MM-DD HH:MM[:SS]" (anche con '/'): mktime/timegm
+    una volta per ora, poi solo somme. Corretto anche nei giorni di cambio ora.
+    """
+    def __init__(self, utc=False):
+        self.utc = utc
+        self._hours = {}
+
+    def __call__(self, value):
+        m = _TS_RE.match(value)
+        if not m:
+            try:
+                dt = datetime.fromisoformat(value.strip())
+            except ValueError:
+                return None
+            return int(dt.timestamp()) if not self.utc else calendar.timegm(dt.timetuple())
+        y, mo, d, h, mi, s = m.groups()
+        key = (y, mo, d, h)
+        base = self._hours.get(key)
+        if base is None:
+            tt = (int(y), int(mo), int(d), int(h), 0, 0, 0, 0, -1)
+            base = calendar.timegm(tt) if self.utc else int(time.mktime(tt))
+            self._hours[key] = base
+        return base + int(mi) * 60 + int(s or 0)
+
+
+# =========================
+# GATEWAY FORM
+# =========================
+def reading_from_gateway(form):
+    """Campi del POST GW1100 -> dict nelle unita' di `readings` (°C, km/h, hPa, pollici pioggia)."""
+    return fields.parse(form)[0]
+
+
+# =========================
+# CSV
+# =========================
+# intestazione normalizzata (minuscolo, senza spazi/unita') -> colonna readings
+_HEADER_MAP = {
+    "temperature": "temperature", "outdoortemperature": "temperature", "outtemp": "temperature",
+    "temp": "temperature", "tempf": "temperature",
+    "humidity": "humidity", "outdoorhumidity": "humidity", "outhumidity": "humidity",
+    "wind": "windspeed", "windspeed": "windspeed", "windspeedmph": "windspeed",
+    "winddirection": "winddir", "winddir": "winddir",
+    "relpressure": "pressure", "relativepressure": "pressure", "pressure": "pressure",
+    "baromrelin": "pressure",
+    "solarrad": "solarradiation", "solarradiation": "solarradiation", "solar": "solarradiation",
+    "uvindex": "uv", "uv": "uv", "uvi": "uv",
+    "rainrate": "rainratein", "rainratein": "rainratein",
+    "eventrain": "eventrainin", "eventrainin": "eventrainin",
+    "hourlyrain": "hourlyrainin", "hourlyrainin": "hourlyrainin",
+    "24hoursrain": "last24hrainin", "last24hrain": "last24hrainin", "last24hrainin": "last24hrainin",
+    "dailyrain": "dailyrainin", "dailyrainin": "dailyrainin",
+    "weeklyrain": "weeklyrainin", "weeklyrainin": "weeklyrainin",
+    "monthlyrain": "monthlyrainin", "monthlyrainin": "monthlyrainin",
+    "yearlyrain": "yearlyrainin", "yearlyrainin": "yearlyrainin",
+}
+_TIME_HEADERS = {"time", "date", "datetime", "timestamp", "localtime"}
+_UTC_HEADERS = {"dateutc", "timeutc"}
+
+# unita' implicite delle chiavi native del gateway
+_NATIVE_UNITS = {
+    "tempf": "f", "windspeedmph": "mph", "baromrelin": "inhg",
+    "rainratein": "in", "eventrainin": "in", "hourlyrainin": "in", "last24hrainin": "in",
+    "dailyrainin": "in", "weeklyrainin": "in", "monthlyrainin": "in", "yearlyrainin": "in",
+}
+
+# (colonna, unita') -> fattore/funzione verso le unita' di readings
+_TEMP = {"c": None, "f": lambda v: (v - 32.0) * 5.0 / 9.0}
+_WIND = {"km/h": None, "kmh": None, "mph": 1.60934, "m/s": 3.6, "ms": 3.6, "knots": 1.852, "kn": 1.852}
+_PRESS = {"hpa": None, "mbar": None, "inhg": 33.8639, "mmhg": 1.33322}
+_RAIN = {"in": None, "in/hr": None, "in/h": None, "mm": 1 / 25.4, "mm/hr": 1 / 25.4, "mm/h": 1 / 25.4}
+
+
+def _norm_header(h):
+    h = h.strip().lower().replace("﻿", "")
+    unit = ""
+    m = re.search(r"\(([^)]*)\)", h)
+    if m:
+        unit = m.group(1).strip().replace("℃", "c").replace("℉", "f").replace("°", "").replace(" ", "")
+        h = h[:m.start()]
+    return re.sub(r"[\s_\-]+", "", h), unit
+
+
+def _converter(col, unit):
+    if col == "temperature":
+        conv = _TEMP.get(unit or "c", None)
+    elif col == "windspeed":
+        conv = _WIND.get(unit or "km/h", None)
+    elif col == "pressure":
+        conv = _PRESS.get(unit or "hpa", None)
+    elif col.endswith("rainin"):
+        conv = _RAIN.get(unit or "mm", None)
+    else:
+        conv = None
+    if conv is None or callable(conv):
+        return conv
+    return lambda v, k=conv: v * k
+
+
+def compile_header(header):
+    """
+    Intestazione CSV -> (indice colonna tempo, utc?, [(indice, posizione in VALUE_COLUMNS, conv)]).
+    Fatto una volta per file: il loop sulle righe fa solo lookup per indice.
+    """
+    time_idx, utc, fields = None, False, []
+    seen = set()
+    for i, raw in enumerate(header):
+        name, unit = _norm_header(raw)
+        if name in _UTC_HEADERS and time_idx is None:
+            time_idx, utc = i, True
+            continue
+        if name in _TIME_HEADERS and time_idx is None:
+            time_idx = i
+            continue
+        col = _HEADER_MAP.get(name)
+        if col is None or col in seen:
+            continue
+        seen.add(col)
+        fields.append((i, VALUE_COLUMNS.index(col), _converter(col, unit or _NATIVE_UNITS.get(name, ""))))
+    if time_idx is None:
+        raise ValueError("CSV senza colonna tempo (Time / dateutc)")
+    if not fields:
+        raise ValueError("CSV senza colonne riconosciute")
+    return time_idx, utc, fields
+
+
+def iter_csv_rows(path, station, utc=None):
+    """Genera tuple pronte per READINGS_COLUMNS da un CSV Ecowitt."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(f, dialect)
+        time_idx, is_utc, fields = compile_header(next(reader))
+        parse_ts = _TimeParser(utc=is_utc if utc is None else utc)
+        width = len(VALUE_COLUMNS)
+        for row in reader:
+            if len(row) <= time_idx:
+                continue
+            ts = parse_ts(row[time_idx])
+            if ts is None:
+                continue
+            vals = [None] * width
+            for i, pos, conv in fields:
+                try:
+                    v = float(row[i])
+                except (IndexError, ValueError):
+                    continue   # "--", vuoto
+                vals[pos] = conv(v) if conv else v
+            yield (ts, station, *vals)
+
+
+# =========================
+# INSERT + ROLLUP
+# =========================
+def insert_rows(conn, rows, batch_rows=BATCH_ROWS):
+    """
+    executemany a blocchi in un'unica transazione. Ritorna
+    (righe lette, righe inserite, ts minimo, ts massimo): il range e' quello
+    delle righe effettivamente inserite (None, None se nessuna).
+    """
+    seen = 0
+    before = conn.total_changes
+    rev = history_engine.revision(conn)
+    batch = []
+    conn.execute("BEGIN")
+    try:
+        for r in rows:
+            batch.append(r)
+            if len(batch) >= batch_rows:
+                conn.executemany(_INSERT_SQL, batch)
+                seen += len(batch)
+                batch = []
+        if batch:
+            conn.executemany(_INSERT_SQL, batch)
+            seen += len(batch)
+        # le righe nuove sono quelle oltre la revisione di partenza (le
+        # ignorate non consumano rowid): un range sul rowid, niente scansione
+        ts_min, ts_max = conn.execute("SELECT MIN(ts), MAX(ts) FROM readings WHERE rowid > ?",
+                                      (rev,)).fetchone()
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    inserted = conn.total_changes - before
+    return seen, inserted, ts_min, ts_max
+
+
+def _day_bounds(ts_min, ts_max):
+    lt = time.localtime(ts_min)
+    start = int(time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, 0, 0, 0, 0, 0, -1)))
+    lt = time.localtime(ts_max)
+    end = int(time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday + 1, 0, 0, 0, 0, 0, -1))) - 1
+    return start, end
+
+
+def rebuild_rollups(conn, station, ts_min, ts_max):
+    """Ricalcola rain_rollup_daily e daily_stats per i giorni interi coperti da [ts_min, ts_max]."""
+    start, end = _day_bounds(ts_min, ts_max)
+    # righe sparse del coalescing riempite in avanti (solo se ce ne sono):
+    # l'ultima riga del giorno ha per ogni contatore l'ultimo valore non NULL
+    where, params = "ts BETWEEN ? AND ? AND location = ?", [start, end, station]
+    src = f"readings WHERE {where}"
+    if history_engine.has_sparse(conn, where, params):
+        seeds = history_engine.seed_values(conn, RAIN_COLUMNS, start, location=station)
+        src, params = history_engine.filled_readings(RAIN_COLUMNS, where, params, seeds)
+        src = f"({src})"
+    # colonne "bare" con MAX(ts): SQLite prende i valori dell'ultima lettura del giorno
+    conn.execute(f"""
+      INSERT OR REPLACE INTO rain_rollup_daily
+        (location, day, ts, rainrate_mm, event_mm, hourly_mm, last24h_mm, daily_mm, weekly_mm, monthly_mm, yearly_mm)
+      SELECT location, {_DAY_SQL} AS d, MAX(ts),
+        rainratein * 25.4, eventrainin * 25.4, hourlyrainin * 25.4, last24hrainin * 25.4,
+        dailyrainin * 25.4, weeklyrainin * 25.4, monthlyrainin * 25.4, yearlyrainin * 25.4
+      FROM {src}
+      GROUP BY d
+    """, params)
+    daily_stats.rebuild(conn, start, end, location=station)
+    conn.commit()
+
+
+# =========================
+# CLI
+# =========================
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Backfill di letture Ecowitt da CSV con timestamp originali")
+    ap.add_argument("files", nargs="+", help="CSV ecowitt.net / SD card / chiavi gateway")
+    ap.add_argument("--db", default=DEFAULT_DB_PATH, help=f"database SQLite (default {DEFAULT_DB_PATH})")
+    ap.add_argument("--station", help="location delle righe (default: quella dell'ultima lettura nel DB)")
+    ap.add_argument("--utc", action="store_true", help="la colonna Time e' in UTC (default: ora locale)")
+    args = ap.parse_args(argv)
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    conn.isolation_level = None   # transazioni esplicite in insert_rows
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name='readings'").fetchone() is None:
+        sys.exit(f"{args.db}: tabella readings assente, avviare prima il server")
+    if "location" not in [r[1] for r in conn.execute("PRAGMA table_info(rain_rollup_daily)")]:
+        sys.exit(f"{args.db}: rollup senza stazione (schema precedente), avviare prima il server")
+    ensure_unique_index(conn)
+    history_engine.ensure_sparse_index(conn)
+
+    station = args.station
+    if not station:
+        r = conn.execute("SELECT location FROM readings ORDER BY ts DESC LIMIT 1").fetchone()
+        if r is None:
+            sys.exit("DB vuoto: indicare --station (LOCATION del server)")
+        station = r[0]
+
+    t0 = time.perf_counter()
+    rev = history_engine.revision(conn)
+    total_seen = total_ins = 0
+    ts_min = ts_max = None
+    for path in args.files:
+        t = time.perf_counter()
+        seen, ins, lo, hi = insert_rows(conn, iter_csv_rows(path, station, utc=True if args.utc else None))
+        total_seen += seen
+        total_ins += ins
+        if lo is not None:
+            ts_min = lo if ts_min is None else min(ts_min, lo)
+            ts_max = hi if ts_max is None else max(ts_max, hi)
+        print(f"{path}: {seen} righe, {ins} nuove ({time.perf_counter() - t:.1f}s)")
+
+    if ts_min is not None:
+        t = time.perf_counter()
+        conn.execute("BEGIN")
+        # righe sparse gia' presenti (coalescing): le righe importate non
+        # devono diventare la loro "riga precedente"
+        history_engine.pin_sparse(conn, station, ts_min, ts_max, rev)
+        rebuild_rollups(conn, station, ts_min, ts_max)
+        print(f"rollup {time.strftime('%Y-%m-%d', time.localtime(ts_min))} .. "
+              f"{time.strftime('%Y-%m-%d', time.localtime(ts_max))} ricalcolati ({time.perf_counter() - t:.1f}s)")
+    else:
+        print("nessuna riga nuova: rollup invariati")
+    conn.close()
+    print(f"totale: {total_seen} righe, {total_ins} nuove in {time.perf_counter() - t0:.1f}s (station={station})")
+    print("nota: le righe piu' vecchie di RETENTION_DAYS restano solo nei rollup giornalieri")
+
+
+if __name__ == "__main__":
+    main()
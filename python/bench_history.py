@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# bench_history.py
+# Confronta i percorsi di aggregazione di /api/history su un DB sintetico:
+#   legacy = query AVG + loop Python come prima di history_engine
+#   sql    = history_engine.aggregate_sql
+#   numpy  = history_engine.aggregate_numpy (se numpy e' installato)
+#   auto   = history_engine.aggregate, il percorso scelto da /api/history
+# Il tempo include la serializzazione JSON della risposta.
+#
+#   python3 python/bench_history.py --days 30 --interval 16
+#
+# Risultati (30 giorni, 162000 righe, nessuna riga sparsa, migliore di 3, ms):
+#   window  bucket  legacy     sql   numpy    auto
+#      24h     60s      77      66      57      57
+#     168h     60s     550     480     400     400
+#     168h    900s     110     117     215     117
+#     720h     60s    2550    2100    1700    1700
+#     720h   3600s     385     415     860     415
+# Con bucket larghi il GROUP BY SQL usa lo stesso piano della query storica
+# (idx_readings_sparse vuoto -> niente riempimento); resta il costo della
+# media vettoriale di winddir (~25 ms a 720 h), che la query storica
+# calcolava sbagliata. Numpy conviene solo con bucket da 1 minuto.
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import history_engine
+
+COLUMNS = [col for _, col, _ in history_engine.SERIES]
+
+
+def make_db(path, days, interval):
+    conn = sqlite3.connect(path)
+    conn.execute(f"CREATE TABLE readings (ts INTEGER NOT NULL, location TEXT, pressure REAL, {', '.join(c + ' REAL' for c in COLUMNS)})")
+    conn.execute("CREATE INDEX idx_readings_ts ON readings(ts)")
+    history_engine.ensure_sparse_index(conn)
+    now = int(time.time())
+    t0 = now - days * 86400
+    rnd = random.Random(1)
+
+    def rows():
+        for ts in range(t0, now, interval):
+            h = (ts % 86400) / 86400.0
+            vals = [
+                15 + 8 * math.sin(2 * math.pi * h) + rnd.random(),   # temperature
+                60 + 20 * math.cos(2 * math.pi * h),                   # humidity
+                rnd.random() * 20,                                     # windspeed
+                (350 + rnd.random() * 20) % 360,                       # winddir (attorno a N)
+                max(0.0, 800 * math.sin(math.pi * h)),                 # solarradiation
+                max(0.0, 8 * math.sin(math.pi * h)),                   # uv
+            ] + [rnd.random() * 0.1 for _ in range(8)]               # rain (in)
+            yield (ts, "BENCH", 1013.0, *vals)
+
+    conn.executemany(f"INSERT INTO readings VALUES ({','.join('?' * (3 + len(COLUMNS)))})", rows())
+    conn.commit()
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def legacy(conn, start, bucket=60, agg="mean"):
+    rows = conn.execute(f"""
+      SELECT (ts/{bucket})*{bucket} AS tmin,
+        AVG(temperature) AS temperature, AVG(humidity) AS humidity,
+        AVG(windspeed) AS windspeed, AVG(winddir) AS winddir,
+        AVG(solarradiation) AS solarradiation, AVG(uv) AS uv,
+        AVG(rainratein * 25.4) AS rainrate_mm, AVG(eventrainin * 25.4) AS event_mm,
+        AVG(hourlyrainin * 25.4) AS hourly_mm, AVG(last24hrainin * 25.4) AS last24h_mm,
+        AVG(dailyrainin * 25.4) AS daily_mm, AVG(weeklyrainin * 25.4) AS weekly_mm,
+        AVG(monthlyrainin * 25.4) AS monthly_mm, AVG(yearlyrainin * 25.4) AS yearly_mm
+      FROM readings WHERE ts >= ? GROUP BY tmin ORDER BY tmin ASC
+    """, (start,)).fetchall()
+    out = {k: [] for k in history_engine.KEYS}
+    for r in rows:
+        tmin = int(r["tmin"])
+        for k in history_engine.KEYS:
+            out[k].append([tmin, float(r[k] or 0.0)])
+    return out
+
+
+def timed(fn, conn, start, bucket, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        body = json.dumps(fn(conn, start, bucket))
+        best = min(best, time.perf_counter() - t)
+    return best * 1000.0, len(body)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark aggregazione /api/history")
+    ap.add_argument("--days", type=int, default=30, help="giorni di dati sintetici")
+    ap.add_argument("--interval", type=int, default=16, help="secondi tra due letture (GW1100: 16)")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    engines = [("legacy", legacy), ("sql", history_engine.aggregate_sql)]
+    if history_engine.numpy_available():
+        engines.append(("numpy", history_engine.aggregate_numpy))
+    else:
+        print("numpy non installato: salto il percorso numpy")
+    engines.append(("auto", history_engine.aggregate))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t = time.perf_counter()
+        conn = make_db(os.path.join(tmp, "bench.db"), args.days, args.interval)
+        n = conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+        print(f"DB sintetico: {n} righe in {time.perf_counter() - t:.1f}s")
+
+        now = int(time.time())
+        windows = [(24, 60), (168, 60), (168, 900), (args.days * 24, 60), (args.days * 24, 3600)]
+        print(f"{'window':>8} {'bucket':>7} " + " ".join(f"{name + ' ms':>10}" for name, _ in engines))
+        for hours, bucket in windows:
+            if hours > args.days * 24:
+                continue
+            res = [timed(fn, conn, now - hours * 3600, bucket, args.repeat) for _, fn in engines]
+            print(f"{hours:>7}h {bucket:>6}s " + " ".join(f"{ms:>10.1f}" for ms, _ in res))
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# daily_stats.py
+# Aggregati giornalieri compatti (n/sum/min/max per metrica) mantenuti all'ingest.
+# Sono la base di /api/stats: bastano pochi KB/anno e non dipendono da
+# `readings`, che viene cancellata dopo RETENTION_DAYS.
+# Una serie per stazione (location): la locale e i nodi del collector mesh
+# non si mescolano mai, come rain_rollup_daily.
+import fields
+import history_engine
+
+# metrica -> espressione SQL su `readings` (stesse unita' di latest_data):
+# le colonne core con rollup "stats" nel registro (fields.py) + pioggia
+METRICS = {m: m for m in fields.CORE if fields.has_stats(m)}
+METRICS["rain_mm"] = "dailyrainin * 25.4"   # contatore giornaliero: max = totale del giorno
+
+_DAY_SQL = "CAST(strftime('%Y%m%d', ts, 'unixepoch', 'localtime') AS INTEGER)"
+
+
+def migrate_location(conn, table, create_sql, location):
+    """
+    Crea `table` con `create_sql` (chiave con location). Una tabella dello
+    schema precedente, senza location, viene ricreata e le sue righe
+    assegnate a `location`: la stazione locale, l'unica che scriveva i rollup.
+    """
+    cols = [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+    if cols and "location" not in cols:
+        conn.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+        conn.execute(create_sql)
+        conn.execute(f"""
+          INSERT INTO {table} (location, {", ".join(cols)})
+          SELECT ?, {", ".join(cols)} FROM {table}_old
+        """, (location,))
+        conn.execute(f"DROP TABLE {table}_old")
+    else:
+        conn.execute(create_sql)
+
+
+def init(conn, location):
+    """Schema di daily_stats; `location` = stazione locale (migrazione, vedi migrate_location)."""
+    migrate_location(conn, "daily_stats", """
+    CREATE TABLE IF NOT EXISTS daily_stats (
+        location TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        day INTEGER NOT NULL,      -- YYYYMMDD (local time)
+        n INTEGER NOT NULL,
+        sum REAL NOT NULL,
+        min REAL,
+        max REAL,
+        PRIMARY KEY (location, metric, day)
+    ) WITHOUT ROWID;
+    """, location)
+    empty = conn.execute("SELECT 1 FROM daily_stats LIMIT 1").fetchone() is None
+    if empty:
+        # primo avvio: ricostruisce da readings (ultimi RETENTION_DAYS), ogni
+        # stazione per conto suo, e recupera i totali pioggia storici da
+        # rain_rollup_daily
+        rebuild(conn)
+        conn.execute("""
+          INSERT OR IGNORE INTO daily_stats (location, metric, day, n, sum, min, max)
+          SELECT location, 'rain_mm', day, 1, daily_mm, daily_mm, daily_mm
+          FROM rain_rollup_daily WHERE daily_mm IS NOT NULL
+        """)
+    conn.commit()
+
+
+def upsert(conn, location, values, day):
+    """Aggiunge un campione per metrica al giorno `day` (YYYYMMDD) della stazione `location`."""
+    merge(conn, [(location, m, day, 1, float(v), float(v), float(v))
+                 for m, v in values.items() if m in METRICS and v is not None])
+
+
+def merge(conn, rows):
+    """
+    Somma aggregati parziali [(location, metric, day, n, sum, min, max)] a
+    quelli salvati. Accetta anche metriche fuori da METRICS (rollup "stats"
+    del registro fields).
+    """
+    conn.executemany("""
+      INSERT INTO daily_stats (location, metric, day, n, sum, min, max) VALUES (?,?,?,?,?,?,?)
+      ON CONFLICT(location, metric, day) DO UPDATE SET
+        n = n + excluded.n,
+        sum = sum + excluded.sum,
+        min = MIN(min, excluded.min),
+        max = MAX(max, excluded.max)
+    """, rows)
+
+
+def rebuild(conn, ts_from=None, ts_to=None, location=None):
+    """
+    Ricalcola i giorni presenti in `readings` nell'intervallo [ts_from, ts_to]
+    in un solo passaggio, per stazione (solo `location`, se indicata).
+    I giorni non piu' presenti in readings restano intatti.
+    """
+    where, params = _ts_range(ts_from, ts_to)
+    if location is not None:
+        where += " AND location = ?"
+        params.append(location)
+    # righe sparse del coalescing: riempite in avanti (come history/export),
+    # altrimenti le colonne invariate mancherebbero da n/sum. Il riempimento
+    # (window function) costa molto: solo se nell'intervallo ci sono NULL
+    src = "readings WHERE 1" + where
+    if history_engine.has_sparse(conn, "1" + where, params):
+        seeds = None
+        if ts_from is not None and location is not None:
+            seeds = history_engine.seed_values(conn, fields.CORE, ts_from, location=location)
+        src, params = history_engine.filled_readings(fields.CORE, "1" + where, params, seeds)
+        src = f"({src})"
+    # un solo GROUP BY per tutte le metriche, poi unpivot in Python (pochi giorni)
+    aggs = ", ".join(f"COUNT({e}), TOTAL({e}), MIN({e}), MAX({e})" for e in METRICS.values())
+    rows = conn.execute(f"""
+      SELECT location, {_DAY_SQL} AS d, {aggs}
+      FROM {src}
+      GROUP BY location, d
+    """, params).fetchall()
+    out = []
+    for r in map(tuple, rows):
+        for i, metric in enumerate(METRICS):
+            n, total, lo, hi = r[2 + 4 * i: 6 + 4 * i]
+            if n:
+                out.append((r[0], metric, r[1], n, total, lo, hi))
+    conn.executemany("""
+      INSERT OR REPLACE INTO daily_stats (location, metric, day, n, sum, min, max) VALUES (?,?,?,?,?,?,?)
+    """, out)
+
+
+def _ts_range(ts_from, ts_to):
+    where, params = "", []
+    if ts_from is not None:
+        where += " AND ts >= ?"
+        params.append(int(ts_from))
+    if ts_to is not None:
+        where += " AND ts <= ?"
+        params.append(int(ts_to))
+    return where, params
+
+
+def _day_range(day_from, day_to):
+    where, params = "", []
+    if day_from is not None:
+        where += " AND day >= ?"
+        params.append(int(day_from))
+    if day_to is not None:
+        where += " AND day <= ?"
+        params.append(int(day_to))
+    return where, params
+
+
+def _r(x, nd=2):
+    return None if x is None else round(x, nd)
+
+
+# =========================
+# QUERIES
+# =========================
+def summary(conn, location):
+    rows = conn.execute("""
+      SELECT metric, MIN(day) AS first_day, MAX(day) AS last_day, COUNT(*) AS days
+      FROM daily_stats WHERE location = ? GROUP BY metric
+    """, (location,)).fetchall()
+    return {r["metric"]: {"first_day": r["first_day"], "last_day": r["last_day"], "days": r["days"]} for r in rows}
+
+
+def daily(conn, location, metric, day_from=None, day_to=None):
+    where, params = _day_range(day_from, day_to)
+    rows = conn.execute(f"""
+      SELECT day, n, sum, min, max FROM daily_stats
+      WHERE location = ? AND metric = ? {where} ORDER BY day
+    """, (location, metric, *params)).fetchall()
+    return [{"day": r["day"], "min": _r(r["min"]), "max": _r(r["max"]),
+             "mean": _r(r["sum"] / r["n"]) if r["n"] else None} for r in rows]
+
+
+def monthly(conn, location, metric, day_from=None, day_to=None):
+    where, params = _day_range(day_from, day_to)
+    rows = conn.execute(f"""
+      SELECT day / 100 AS month, SUM(n) AS n, SUM(sum) AS sum, MIN(min) AS min, MAX(max) AS max,
+             AVG(sum / n) AS mean_daily, COUNT(*) AS days
+      FROM daily_stats
+      WHERE location = ? AND metric = ? AND n > 0 {where}
+      GROUP BY month ORDER BY month
+    """, (location, metric, *params)).fetchall()
+    return [{"month": r["month"], "days": r["days"], "min": _r(r["min"]), "max": _r(r["max"]),
+             "mean": _r(r["sum"] / r["n"]) if r["n"] else None, "mean_daily": _r(r["mean_daily"])}
+            for r in rows]
+
+
+def records(conn, location, metric, month=None):
+    cond, params = "location = ? AND metric = ?", [location, metric]
+    if month:
+        cond += " AND (day / 100) % 100 = ?"
+        params.append(int(month))
+    hi = conn.execute(f"SELECT day, max FROM daily_stats WHERE {cond} AND max IS NOT NULL ORDER BY max DESC, day LIMIT 1", params).fetchone()
+    lo = conn.execute(f"SELECT day, min FROM daily_stats WHERE {cond} AND min IS NOT NULL ORDER BY min ASC, day LIMIT 1", params).fetchone()
+    return {
+        "high": {"day": hi["day"], "value": _r(hi["max"])} if hi else None,
+        "low": {"day": lo["day"], "value": _r(lo["min"])} if lo else None,
+    }
+
+
+def degree_days(conn, location, base=18.0, day_from=None, day_to=None):
+    """HDD/CDD mensili dalla temperatura media giornaliera (metodo media)."""
+    where, params = _day_range(day_from, day_to)
+    rows = conn.execute(f"""
+      SELECT day / 100 AS month,
+             TOTAL(MAX(0, ? - sum / n)) AS hdd,
+             TOTAL(MAX(0, sum / n - ?)) AS cdd,
+             COUNT(*) AS days
+      FROM daily_stats
+      WHERE location = ? AND metric = 'temperature' AND n > 0 {where}
+      GROUP BY month ORDER BY month
+    """, (float(base), float(base), location, *params)).fetchall()
+    return [{"month": r["month"], "days": r["days"], "hdd": _r(r["hdd"], 1), "cdd": _r(r["cdd"], 1)} for r in rows]
+
+
+def rain_totals(conn, location, by="month", day_from=None, day_to=None):
+    div = 10000 if by == "year" else 100
+    where, params = _day_range(day_from, day_to)
+    rows = conn.execute(f"""
+      SELECT day / {div} AS period, TOTAL(max) AS total_mm, COUNT(*) AS days,
+             SUM(max >= 1.0) AS rain_days
+      FROM daily_stats
+      WHERE location = ? AND metric = 'rain_mm' {where}
+      GROUP BY period ORDER BY period
+    """, (location, *params)).fetchall()
+    return [{by: r["period"], "total_mm": _r(r["total_mm"], 1), "days": r["days"], "rain_days": r["rain_days"]}
+            for r in rows]
+
+
+def this_day(conn, location, mmdd):
+    """Stesso giorno (MMDD) negli anni passati, tutte le metriche."""
+    rows = conn.execute("""
+      SELECT metric, day, n, sum, min, max FROM daily_stats
+      WHERE location = ? AND day % 10000 = ? ORDER BY day, metric
+    """, (location, int(mmdd))).fetchall()
+    out = {}
+    for r in rows:
+        y = out.setdefault(r["day"] // 10000, {})
+        y[r["metric"]] = {"min": _r(r["min"]), "max": _r(r["max"]),
+                          "mean": _r(r["sum"] / r["n"]) if r["n"] else None}
+    return [{"year": y, **v} for y, v in sorted(out.items())]
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# export_data.py
+# Export in streaming di `readings` e delle tabelle rollup (CSV / NDJSON /
+# Arrow IPC / Parquet). Le righe arrivano dal cursore SQLite a blocchi di
+# CHUNK_ROWS e ogni blocco viene serializzato e rilasciato subito:
+# la memoria resta costante qualunque sia l'intervallo.
+# Le colonne NULL di `readings` scritte dal coalescing ("invariato") sono
+# riempite con il valore precedente; --raw le lascia vuote.
+# Usato da /api/export nel server e da riga di comando:
+#
+#   python3 python/export_data.py --from 2026-01-01 --to 2026-02-01 --format csv -o gennaio.csv
+#   python3 python/export_data.py --table daily_stats --format parquet -o stats.parquet
+import argparse
+import csv
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+import history_engine
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, "data", "ecowitt.db")
+
+CHUNK_ROWS = 5000
+
+# tabella -> (colonna di filtro, "ts" = epoch s | "day" = YYYYMMDD, ORDER BY)
+# L'ordine segue una chiave/indice: SQLite legge in ordine, niente sort
+# temporaneo (su readings_extra, milioni di righe, era il costo maggiore)
+TABLES = {
+    "readings": ("ts", "ts", "ts"),
+    "rain_rollup_daily": ("day", "day", "location, day"),
+    "daily_stats": ("day", "day", "location, metric, day"),
+    # vista su readings_ext (metriche fuori da readings): serie per serie,
+    # ts crescente dentro la serie (chiave (series, ts))
+    "readings_extra": ("ts", "ts", "location, metric, ts"),
+}
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+COLUMNAR = {"arrow", "parquet"}
+
+
+def columnar_available():
+    return pa is not None
+
+
+def parse_time(value, end=False):
+    """
+    Epoch (s) oppure data/ora locale ISO: 2026-01-31, 2026-01-31T12:00[:00].
+    Con end=True una data senza ora indica la fine del giorno.
+    """
+    if value is None or value == "":
+        return None
+    value = str(value).strip()
+    if value.lstrip("-").isdigit():
+        return int(value)
+    dt = datetime.fromisoformat(value.replace(" ", "T"))
+    ts = int(dt.timestamp())
+    if end and len(value) == 10:
+        # mezzanotte locale successiva: nei giorni del cambio d'ora non e' +86400
+        ts = int((dt + timedelta(days=1)).timestamp()) - 1
+    return ts
+
+
+def _yyyymmdd(ts):
+    lt = time.localtime(ts)
+    return lt.tm_year * 10000 + lt.tm_mon * 100 + lt.tm_mday
+
+
+def columns(conn, table):
+    """[(nome, tipo dichiarato)] dalla tabella, nell'ordine dello schema."""
+    return [(r[1], (r[2] or "").upper()) for r in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def iter_chunks(conn, table, ts_from=None, ts_to=None, chunk_rows=CHUNK_ROWS, fill=True, station=None):
+    """
+    Genera liste di tuple (max chunk_rows) nell'ordine di TABLES (ts crescente
+    per stazione/serie).
+    `station` filtra per location (None = tutte).
+    """
+    if table not in TABLES:
+        raise ValueError(f"unknown table: {table}")
+    key, kind, order = TABLES[table]
+    lo, hi = ts_from, ts_to
+    if kind == "day":
+        lo = _yyyymmdd(ts_from) if ts_from is not None else None
+        hi = _yyyymmdd(ts_to) if ts_to is not None else None
+
+    where, params = [], []
+    if lo is not None:
+        where.append(f"{key} >= ?")
+        params.append(lo)
+    if hi is not None:
+        where.append(f"{key} <= ?")
+        params.append(hi)
+    if station is not None:
+        where.append("location = ?")
+        params.append(station)
+    sql = f"SELECT * FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {order}"
+
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(sql, params)
+    filler = _Filler(conn, ts_from) if fill and table == "readings" else None
+    try:
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            if filler is not None:
+                rows = filler.fill(rows)
+            yield rows
+    finally:
+        cur.close()
+
+
+class _Filler:
+    # riempimento in avanti per stazione; lo stato passa da un blocco al successivo
+    def __init__(self, conn, ts_from):
+        self.conn = conn
+        self.ts_from = ts_from
+        self.names = [c for c, _ in columns(conn, "readings")]
+        self.loc = self.names.index("location")
+        self.last = {}
+
+    def _seed(self, r):
+        if self.ts_from is None:
+            return r
+        seeds = history_engine.seed_values(self.conn, self.names, self.ts_from, location=r[self.loc])
+        return tuple(v if v is not None else sd for v, sd in zip(r, seeds))
+
+    def fill(self, rows):
+        out = []
+        for r in rows:
+            last = self.last.get(r[self.loc])
+            if None in r:
+                if last is None:
+                    r = self._seed(r)
+                else:
+                    r = tuple(v if v is not None else last[i] for i, v in enumerate(r))
+            self.last[r[self.loc]] = r
+            out.append(r)
+        return out
+
+
+# =========================
+# SERIALIZERS (chunk di righe -> bytes)
+# =========================
+def _csv(cols, chunks):
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    w.writerow([c for c, _ in cols])
+    for rows in chunks:
+        w.writerows(rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def _ndjson(cols, chunks):
+    names = [c for c, _ in cols]
+    dumps = json.JSONEncoder(separators=(",", ":")).encode
+    for rows in chunks:
+        yield "".join(dumps(dict(zip(names, r))) + "\n" for r in rows).encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    # file-like in sola scrittura: accumula i byte finche' non vengono ritirati
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        b = bytes(b)
+        self._parts.append(b)
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def take(self):
+        out = b"".join(self._parts)
+        self._parts = []
+        return out
+
+
+def _arrow_schema(cols):
+    types = {"INTEGER": pa.int64(), "REAL": pa.float64(), "TEXT": pa.string()}
+    return pa.schema([(name, types.get(decl, pa.float64())) for name, decl in cols])
+
+
+def _columnar(cols, chunks, fmt):
+    if pa is None:
+        raise RuntimeError("pyarrow non installato: formato non disponibile")
+    schema = _arrow_schema(cols)
+    sink = _ChunkSink()
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    try:
+        for rows in chunks:
+            arrays = [pa.array([r[i] for r in rows], type=f.type) for i, f in enumerate(schema)]
+            batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+            writer.write_batch(batch)   # parquet: un row group per chunk
+            data = sink.take()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    data = sink.take()
+    if data:
+        yield data
+
+
+def stream(conn, table, fmt, ts_from=None, ts_to=None, chunk_rows=CHUNK_ROWS, fill=True, station=None):
+    """Generatore di bytes per `table` nel formato `fmt`."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format: {fmt}")
+    cols = columns(conn, table)
+    chunks = iter_chunks(conn, table, ts_from, ts_to, chunk_rows, fill, station)
+    if fmt == "csv":
+        return _csv(cols, chunks)
+    if fmt == "ndjson":
+        return _ndjson(cols, chunks)
+    return _columnar(cols, chunks, fmt)
+
+
+# =========================
+# CLI
+# =========================
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Export dati Ecowitt da DB_PATH (senza passare dal server)")
+    ap.add_argument("--db", default=DEFAULT_DB_PATH, help=f"database SQLite (default {DEFAULT_DB_PATH})")
+    ap.add_argument("--table", default="readings", choices=sorted(TABLES))
+    ap.add_argument("--from", dest="ts_from", help="epoch o data locale ISO (incluso)")
+    ap.add_argument("--to", dest="ts_to", help="epoch o data locale ISO (incluso)")
+    ap.add_argument("--format", default="csv", choices=sorted(FORMATS))
+    ap.add_argument("-o", "--output", help="file di uscita (default stdout)")
+    ap.add_argument("--station", help="solo questa location (default tutte)")
+    ap.add_argument("--raw", action="store_true", help="readings: lascia NULL le colonne invariate (coalescing)")
+    args = ap.parse_args(argv)
+
+    if args.format in COLUMNAR and pa is None:
+        ap.error("pyarrow non installato (pip3 install pyarrow)")
+    bounds = []
+    for opt, value in (("--from", args.ts_from), ("--to", args.ts_to)):
+        try:
+            bounds.append(parse_time(value, end=opt == "--to"))
+        except ValueError:
+            ap.error(f"{opt}: data non valida {value!r} (epoch o ISO, es. 2026-01-31T12:00)")
+    ts_from, ts_to = bounds
+
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    n = 0
+    try:
+        for data in stream(conn, args.table, args.format,
+                           ts_from, ts_to,
+                           fill=not args.raw, station=args.station):
+            out.write(data)
+            n += len(data)
+    finally:
+        if args.output:
+            out.close()
+        conn.close()
+    if args.output:
+        print(f"{args.output}: {n} bytes", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
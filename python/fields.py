@@ -0,0 +1,177 @@
+# fields.py
+# Registro dei campi del POST Ecowitt (GW1100 + sensori aggiuntivi): per ogni
+# chiave la metrica salvata, l'unita', la conversione, dove si salva e il
+# rollup giornaliero.
+#  - storage "core": colonna di `readings` (i 15 campi storici, sempre presenti)
+#  - storage "ext":  tabella lunga `readings_ext` (readings_ext.py), una riga
+#    per (serie, ts): un sensore non collegato non scrive e non occupa niente
+#  - rollup "stats": un campione al giorno in daily_stats (n/sum/min/max)
+# Aggiungere un sensore = una riga in FIELDS. Le chiavi numeriche non in
+# registro vengono salvate lo stesso come "ext", senza conversione.
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+Field = namedtuple("Field", "metric unit conv digits storage rollup")
+
+
+# conversioni: unita' Ecowitt -> unita' salvate
+def f_to_c(v):
+    return (v - 32.0) * 5.0 / 9.0
+
+
+def mph_to_kmh(v):
+    return v * 1.60934
+
+
+def inhg_to_hpa(v):
+    return v * 33.8639
+
+
+# chiave (regex, il gruppo va al posto di {0} nella metrica), metrica, unita',
+# conversione, cifre decimali (0 = intero), storage, rollup
+FIELDS = [
+    # outdoor (WS69/WH65) + barometro del gateway
+    (r"tempf", "temperature", "°C", f_to_c, 2, "core", "stats"),
+    (r"humidity", "humidity", "%", None, 0, "core", "stats"),
+    (r"windspeedmph", "windspeed", "km/h", mph_to_kmh, 2, "core", "stats"),
+    (r"winddir", "winddir", "°", None, 1, "core", None),
+    (r"baromrelin", "pressure", "hPa", inhg_to_hpa, 2, "core", "stats"),
+    (r"solarradiation", "solarradiation", "W/m²", None, 1, "core", "stats"),
+    (r"uv", "uv", "", None, 1, "core", "stats"),
+    # pioggia: contatori in pollici come li manda il gateway
+    (r"rainratein", "rainratein", "in/h", None, 4, "core", None),
+    (r"eventrainin", "eventrainin", "in", None, 4, "core", None),
+    (r"hourlyrainin", "hourlyrainin", "in", None, 4, "core", None),
+    (r"last24hrainin", "last24hrainin", "in", None, 4, "core", None),
+    (r"dailyrainin", "dailyrainin", "in", None, 4, "core", None),
+    (r"weeklyrainin", "weeklyrainin", "in", None, 4, "core", None),
+    (r"monthlyrainin", "monthlyrainin", "in", None, 4, "core", None),
+    (r"yearlyrainin", "yearlyrainin", "in", None, 4, "core", None),
+
+    (r"windgustmph", "windgust", "km/h", mph_to_kmh, 2, "ext", "stats"),
+    (r"maxdailygust", "maxdailygust", "km/h", mph_to_kmh, 2, "ext", None),
+    (r"windspdmph_avg10m", "windspeed_avg10m", "km/h", mph_to_kmh, 2, "ext", None),
+    (r"winddir_avg10m", "winddir_avg10m", "°", None, 1, "ext", None),
+    (r"totalrainin", "totalrainin", "in", None, 4, "ext", None),
+    (r"baromabsin", "pressure_abs", "hPa", inhg_to_hpa, 2, "ext", None),
+    # indoor (sensore del gateway)
+    (r"tempinf", "indoortemp", "°C", f_to_c, 2, "ext", "stats"),
+    (r"humidityin", "indoorhumidity", "%", None, 0, "ext", "stats"),
+    # WH31 multicanale, WN34 sonda, WH51 suolo, WH41/43 PM2.5, WH55 perdite
+    (r"temp(\d+)f", "temp{0}", "°C", f_to_c, 2, "ext", "stats"),
+    (r"humidity(\d+)", "humidity{0}", "%", None, 0, "ext", "stats"),
+    (r"tf_ch(\d+)", "tf_ch{0}", "°C", f_to_c, 2, "ext", "stats"),
+    (r"soilmoisture(\d+)", "soilmoisture{0}", "%", None, 0, "ext", "stats"),
+    (r"soilad(\d+)", "soilad{0}", "", None, 0, "ext", None),
+    (r"pm25_ch(\d+)", "pm25_ch{0}", "µg/m³", None, 1, "ext", "stats"),
+    (r"pm25_avg_24h_ch(\d+)", "pm25_avg_24h_ch{0}", "µg/m³", None, 1, "ext", None),
+    (r"leak_ch(\d+)", "leak_ch{0}", "", None, 0, "ext", None),
+    (r"co2(in)?", "co2{0}", "ppm", None, 0, "ext", "stats"),
+    # WH57 fulmini: lightning_num e' il contatore del giorno (max = totale)
+    (r"lightning", "lightning", "km", None, 1, "ext", None),
+    (r"lightning_num", "lightning_num", "", None, 0, "ext", "stats"),
+    (r"lightning_time", "lightning_time", "s", None, 0, "ext", None),
+    # batterie: stato 0/1, livello 0-5 o tensione, secondo il sensore
+    (r"(\w*batt\w*)", "{0}", "", None, 2, "ext", None),
+]
+CIRCULAR = {"winddir", "winddir_avg10m"}
+
+# chiavi del POST che non sono misure
+IGNORE = {"passkey", "stationtype", "dateutc", "freq", "model", "runtime", "interval", "heap"}
+
+_PATTERNS = [(re.compile(p), Field(*rest)) for p, *rest in FIELDS]
+_cache = {}
+
+# colonne valore di `readings` (ordine dello schema) e contatori pioggia:
+# gli altri moduli costruiscono da qui le loro liste di colonne
+CORE = [f.metric for p, f in _PATTERNS if f.storage == "core"]
+RAIN = [f.metric for p, f in _PATTERNS if f.storage == "core" and f.unit in ("in", "in/h")]
+_CORE_DEFAULTS = {f.metric: 0 if f.digits == 0 else 0.0 for p, f in _PATTERNS if f.storage == "core"}
+
+
+def resolve(key):
+    """Field della chiave Ecowitt `key` (metrica gia' espansa), None se da ignorare."""
+    f = _cache.get(key)
+    if f is None and key not in _cache:
+        if key.lower() not in IGNORE:
+            for rx, field in _PATTERNS:
+                m = rx.fullmatch(key)
+                if m:
+                    groups = [g or "" for g in m.groups()]
+                    f = field._replace(metric=field.metric.format(*groups))
+                    break
+            else:
+                # chiave sconosciuta: valore grezzo, nome normalizzato
+                f = Field(re.sub(r"[^a-z0-9_]", "_", key.lower()), "", None, None, "ext", None)
+        _cache[key] = f
+    return f
+
+
+def convert(field, raw):
+    v = float(raw)
+    if field.conv is not None:
+        v = field.conv(v)
+    if field.digits == 0:
+        return int(round(v, 0))
+    return v if field.digits is None else round(v, field.digits)
+
+
+def parse(form):
+    """
+    POST del gateway -> (core, ext): `core` ha tutte le colonne di readings
+    (0 se mancanti), `ext` solo le metriche effettivamente presenti.
+    """
+    core = dict(_CORE_DEFAULTS)
+    ext = {}
+    for key, raw in form.items():
+        f = resolve(key)
+        if f is None:
+            continue
+        try:
+            v = convert(f, raw)
+        except (TypeError, ValueError):
+            continue
+        if f.storage == "core":
+            core[f.metric] = v
+        else:
+            ext[f.metric] = v
+    return core, ext
+
+
+def _metric_rx(field):
+    # "temp{0}" -> temp(.*): dal nome della metrica risale ai gruppi della chiave
+    return re.compile(re.escape(field.metric).replace(r"\{0\}", "(.*)"))
+
+
+_METRICS = [(rx, _metric_rx(f), f) for rx, f in _PATTERNS]
+
+
+@lru_cache(maxsize=1024)
+def resolve_metric(metric):
+    """Field dal nome della metrica salvata (es. "temp2"), None se non in registro."""
+    for rx, mrx, field in _METRICS:
+        m = mrx.fullmatch(metric)
+        if m is None:
+            continue
+        if not m.groups():
+            return field
+        # la chiave ricostruita deve essere valida per la regex del campo
+        key = re.sub(r"\([^)]*\)\??", lambda _: m.group(1), rx.pattern, count=1)
+        if rx.fullmatch(key):
+            return field._replace(metric=metric)
+    return None
+
+
+def unit(metric):
+    f = resolve_metric(metric)
+    return f.unit if f is not None else ""
+
+
+def has_stats(metric):
+    f = resolve_metric(metric)
+    return f is not None and f.rollup == "stats"
+
+
+def is_circular(metric):
+    return metric in CIRCULAR
@@ -0,0 +1,446 @@
+# history_engine.py
+# Aggregazione a bucket di `readings` per /api/history.
+#  - "sql":   GROUP BY in SQLite + loop Python (sempre disponibile)
+#  - "numpy": legge le colonne in un passaggio e fa bucket/medie/min/max
+#             come operazioni su array (se numpy e' installato)
+# La direzione del vento e' una media vettoriale (sin/cos): AVG(winddir)
+# tra 350° e 10° darebbe 180°.
+#
+# Con sqlite3 il costo fisso del percorso numpy e' la materializzazione delle
+# righe in Python: conviene con bucket piccoli (molti bucket, poche righe
+# per bucket), mentre con bucket larghi il GROUP BY in C restituisce poche
+# righe ed e' piu' rapido. "auto" sceglie di conseguenza.
+# Su settimana/mese il limite e' la decodifica delle righe in SQLite (righe x
+# colonne), non l'aggregazione: un pre-bucket a 60 s in SQL seguito da numpy
+# e' risultato piu' lento della lettura diretta, quindi non c'e'. Senza righe
+# sparse (idx_readings_sparse) il GROUP BY ha il piano della query storica
+# (numeri in bench_history.py).
+#
+# Con il coalescing delle scritture (write_coalescer) una colonna NULL vale
+# "come la riga precedente": le colonne vengono riempite in avanti, partendo
+# dall'ultimo valore prima di `start` (entro FILL_LOOKBACK_SEC).
+#
+# Le metriche "ext" (fields.py: raffica, indoor, sensori aggiuntivi) stanno
+# in readings_ext, una serie per metrica scritta solo ai cambi (e al
+# keepalive): aggregate_ext le campiona sui ts di readings della stessa
+# stazione, riempiendo in avanti, cosi' bucket e medie sono quelli delle
+# colonne core.
+import math
+import sqlite3
+
+import fields
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# chiave di output -> (colonna readings, fattore di conversione)
+SERIES = [
+    ("temperature", "temperature", 1.0),
+    ("humidity", "humidity", 1.0),
+    ("windspeed", "windspeed", 1.0),
+    ("winddir", "winddir", 1.0),
+    ("solarradiation", "solarradiation", 1.0),
+    ("uv", "uv", 1.0),
+
+    ("rainrate_mm", "rainratein", 25.4),
+    ("event_mm", "eventrainin", 25.4),
+    ("hourly_mm", "hourlyrainin", 25.4),
+    ("last24h_mm", "last24hrainin", 25.4),
+    ("daily_mm", "dailyrainin", 25.4),
+    ("weekly_mm", "weeklyrainin", 25.4),
+    ("monthly_mm", "monthlyrainin", 25.4),
+    ("yearly_mm", "yearlyrainin", 25.4),
+]
+KEYS = [k for k, _, _ in SERIES]
+# colonne di readings disponibili solo se richieste esplicitamente (`keys`)
+OPTIONAL_SERIES = [
+    ("pressure", "pressure", 1.0),
+]
+ALL_KEYS = KEYS + [k for k, _, _ in OPTIONAL_SERIES]
+AGGS = ("mean", "min", "max")
+CIRCULAR = fields.CIRCULAR
+NUMPY_MAX_BUCKET = 120  # auto: numpy fino a questo bucket (s), poi SQL
+DECIMALS = 3            # arrotondamento in uscita (meno byte e JSON piu' rapido)
+FILL_LOOKBACK_SEC = 3600  # quanto cercare indietro il valore iniziale di una colonna NULL
+
+
+def numpy_available():
+    return np is not None
+
+
+def _where(start, location):
+    # con `location` lavora sull'indice unico (location, ts)
+    if location is None:
+        return "ts >= ?", [int(start)]
+    return "location = ? AND ts >= ?", [location, int(start)]
+
+
+def _scan_where(conn, start, location):
+    # per aggregare tutta la finestra: con una sola stazione nel DB basta il
+    # range su ts (idx_readings_ts, piu' compatto dell'indice unico)
+    if location is not None:
+        lo, hi = conn.execute("SELECT MIN(location), MAX(location) FROM readings").fetchone()
+        if lo == hi == location:
+            location = None
+    return _where(start, location)
+
+
+def seed_values(conn, columns, ts, lookback=FILL_LOOKBACK_SEC, location=None):
+    """Ultimo valore non NULL di ogni colonna in [ts - lookback, ts), o None."""
+    where, params = _where(int(ts) - int(lookback), location)
+    out = []
+    for col in columns:
+        r = conn.execute(f"""
+          SELECT {col} FROM readings
+          WHERE {where} AND ts < ? AND {col} IS NOT NULL
+          ORDER BY ts DESC LIMIT 1
+        """, (*params, int(ts))).fetchone()
+        out.append(None if r is None else r[0])
+    return out
+
+
+def filled_readings(columns, where, params, seeds=None):
+    """
+    (sql, params) di una subquery su readings (ts, location, `columns`) con le
+    colonne NULL riempite in avanti per stazione, come _ffill: COUNT(col) in
+    ordine di ts numera i blocchi "valore + righe invariate", MAX sul blocco
+    ne prende il valore. Le righe prima del primo valore prendono `seeds`.
+    """
+    seeds = list(seeds) if seeds is not None else [None] * len(columns)
+    counts = ", ".join(f"COUNT({c}) OVER w AS g{i}" for i, c in enumerate(columns))
+    filled = ", ".join(f"COALESCE(MAX({c}) OVER (PARTITION BY location, g{i}), ?) AS {c}"
+                       for i, c in enumerate(columns))
+    sql = f"""
+      SELECT ts, location, {filled}
+      FROM (
+        SELECT ts, location, {", ".join(columns)}, {counts}
+        FROM readings
+        WHERE {where}
+        WINDOW w AS (PARTITION BY location ORDER BY ts)
+      )"""
+    return sql, [*seeds, *params]
+
+
+def _sum(columns, table=None):
+    # NULL se almeno una colonna e' NULL: un solo test per riga
+    return " + ".join(c if table is None else f"{table}.{c}" for c in columns)
+
+
+# righe sparse (coalescing): indice parziale, vuoto senza coalescing. Le query
+# devono ripetere la stessa espressione perche' SQLite lo usi
+_SPARSE_SQL = f"({_sum(fields.CORE)}) IS NULL"
+
+
+def ensure_sparse_index(conn):
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_readings_sparse ON readings(ts, location) WHERE {_SPARSE_SQL};")
+
+
+def has_sparse(conn, where, params):
+    """
+    True se qualche riga di readings che soddisfa `where` (con un range su
+    ts) ha una colonna NULL: una ricerca su idx_readings_sparse, che con una
+    location il planner scarterebbe per l'indice unico.
+    """
+    r = conn.execute(f"""
+      SELECT 1 FROM readings INDEXED BY idx_readings_sparse
+      WHERE {where} AND {_SPARSE_SQL} LIMIT 1
+    """, params).fetchone()
+    return r is not None
+
+
+def revision(conn):
+    """
+    Revisione di readings: il rowid massimo, che cresce a ogni riga inserita
+    (anche in ritardo o da backfill). Le righe piu' vecchie cancellate dalla
+    retention non lo abbassano; con la tabella svuotata riparte da capo.
+    """
+    r = conn.execute("SELECT MAX(rowid) FROM readings").fetchone()
+    return r[0] or 0
+
+
+def delta_start(conn, since, rev, bucket, window_start, location=None):
+    """
+    Primo bucket da restituire a un client che ha i bucket fino a `since`
+    (il cursor) letti alla revisione `rev`: il bucket di `since`, o prima se
+    dopo `rev` sono state inserite righe piu' vecchie (invii in ritardo,
+    backfill). Revisione sconosciuta o piu' avanti di quella attuale
+    (tabella svuotata) -> tutta la finestra.
+    """
+    start = max(window_start, (int(since) // bucket) * bucket)
+    if rev is None:
+        return start
+    if int(rev) > revision(conn):
+        return window_start
+    where, params = ("rowid > ?", [int(rev)]) if location is None else \
+        ("rowid > ? AND location = ?", [int(rev), location])
+    changed = conn.execute(f"SELECT MIN(ts) FROM readings WHERE {where}", params).fetchone()[0]
+    if changed is not None and changed < start:
+        start = max(window_start, (changed // bucket) * bucket)
+    return start
+
+
+def pin_sparse(conn, location, ts_min, ts_max, rev, columns=None, lookback=FILL_LOOKBACK_SEC):
+    """
+    Dopo l'inserimento di righe complete in [ts_min, ts_max] (in ritardo o da
+    backfill, rowid > `rev`): le righe sparse gia' presenti fino alla riga
+    completa successiva vengono riempite con i valori che rappresentavano,
+    calcolati senza le righe nuove, che altrimenti farebbero da "riga
+    precedente". Ritorna le righe aggiornate.
+    """
+    columns = list(fields.CORE if columns is None else columns)
+    r = conn.execute(f"""
+      SELECT MIN(ts) FROM readings
+      WHERE location = ? AND ts > ? AND rowid <= ? AND ({_sum(columns)}) IS NOT NULL
+    """, (location, int(ts_max), rev)).fetchone()
+    end = r[0] if r[0] is not None else conn.execute(
+        "SELECT MAX(ts) FROM readings WHERE location = ?", (location,)).fetchone()[0]
+    if end is None:
+        return 0
+    where = "location = ? AND ts BETWEEN ? AND ? AND rowid <= ?"
+    params = [location, int(ts_min), int(end), rev]
+    if not has_sparse(conn, where, params):
+        return 0
+    seeds = seed_values(conn, columns, ts_min, lookback, location)
+    sql, params = filled_readings(columns, where, params, seeds)
+    return conn.execute(f"""
+      UPDATE readings SET {", ".join(f"{c} = f.{c}" for c in columns)}
+      FROM ({sql}) AS f
+      WHERE readings.location = f.location AND readings.ts = f.ts
+        AND ({_sum(columns, "readings")}) IS NULL
+    """, params).rowcount
+
+
+def _series(keys):
+    if keys is None:
+        return SERIES
+    return [s for s in SERIES + OPTIONAL_SERIES if s[0] in keys]
+
+
+def aggregate(conn, start, bucket=60, agg="mean", engine="auto", fill_lookback=FILL_LOOKBACK_SEC,
+              location=None, keys=None):
+    """
+    Ritorna {key: [(t_bucket, value), ...]} per i bucket con ts >= start
+    (solo la stazione `location`, se indicata; solo le chiavi `keys`, se indicate).
+    Colonne NULL riempite in avanti; senza un valore precedente -> 0.0.
+    """
+    if agg not in AGGS:
+        agg = "mean"
+    bucket = max(60, int(bucket))
+    if engine == "auto":
+        engine = "numpy" if (np is not None and bucket <= NUMPY_MAX_BUCKET) else "sql"
+    if engine == "numpy":
+        if np is None:
+            raise RuntimeError("numpy engine requested but numpy is not installed")
+        return aggregate_numpy(conn, start, bucket, agg, fill_lookback, location, keys)
+    return aggregate_sql(conn, start, bucket, agg, fill_lookback, location, keys)
+
+
+# =========================
+# SQL + loop
+# =========================
+class _CircMean:
+    def __init__(self):
+        self.s = 0.0
+        self.c = 0.0
+
+    def step(self, deg):
+        if deg is None:
+            return
+        r = math.radians(deg)
+        self.s += math.sin(r)
+        self.c += math.cos(r)
+
+    def finalize(self):
+        if self.s == 0.0 and self.c == 0.0:
+            return None
+        return math.degrees(math.atan2(self.s, self.c)) % 360.0
+
+
+_sql_math = None
+
+def _has_sql_math(conn):
+    # sin/cos/atan2 esistono solo se SQLite e' compilato con le math functions
+    global _sql_math
+    if _sql_math is None:
+        try:
+            conn.execute("SELECT MOD(DEGREES(ATAN2(SIN(1), COS(1))), 360)").fetchone()
+            _sql_math = True
+        except sqlite3.OperationalError:
+            _sql_math = False
+    return _sql_math
+
+
+def _agg_expr(conn, col, agg, circular, factor=1.0):
+    fn = {"mean": "AVG", "min": "MIN", "max": "MAX"}[agg]
+    if agg == "mean" and circular:
+        if _has_sql_math(conn):
+            return (f"MOD(DEGREES(ATAN2(SUM(SIN(RADIANS({col}))), "
+                    f"SUM(COS(RADIANS({col}))))) + 360, 360)")
+        conn.create_aggregate("circ_mean", 1, _CircMean)
+        return f"circ_mean({col})"
+    if factor != 1.0:
+        return f"{fn}({col} * {factor})"
+    return f"{fn}({col})"
+
+
+def aggregate_sql(conn, start, bucket=60, agg="mean", fill_lookback=FILL_LOOKBACK_SEC, location=None, keys=None):
+    # stessa regola del percorso numpy: se nella finestra ci sono righe
+    # sparse (coalescing, idx_readings_sparse) le colonne vengono riempite in
+    # avanti riga per riga prima di aggregare (filled_readings); senza NULL
+    # basta il GROUP BY, con lo stesso piano della query storica
+    series = _series(keys)
+    if not series:
+        return {}
+    columns = [col for _, col, _ in series]
+    aggs = [f"ROUND({_agg_expr(conn, col, agg, key in CIRCULAR, factor)}, {DECIMALS}) AS {key}"
+            for key, col, factor in series]
+
+    where, params = _where(start, location)
+    if has_sparse(conn, where, params):
+        seeds = seed_values(conn, columns, start, fill_lookback, location)
+        sql, params = filled_readings(columns, where, params, seeds)
+        src = f"({sql})"
+    else:
+        where, params = _scan_where(conn, start, location)
+        src = f"readings WHERE {where}"
+    rows = conn.execute(f"""
+      SELECT (ts/{bucket})*{bucket} AS tb, {", ".join(aggs)}
+      FROM {src}
+      GROUP BY tb
+      ORDER BY tb ASC
+    """, params).fetchall()
+
+    out = {k: [] for k, _, _ in series}
+    # resta NULL solo cio' che precede il primo valore (senza seed) -> 0.0
+    last = [None] * len(series)
+    for r in rows:
+        tb = int(r[0])
+        for i, (k, _, _) in enumerate(series):
+            v = r[i + 1]
+            if v is None:
+                v = last[i]
+            else:
+                last[i] = v
+            out[k].append((tb, float(v or 0.0)))
+    return out
+
+
+# =========================
+# NUMPY
+# =========================
+def _ffill(col, seed):
+    # NaN -> ultimo valore valido precedente (seed per quelli iniziali)
+    if np.isnan(col[0]) and seed is not None:
+        col[0] = seed
+    valid = ~np.isnan(col)
+    if valid.all():
+        return col
+    # senza seed le righe iniziali puntano a col[0] e restano NaN
+    idx = np.where(valid, np.arange(len(col)), 0)
+    np.maximum.accumulate(idx, out=idx)
+    return col[idx]
+
+
+def aggregate_numpy(conn, start, bucket=60, agg="mean", fill_lookback=FILL_LOOKBACK_SEC, location=None,
+                    keys=None):
+    series = _series(keys)
+    if not series:
+        return {}
+    where, params = _scan_where(conn, start, location)
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(f"""
+      SELECT ts, {", ".join(col for _, col, _ in series)}
+      FROM readings
+      WHERE {where}
+      ORDER BY ts ASC
+    """, params)
+    rows = cur.fetchall()
+    if not rows:
+        return {k: [] for k, _, _ in series}
+
+    # None -> nan
+    data = np.array(rows, dtype=np.float64)
+    ts = data[:, 0].astype(np.int64)
+    tb = (ts // bucket) * bucket
+    # righe ordinate per ts: ogni bucket e' un blocco contiguo
+    starts = np.flatnonzero(np.concatenate(([True], tb[1:] != tb[:-1])))
+    t_out = tb[starts].tolist()
+
+    # colonne sparse: riempimento in avanti riga per riga prima di aggregare
+    nulls = np.isnan(data[:, 1:])
+    if nulls.any():
+        cols = [col for _, col, _ in series]
+        missing = [i for i in range(len(cols)) if nulls[0, i]]
+        seeds = dict(zip(missing, seed_values(conn, [cols[i] for i in missing], start, fill_lookback, location)))
+        for i in np.flatnonzero(nulls.any(axis=0)):
+            data[:, i + 1] = _ffill(data[:, i + 1], seeds.get(i))
+
+    out = {}
+    for i, (key, _, factor) in enumerate(series, 1):
+        col = data[:, i]
+        valid = ~np.isnan(col)
+        cnt = np.add.reduceat(valid.astype(np.float64), starts)
+
+        if agg == "mean" and key in CIRCULAR:
+            rad = np.radians(np.where(valid, col, 0.0))
+            s = np.add.reduceat(np.where(valid, np.sin(rad), 0.0), starts)
+            c = np.add.reduceat(np.where(valid, np.cos(rad), 0.0), starts)
+            vals = np.degrees(np.arctan2(s, c)) % 360.0
+            vals[(s == 0.0) & (c == 0.0)] = 0.0
+        elif agg == "mean":
+            sums = np.add.reduceat(np.where(valid, col, 0.0), starts)
+            vals = np.divide(sums, cnt, out=np.zeros_like(sums), where=cnt > 0)
+        elif agg == "min":
+            vals = np.fmin.reduceat(col, starts)
+        else:
+            vals = np.fmax.reduceat(col, starts)
+
+        vals = np.nan_to_num(vals, nan=0.0)
+        if factor != 1.0:
+            vals = vals * factor
+        vals[cnt == 0] = 0.0
+        vals = np.round(vals, DECIMALS)
+        out[key] = list(zip(t_out, vals.tolist()))
+    return out
+
+
+# =========================
+# EXT (readings_ext)
+# =========================
+def aggregate_ext(conn, metrics, start, bucket=60, agg="mean", location=None, fill_lookback=FILL_LOOKBACK_SEC):
+    """
+    {metrica: [(t_bucket, value), ...]} per le metriche ext di `location`.
+    Ogni riga di readings da `start` in poi prende l'ultimo valore della serie
+    entro `fill_lookback` (anche prima di `start`); i bucket senza valori
+    mancano. Una metrica senza serie (sensore mai visto) -> lista vuota.
+    """
+    if agg not in AGGS:
+        agg = "mean"
+    bucket = max(60, int(bucket))
+    where, params = _where(start, location)
+    out = {}
+    for m in metrics:
+        r = conn.execute("SELECT id FROM ext_series WHERE location IS ? AND metric = ?", (location, m)).fetchone()
+        if r is None:
+            out[m] = []
+            continue
+        # per riga un range sulla chiave (series, ts), all'indietro dal ts
+        expr = _agg_expr(conn, "value", agg, fields.is_circular(m))
+        rows = conn.execute(f"""
+          SELECT tb, ROUND({expr}, {DECIMALS})
+          FROM (
+            SELECT (ts/{bucket})*{bucket} AS tb,
+                   (SELECT e.value FROM readings_ext e
+                    WHERE e.series = ? AND e.ts <= r.ts AND e.ts >= r.ts - ?
+                    ORDER BY e.ts DESC LIMIT 1) AS value
+            FROM readings r
+            WHERE {where}
+          )
+          GROUP BY tb
+          ORDER BY tb ASC
+        """, (r[0], int(fill_lookback), *params)).fetchall()
+        out[m] = [(int(tb), float(v)) for tb, v in rows if v is not None]
+    return out
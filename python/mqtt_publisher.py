@@ -0,0 +1,204 @@
+# mqtt_publisher.py
+# Pubblica le letture su un broker MQTT locale senza toccare la latenza del POST
+# del GW1100: ecowitt_upload fa solo submit() (non bloccante), un thread
+# dedicato tiene una connessione persistente, si riconnette con backoff e
+# pubblica:
+#   <topic>/<metrica>   valore singolo, retained, solo se cambiato (colonne
+#                       core + metriche ext presenti nella lettura, fields.py)
+#   <topic>/state       JSON compatto con tutta la lettura, retained
+# Se arrivano piu' letture mentre il broker e' lento o giu', vale solo l'ultima.
+import json
+import logging
+import threading
+
+import fields
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:
+    mqtt = None
+
+logger = logging.getLogger("ecowitt_server")
+
+# metriche pubblicate sempre su topic singoli; le ext si aggiungono se presenti
+METRICS = list(fields.CORE)
+
+
+def _metric_keys(reading):
+    # ext: le altre chiavi numeriche della lettura (raffica, indoor, sensori aggiuntivi)
+    return METRICS + [k for k, v in reading.items()
+                      if k not in METRICS and isinstance(v, (int, float)) and not isinstance(v, bool)]
+
+
+def _paho_client(client_id):
+    # paho-mqtt 2.x vuole la versione delle callback, 1.x no
+    try:
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+    except AttributeError:
+        return mqtt.Client(client_id=client_id)
+
+
+class MqttPublisher:
+    """
+    Publisher con un solo slot "pending": submit() sostituisce la lettura in
+    attesa e sveglia il thread, che pubblica solo la piu' recente.
+    `client_factory(client_id)` permette di usare un client finto nei test.
+    """
+
+    def __init__(self, broker, port=1883, topic="ecowitt", client_id="ecowitt-server",
+                 username=None, password=None, keepalive=60,
+                 backoff_min=1.0, backoff_max=60.0, client_factory=None):
+        self.broker = broker
+        self.port = port
+        self.topic = topic.rstrip("/")
+        self.client_id = client_id
+        self.username = username
+        self.password = password
+        self.keepalive = keepalive
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.client_factory = client_factory or _paho_client
+
+        self._cv = threading.Condition()
+        self._pending = None
+        self._stop = False
+        self._connected = False
+        self._client = None
+        self._last_sent = {}
+        self._thread = None
+
+        self.published = 0
+        self.coalesced = 0
+
+    # -------- API --------
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="mqtt-publisher", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, reading, ts):
+        """Non blocca mai: accoda (sostituendo) e ritorna."""
+        with self._cv:
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = (dict(reading), ts)
+            self._cv.notify()
+
+    def stop(self, timeout=5.0):
+        with self._cv:
+            self._stop = True
+            self._cv.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._client is not None:
+            try:
+                self._client.loop_stop()
+                self._client.disconnect()
+            except Exception:
+                pass
+
+    # -------- worker --------
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        ok = (rc == 0) if isinstance(rc, int) else not getattr(rc, "is_failure", False)
+        with self._cv:
+            self._connected = ok
+            if ok:
+                # dopo una riconnessione ripubblica tutto (retained)
+                self._last_sent = {}
+            self._cv.notify()
+        if ok:
+            logger.info(f"[MQTT] Connected to {self.broker}:{self.port}")
+        else:
+            logger.warning(f"[MQTT] Connect refused: {rc}")
+
+    def _on_disconnect(self, client, userdata, *args):
+        with self._cv:
+            self._connected = False
+        logger.warning("[MQTT] Disconnected, paho will reconnect")
+
+    def _connect(self):
+        delay = self.backoff_min
+        while True:
+            with self._cv:
+                if self._stop:
+                    return False
+            try:
+                c = self.client_factory(self.client_id)
+                if self.username:
+                    c.username_pw_set(self.username, self.password)
+                c.on_connect = self._on_connect
+                c.on_disconnect = self._on_disconnect
+                c.reconnect_delay_set(min_delay=max(1, int(self.backoff_min)), max_delay=max(1, int(self.backoff_max)))
+                c.connect(self.broker, self.port, self.keepalive)
+                c.loop_start()
+                self._client = c
+                return True
+            except Exception as e:
+                logger.warning(f"[MQTT] Connect to {self.broker}:{self.port} failed: {e}; retry in {delay:.1f}s")
+                with self._cv:
+                    self._cv.wait_for(lambda: self._stop, timeout=delay)
+                delay = min(self.backoff_max, delay * 2)
+
+    def _run(self):
+        if not self._connect():
+            return
+        while True:
+            with self._cv:
+                # attende una lettura e una connessione attiva
+                self._cv.wait_for(lambda: self._stop or (self._pending is not None and self._connected))
+                if self._stop:
+                    return
+                reading, ts = self._pending
+                self._pending = None
+            try:
+                self._publish(reading, ts)
+            except Exception as e:
+                logger.warning(f"[MQTT] Publish failed: {e}")
+                with self._cv:
+                    # rimette in coda se nel frattempo non e' arrivato altro
+                    if self._pending is None:
+                        self._pending = (reading, ts)
+                    self._cv.wait_for(lambda: self._stop, timeout=self.backoff_min)
+
+    def _publish(self, reading, ts):
+        c = self._client
+        keys = _metric_keys(reading)
+        # _on_connect (thread di rete paho) sostituisce _last_sent sotto _cv:
+        # qui si lavora su una copia, salvata solo se nel frattempo non c'e'
+        # stata una riconnessione (altrimenti al prossimo giro si ripubblica tutto)
+        with self._cv:
+            last = self._last_sent
+        sent = dict(last)
+        try:
+            for key in keys:
+                if key not in reading:
+                    continue
+                v = reading[key]
+                if sent.get(key) == v:
+                    continue
+                _check(c.publish(f"{self.topic}/{key}", str(v), qos=0, retain=True))
+                sent[key] = v
+        finally:
+            with self._cv:
+                if self._last_sent is last:
+                    self._last_sent = sent
+        state = {k: reading[k] for k in keys if k in reading}
+        state["ts"] = ts
+        _check(c.publish(f"{self.topic}/state", json.dumps(state, separators=(",", ":")), qos=0, retain=True))
+        self.published += 1
+
+
+def _check(info):
+    # paho non solleva eccezioni: se non connesso ritorna rc != 0
+    rc = getattr(info, "rc", 0)
+    if rc:
+        raise RuntimeError(f"publish rc={rc}")
+
+
+def make_publisher(broker, **kwargs):
+    """None se paho-mqtt non e' installato (e nessun client_factory e' fornito)."""
+    if mqtt is None and kwargs.get("client_factory") is None:
+        logger.warning("[MQTT] paho-mqtt not installed, publishing disabled (pip3 install paho-mqtt)")
+        return None
+    return MqttPublisher(broker, **kwargs).start()
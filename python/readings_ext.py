@@ -0,0 +1,89 @@
+# readings_ext.py
+# Metriche "ext" del registro (fields.py): tutto quello che non e' una
+# colonna di `readings` (raffica, indoor, canali WH31, suolo, PM2.5,
+# fulmini, batterie, chiavi sconosciute).
+#  - ext_series: una riga per (stazione, metrica), con l'unita'
+#  - readings_ext: (serie, ts, valore) WITHOUT ROWID, chiave (serie, ts):
+#    nessun indice separato, le righe di una serie sono contigue e una query
+#    su una metrica legge solo le sue pagine
+# Un sensore nuovo crea la sua serie al primo valore: niente ALTER TABLE.
+# La vista readings_extra (ts, location, metric, unit, value) serve all'export.
+import fields
+
+# (location, metrica) -> id serie; le serie non vengono mai cancellate
+_series = {}
+
+
+def init(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ext_series (
+        id INTEGER PRIMARY KEY,
+        location TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        unit TEXT,
+        UNIQUE (location, metric)
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS readings_ext (
+        series INTEGER NOT NULL,
+        ts INTEGER NOT NULL,
+        value REAL,
+        PRIMARY KEY (series, ts)
+    ) WITHOUT ROWID;
+    """)
+    conn.execute("""
+    CREATE VIEW IF NOT EXISTS readings_extra AS
+      SELECT e.ts AS ts, s.location AS location, s.metric AS metric, s.unit AS unit, e.value AS value
+      FROM readings_ext e JOIN ext_series s ON s.id = e.series
+    """)
+    conn.commit()
+
+
+def series_id(conn, location, metric, create=False):
+    """Id della serie (location, metric); None se non esiste e create=False."""
+    sid = _series.get((location, metric))
+    if sid is None:
+        fresh = False
+        if create:
+            cur = conn.execute("INSERT OR IGNORE INTO ext_series (location, metric, unit) VALUES (?,?,?)",
+                               (location, metric, fields.unit(metric)))
+            fresh = cur.rowcount == 1
+        r = conn.execute("SELECT id FROM ext_series WHERE location = ? AND metric = ?",
+                         (location, metric)).fetchone()
+        if r is None:
+            return None
+        sid = r[0]
+        # una serie appena creata va in cache solo dopo il commit (rollback possibile)
+        if not fresh:
+            _series[(location, metric)] = sid
+    return sid
+
+
+def insert(conn, location, ts, values):
+    """`values`: metrica -> valore. Stesso ts gia' presente -> ignorato (come readings)."""
+    conn.executemany(
+        "INSERT OR IGNORE INTO readings_ext (series, ts, value) VALUES (?,?,?)",
+        [(series_id(conn, location, m, create=True), int(ts), v) for m, v in values.items() if v is not None],
+    )
+
+
+def cleanup(conn, cutoff):
+    # IN sulle serie: ogni DELETE e' un range sulla chiave (serie, ts)
+    conn.execute("DELETE FROM readings_ext WHERE series IN (SELECT id FROM ext_series) AND ts < ?",
+                 (int(cutoff),))
+
+
+def series(conn, location=None):
+    """[{station, metric, unit, rows, first_ts, last_ts}] delle serie ext."""
+    where, params = ("WHERE s.location = ?", [location]) if location is not None else ("", [])
+    rows = conn.execute(f"""
+      SELECT s.location, s.metric, s.unit,
+             (SELECT COUNT(*) FROM readings_ext e WHERE e.series = s.id) AS n,
+             (SELECT MIN(ts) FROM readings_ext e WHERE e.series = s.id) AS first_ts,
+             (SELECT MAX(ts) FROM readings_ext e WHERE e.series = s.id) AS last_ts
+      FROM ext_series s {where}
+      ORDER BY s.location, s.metric
+    """, params).fetchall()
+    return [{"station": r[0], "metric": r[1], "unit": r[2], "rows": r[3],
+             "first_ts": r[4], "last_ts": r[5]} for r in rows]
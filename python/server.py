@@ -9,7 +9,16 @@ import urllib.parse
 from logging.handlers import RotatingFileHandler
 from threading import Lock
 
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory, stream_with_context
+
+import backfill
+import daily_stats
+import export_data
+import fields
+import history_engine
+import mqtt_publisher
+import readings_ext
+import write_coalescer
 
 # =========================
 # CONFIG
@@ -19,8 +28,25 @@ WEB_PORT = 8080
 LOGFILE = "./ecowitt.log"
 
 RETENTION_DAYS = 30
+USE_GATEWAY_TIME = True          # timestamp da `dateutc` del GW1100 invece dell'ora del server
+GATEWAY_TIME_MAX_AGE = 7 * 86400 # oltre: orologio del gateway non affidabile -> ora del server
+HISTORY_ENGINE = "auto"  # "auto" (numpy se installato) | "numpy" | "sql"
 _CLEANUP_EVERY_SEC = 6 * 3600  # 6h
 
+# Coalescing delle scritture (SD card): righe solo se qualcosa cambia oltre la
+# deadband, colonne invariate NULL, almeno una riga completa ogni KEEPALIVE
+WRITE_COALESCE = False
+COALESCE_KEEPALIVE_SEC = 300
+COALESCE_DEADBAND = dict(write_coalescer.DEFAULT_DEADBAND)
+
+# MQTT (pip3 install paho-mqtt); MQTT_ENABLED=False per disattivare
+MQTT_ENABLED = True
+MQTT_BROKER = "127.0.0.1"
+MQTT_PORT = 1883
+MQTT_TOPIC = "ecowitt"
+MQTT_USERNAME = None
+MQTT_PASSWORD = None
+
 # =========================
 # PATHS (keep current layout)
 # repo root: ~/ecowitt_server
@@ -61,9 +87,21 @@ app = Flask(__name__)
 # =========================
 # GLOBALS
 # =========================
+mqtt_pub = None
+if MQTT_ENABLED:
+    mqtt_pub = mqtt_publisher.make_publisher(
+        MQTT_BROKER, port=MQTT_PORT, topic=MQTT_TOPIC,
+        username=MQTT_USERNAME, password=MQTT_PASSWORD,
+    )
+
 data_lock = Lock()
+write_lock = Lock()
+coalescer = write_coalescer.WriteCoalescer(COALESCE_DEADBAND, COALESCE_KEEPALIVE_SEC) if WRITE_COALESCE else None
+# senza coalescing: metriche ext solo se cambiano o ogni COALESCE_KEEPALIVE_SEC
+ext_filter = write_coalescer.ExtFilter(COALESCE_KEEPALIVE_SEC) if coalescer is None else None
 place_cache = {"value": None, "last_update": 0}
 _last_cleanup = 0
+_latest_ts = 0
 
 latest_data = {
     "location": LOCATION,
@@ -87,6 +125,10 @@ latest_data = {
     "weeklyrainin": 0.0,
     "monthlyrainin": 0.0,
     "yearlyrainin": 0.0,
+
+    # metriche ext (fields.py): aggiunte al primo upload che le contiene
+    "windgust": 0.0,         # km/h
+    "maxdailygust": 0.0,     # km/h
 }
 
 _prev = {
@@ -103,12 +145,6 @@ _prev = {
 # =========================
 # UTILS
 # =========================
-def safe_float(val):
-    try:
-        return float(val)
-    except:
-        return 0.0
-
 def deg_to_cardinal(deg):
     dirs = ["N","NNE","NE","ENE","E","ESE","SE","SSE",
             "S","SSW","SW","WSW","W","WNW","NW","NNW"]
@@ -117,18 +153,9 @@ def deg_to_cardinal(deg):
     except:
         return "--"
 
-def inhg_to_hpa(inhg):
-    return float(inhg) * 33.8639
-
 def inch_to_mm(x):
     return float(x) * 25.4
 
-def f_to_c(tempf):
-    return (float(tempf) - 32.0) * 5.0 / 9.0
-
-def mph_to_kmh(mph):
-    return float(mph) * 1.60934
-
 def trend_of(key, new_val):
     old = _prev.get(key)
     _prev[key] = new_val
@@ -219,11 +246,16 @@ def db_init():
     );
     """)
     conn.execute("CREATE INDEX IF NOT EXISTS idx_readings_ts ON readings(ts);")
+    # (location, ts) unico: re-invii e backfill sono idempotenti
+    backfill.ensure_unique_index(conn)
+    # righe sparse del coalescing: history/rollup riempiono in avanti solo se ce ne sono
+    history_engine.ensure_sparse_index(conn)
 
-    # 1 row/day, no retention
-    conn.execute("""
+    # 1 row/day per stazione, no retention
+    daily_stats.migrate_location(conn, "rain_rollup_daily", """
     CREATE TABLE IF NOT EXISTS rain_rollup_daily (
-        day INTEGER PRIMARY KEY,   -- YYYYMMDD
+        location TEXT NOT NULL,
+        day INTEGER NOT NULL,      -- YYYYMMDD
         ts INTEGER NOT NULL,
         rainrate_mm REAL,
         event_mm REAL,
@@ -232,14 +264,36 @@ def db_init():
         daily_mm REAL,
         weekly_mm REAL,
         monthly_mm REAL,
-        yearly_mm REAL
+        yearly_mm REAL,
+        PRIMARY KEY (location, day)
     );
-    """)
+    """, LOCATION)
     conn.commit()
+
+    # min/max/mean giornalieri per stazione, per /api/stats (no retention)
+    daily_stats.init(conn, LOCATION)
+    # metriche fuori da readings: una serie per (stazione, metrica)
+    readings_ext.init(conn)
+    if WRITE_COALESCE:
+        # gli accumulatori del coalescer non scritti si perdono al riavvio:
+        # il giorno corrente viene ricalcolato da readings
+        lt = time.localtime()
+        today = int(time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, 0, 0, 0, 0, 0, -1)))
+        daily_stats.rebuild(conn, today, location=LOCATION)
+        conn.commit()
     conn.close()
 
 db_init()
 
+def _page_size():
+    conn = db_connect()
+    try:
+        return conn.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        conn.close()
+
+write_meter = write_coalescer.WriteMeter(page_size=_page_size(), stats_metrics=len(daily_stats.METRICS), logger=logger)
+
 def db_cleanup_if_needed(now_ts):
     global _last_cleanup
     if (now_ts - _last_cleanup) < _CLEANUP_EVERY_SEC:
@@ -249,25 +303,23 @@ def db_cleanup_if_needed(now_ts):
     cutoff = now_ts - RETENTION_DAYS * 86400
     conn = db_connect()
     conn.execute("DELETE FROM readings WHERE ts < ?", (cutoff,))
+    readings_ext.cleanup(conn, cutoff)
     conn.commit()
     conn.close()
     logger.info(f"[DB] Retention cleanup: deleted rows older than {RETENTION_DAYS} days.")
 
-def db_insert_reading(d, ts):
-    conn = db_connect()
-    conn.execute("""
-      INSERT INTO readings (
-        ts, location, temperature, humidity, windspeed, winddir, pressure, solarradiation, uv,
-        rainratein, eventrainin, hourlyrainin, last24hrainin, dailyrainin, weeklyrainin, monthlyrainin, yearlyrainin
-      ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-    """, (
-        ts, d["location"], d["temperature"], d["humidity"], d["windspeed"], d["winddir"], d["pressure"], d["solarradiation"], d["uv"],
-        d["rainratein"], d["eventrainin"], d["hourlyrainin"], d["last24hrainin"], d["dailyrainin"], d["weeklyrainin"], d["monthlyrainin"], d["yearlyrainin"]
-    ))
-    conn.commit()
-    conn.close()
+_INSERT_READING_SQL = (
+    f"INSERT OR IGNORE INTO readings (ts, location, {', '.join(fields.CORE)}) "
+    f"VALUES ({','.join('?' * (len(fields.CORE) + 2))})"
+)
+
+def db_insert_reading(conn, d, ts):
+    """True se la riga e' nuova (False: (location, ts) gia' presente, re-invio)."""
+    # con il coalescing le colonne invariate arrivano a None (NULL)
+    cur = conn.execute(_INSERT_READING_SQL, (ts, d["location"], *(d[c] for c in fields.CORE)))
+    return cur.rowcount == 1
 
-def db_upsert_rain_rollup(d, ts):
+def db_upsert_rain_rollup(conn, d, ts):
     day = _yyyymmdd(ts)
     rr = inch_to_mm(d.get("rainratein", 0.0))
     ev = inch_to_mm(d.get("eventrainin", 0.0))
@@ -278,12 +330,11 @@ def db_upsert_rain_rollup(d, ts):
     mo = inch_to_mm(d.get("monthlyrainin", 0.0))
     yr = inch_to_mm(d.get("yearlyrainin", 0.0))
 
-    conn = db_connect()
     conn.execute("""
       INSERT INTO rain_rollup_daily
-        (day, ts, rainrate_mm, event_mm, hourly_mm, last24h_mm, daily_mm, weekly_mm, monthly_mm, yearly_mm)
-      VALUES (?,?,?,?,?,?,?,?,?,?)
-      ON CONFLICT(day) DO UPDATE SET
+        (location, day, ts, rainrate_mm, event_mm, hourly_mm, last24h_mm, daily_mm, weekly_mm, monthly_mm, yearly_mm)
+      VALUES (?,?,?,?,?,?,?,?,?,?,?)
+      ON CONFLICT(location, day) DO UPDATE SET
         ts=excluded.ts,
         rainrate_mm=excluded.rainrate_mm,
         event_mm=excluded.event_mm,
@@ -293,51 +344,120 @@ def db_upsert_rain_rollup(d, ts):
         weekly_mm=excluded.weekly_mm,
         monthly_mm=excluded.monthly_mm,
         yearly_mm=excluded.yearly_mm
-    """, (day, ts, rr, ev, hr, l24, dy, wk, mo, yr))
-    conn.commit()
-    conn.close()
-
-def db_history(hours=24):
-    hours = max(1, min(int(hours), 168))
-    since = int(time.time()) - hours * 3600
-
+      WHERE excluded.ts >= rain_rollup_daily.ts
+    """, (d["location"], day, ts, rr, ev, hr, l24, dy, wk, mo, yr))
+
+def _daily_stats_values(d, ext):
+    # rollup "stats" del registro (core + ext presenti) + totale pioggia del giorno
+    values = {m: d[m] for m in fields.CORE if fields.has_stats(m)}
+    values.update((m, v) for m, v in ext.items() if fields.has_stats(m))
+    values["rain_mm"] = inch_to_mm(d.get("dailyrainin", 0.0))
+    return values
+
+def db_write_reading(d, ext, ts, is_latest):
+    """
+    Scrive una lettura (riga, metriche ext, rollup pioggia, daily_stats) in
+    un solo commit. Con WRITE_COALESCE decide il coalescer cosa scrivere;
+    gli invii in ritardo (non is_latest) vanno sempre scritti completi.
+    Un re-invio (stesso ts gia' scritto) non tocca daily_stats ne' il contatore.
+    """
+    with write_lock:
+        if coalescer is not None and is_latest and coalescer.seen(ts):
+            write_meter.record_duplicate(ts)
+            return
+        if coalescer is None or not is_latest:
+            row, rollup = d, True
+            ext_row = ext_filter.take(ext, ts) if (ext_filter is not None and is_latest) else ext
+            stats = [(d["location"], m, _yyyymmdd(ts), 1, float(v), float(v), float(v))
+                     for m, v in _daily_stats_values(d, ext).items()]
+        else:
+            coalescer.add_stats(_daily_stats_values(d, ext), _yyyymmdd(ts), d["location"])
+            row = coalescer.row(d, ts)
+            ext_row = coalescer.ext(ext)
+            rollup = coalescer.rain_changed(d, ts)
+            # daily_stats in memoria finche' non si scrive comunque qualcosa
+            stats = coalescer.take_stats() if (row is not None or ext_row) else []
+            if row is not None:
+                row["location"] = d["location"]
+
+        if row is not None or ext_row or rollup or stats:
+            conn = db_connect()
+            try:
+                rev = None if is_latest else history_engine.revision(conn)
+                if row is not None and not db_insert_reading(conn, row, ts):
+                    # riga gia' presente: re-invio, niente da aggiungere
+                    conn.rollback()
+                    write_meter.record_duplicate(ts)
+                    return
+                if rev is not None:
+                    # riga completa in ritardo tra righe sparse: le sparse successive
+                    # restano "come la riga precedente" a quando sono state scritte
+                    history_engine.pin_sparse(conn, d["location"], ts, ts, rev)
+                if ext_row:
+                    readings_ext.insert(conn, d["location"], ts, ext_row)
+                if rollup:
+                    db_upsert_rain_rollup(conn, d, ts)
+                if stats:
+                    daily_stats.merge(conn, stats)
+                conn.commit()
+            finally:
+                conn.close()
+
+    sparse = row is not None and any(row.get(c) is None for c in write_coalescer.COLUMNS)
+    write_meter.record(ts, row is not None, sparse, rollup, len(stats), len(ext_row), len(ext))
+
+def db_history(hours=24, since=None, bucket=60, agg="mean", station=None, metrics=None, rev=None):
+    """
+    Aggregati a bucket (default: medie al minuto) delle ultime `hours` ore
+    per la stazione `station` (default: LOCATION, la stazione locale).
+    `metrics`: chiavi da restituire (serie di history_engine o metriche ext);
+    None = le serie di default di history_engine.
+    Con `since` (epoch s) ritorna solo i bucket da quel bucket in poi:
+    il client passa `cursor` e `rev` della risposta precedente e riceve
+    l'ultimo bucket (eventualmente aggiornato) piu' quelli nuovi; se dopo
+    `rev` sono arrivate righe piu' vecchie (invii in ritardo, backfill) si
+    parte dal loro bucket. `since` nella risposta = da dove sostituire.
+    """
+    hours = max(1, min(int(hours), RETENTION_DAYS * 24))
+    bucket = max(60, min(int(bucket), 86400))
+    now = int(time.time())
+    window_start = now - hours * 3600
+    location = station or LOCATION
+
+    core = None if metrics is None else [m for m in metrics if m in history_engine.ALL_KEYS]
+    ext = [] if metrics is None else [m for m in metrics if m not in history_engine.ALL_KEYS]
+    # colonne NULL e serie ext: valore iniziale entro due keepalive
+    fill_lookback = max(history_engine.FILL_LOOKBACK_SEC, 2 * COALESCE_KEEPALIVE_SEC)
     conn = db_connect()
-    rows = conn.execute("""
-      SELECT
-        (ts/60)*60 AS tmin,
-
-        AVG(temperature) AS temperature,
-        AVG(humidity) AS humidity,
-        AVG(windspeed) AS windspeed,
-        AVG(winddir) AS winddir,
-        AVG(solarradiation) AS solarradiation,
-        AVG(uv) AS uv,
-
-        AVG(rainratein * 25.4) AS rainrate_mm,
-        AVG(eventrainin * 25.4) AS event_mm,
-        AVG(hourlyrainin * 25.4) AS hourly_mm,
-        AVG(last24hrainin * 25.4) AS last24h_mm,
-        AVG(dailyrainin * 25.4) AS daily_mm,
-        AVG(weeklyrainin * 25.4) AS weekly_mm,
-        AVG(monthlyrainin * 25.4) AS monthly_mm,
-        AVG(yearlyrainin * 25.4) AS yearly_mm
-
-      FROM readings
-      WHERE ts >= ?
-      GROUP BY tmin
-      ORDER BY tmin ASC
-    """, (since,)).fetchall()
-    conn.close()
-
-    keys = [
-        "temperature","humidity","windspeed","winddir","solarradiation","uv",
-        "rainrate_mm","event_mm","hourly_mm","last24h_mm","daily_mm","weekly_mm","monthly_mm","yearly_mm"
-    ]
-    out = {k: [] for k in keys}
-    for r in rows:
-        tmin = int(r["tmin"])
-        for k in keys:
-            out[k].append([tmin, float(r[k] or 0.0)])
+    try:
+        # revisione letta prima di aggregare: una riga che arriva nel mezzo
+        # viene restituita di nuovo alla richiesta successiva
+        rev_now = history_engine.revision(conn)
+        start = window_start
+        if since is not None:
+            start = history_engine.delta_start(conn, since, rev, bucket, window_start, location)
+        out = {}
+        if core is None or core:
+            out = history_engine.aggregate(conn, start, bucket=bucket, agg=agg, engine=HISTORY_ENGINE,
+                                           fill_lookback=fill_lookback, location=location, keys=core)
+        if ext:
+            out.update(history_engine.aggregate_ext(conn, ext, start, bucket=bucket, agg=agg,
+                                                    location=location, fill_lookback=fill_lookback))
+    finally:
+        conn.close()
+
+    # cursor = ultimo bucket restituito (da ripassare come `since`);
+    # il bucket corrente e' ancora aperto -> provvisorio
+    last = max((s[-1][0] for s in out.values() if s), default=None)
+    open_bucket = (now // bucket) * bucket
+    out["station"] = location
+    out["bucket"] = bucket
+    out["agg"] = agg
+    out["window_start"] = window_start
+    out["since"] = start if since is not None else None
+    out["cursor"] = last if last is not None else start
+    out["rev"] = rev_now
+    out["provisional"] = last if last == open_bucket else None
     return out
 
 # =========================
@@ -347,6 +467,10 @@ def db_history(hours=24):
 def index():
     return send_from_directory(BASE_DIR, "index.html")
 
+@app.route("/bench")
+def bench():
+    return send_from_directory(BASE_DIR, "bench.html")
+
 @app.route("/css/<path:filename>")
 def css_files(filename):
     return send_from_directory(CSS_DIR, filename)
@@ -392,6 +516,12 @@ def api_latest():
         "yearlyrain": round(inch_to_mm(d.get("yearlyrainin", 0.0)), 2),
     }
 
+    # ?metrics=temperature,windgust,rain_mm: solo quelle chiavi (+ location/time);
+    # una metrica mai ricevuta -> null
+    metrics = _arg_list("metrics")
+    if metrics:
+        d = {k: d.get(k) for k in ["location", "time"] + metrics}
+
     return jsonify(d)
 
 @app.route("/api/history")
@@ -401,70 +531,245 @@ def api_history():
         hours = int(hours)
     except:
         hours = 24
-    return jsonify(db_history(hours=hours))
+    since = request.args.get("since")
+    try:
+        since = int(since) if since else None
+    except:
+        since = None
+    rev = request.args.get("rev", type=int)
+    bucket = request.args.get("bucket", 60, type=int)
+    agg = request.args.get("agg", "mean")
+    if agg not in history_engine.AGGS:
+        agg = "mean"
+    station = request.args.get("station") or None
+    metrics = _arg_list("metrics") or None
+    out = db_history(hours=hours, since=since, bucket=bucket, agg=agg, station=station, metrics=metrics, rev=rev)
+
+    def generate():
+        # una serie per chunk: niente stringa unica da MB (720 h a 1 min: ~12 MB)
+        for i, (k, v) in enumerate(out.items()):
+            yield ("{" if i == 0 else ",") + json.dumps(k) + ":" + json.dumps(v, separators=(",", ":"))
+        yield "}"
+
+    return Response(generate(), mimetype="application/json")
+
+@app.route("/api/export")
+def api_export():
+    table = request.args.get("table", "readings")
+    fmt = request.args.get("format", "csv")
+    if table not in export_data.TABLES:
+        return jsonify({"error": "unknown table"}), 400
+    if fmt not in export_data.FORMATS:
+        return jsonify({"error": "unknown format"}), 400
+    if fmt in export_data.COLUMNAR and not export_data.columnar_available():
+        return jsonify({"error": f"{fmt} needs pyarrow on the server"}), 501
+    try:
+        ts_from = export_data.parse_time(request.args.get("from"))
+        ts_to = export_data.parse_time(request.args.get("to"), end=True)
+    except ValueError:
+        return jsonify({"error": "bad from/to"}), 400
+    fill = request.args.get("raw") not in ("1", "true")
+    # readings: stazione locale salvo ?station=<id> (o ?station=all)
+    station = request.args.get("station") or LOCATION
+    if station == "all":
+        station = None
+
+    def generate():
+        # connessione dedicata: resta aperta per tutta la risposta
+        conn = db_connect()
+        try:
+            for data in export_data.stream(conn, table, fmt, ts_from, ts_to, fill=fill, station=station):
+                yield data
+        finally:
+            conn.close()
+
+    mimetype, ext = export_data.FORMATS[fmt]
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={table}.{ext}"},
+    )
+
+@app.route("/api/stations")
+def api_stations():
+    # stazioni presenti in readings (locale + nodi mesh del collector)
+    conn = db_connect()
+    try:
+        rows = conn.execute("""
+          SELECT location, COUNT(*) AS n, MIN(ts) AS first_ts, MAX(ts) AS last_ts
+          FROM readings GROUP BY location ORDER BY location
+        """).fetchall()
+    finally:
+        conn.close()
+    return jsonify([{"station": r["location"], "local": r["location"] == LOCATION, "rows": r["n"],
+                     "first_ts": r["first_ts"], "last_ts": r["last_ts"]} for r in rows])
+
+@app.route("/api/metrics")
+def api_metrics():
+    # metriche interrogabili: colonne di readings + serie ext viste finora
+    station = request.args.get("station") or LOCATION
+    conn = db_connect()
+    try:
+        ext = readings_ext.series(conn, station)
+    finally:
+        conn.close()
+    core = []
+    for k, col, factor in history_engine.SERIES + history_engine.OPTIONAL_SERIES:
+        # le serie pioggia di history sono gia' in mm
+        unit = fields.unit(col) if factor == 1.0 else fields.unit(col).replace("in", "mm")
+        core.append({"metric": k, "storage": "core", "unit": unit, "stats": fields.has_stats(col)})
+    for s in ext:
+        s["storage"] = "ext"
+        s["stats"] = fields.has_stats(s["metric"])
+    return jsonify({"station": station, "metrics": core + ext})
+
+@app.route("/api/storage/writes")
+def api_storage_writes():
+    # stima byte scritti per giorno: `bytes` effettivi, `full_bytes` senza coalescing
+    return jsonify({
+        "coalesce": WRITE_COALESCE,
+        "keepalive_sec": COALESCE_KEEPALIVE_SEC,
+        "deadband": COALESCE_DEADBAND if WRITE_COALESCE else None,
+        "days": write_meter.snapshot(),
+    })
+
+def _arg_day(name):
+    # YYYYMMDD o YYYY-MM-DD
+    v = (request.args.get(name) or "").replace("-", "")
+    try:
+        return int(v) if len(v) == 8 else None
+    except:
+        return None
+
+def _arg_list(name):
+    # "a,b , c" -> ["a", "b", "c"]
+    return [v.strip() for v in (request.args.get(name) or "").split(",") if v.strip()]
+
+def _arg_metric(default="temperature"):
+    metric = request.args.get("metric", default)
+    return metric if metric in daily_stats.METRICS or fields.has_stats(metric) else None
+
+def _arg_station():
+    # rollup giornalieri della stazione `station` (default: quella locale)
+    return request.args.get("station") or LOCATION
+
+@app.route("/api/stats")
+def api_stats():
+    station = _arg_station()
+    conn = db_connect()
+    try:
+        return jsonify({"station": station, "metrics": daily_stats.summary(conn, station)})
+    finally:
+        conn.close()
+
+@app.route("/api/stats/daily")
+def api_stats_daily():
+    metric = _arg_metric()
+    if metric is None:
+        return jsonify({"error": "unknown metric"}), 400
+    day_from = _arg_day("from") or _yyyymmdd(time.time() - 30 * 86400)
+    conn = db_connect()
+    try:
+        return jsonify({"metric": metric, "days": daily_stats.daily(conn, _arg_station(), metric, day_from, _arg_day("to"))})
+    finally:
+        conn.close()
+
+@app.route("/api/stats/monthly")
+def api_stats_monthly():
+    metric = _arg_metric()
+    if metric is None:
+        return jsonify({"error": "unknown metric"}), 400
+    conn = db_connect()
+    try:
+        return jsonify({"metric": metric, "months": daily_stats.monthly(conn, _arg_station(), metric, _arg_day("from"), _arg_day("to"))})
+    finally:
+        conn.close()
+
+@app.route("/api/stats/records")
+def api_stats_records():
+    month = request.args.get("month", type=int)
+    if "metric" in request.args:
+        metric = _arg_metric()
+        if metric is None:
+            return jsonify({"error": "unknown metric"}), 400
+        metrics = [metric]
+    else:
+        metrics = list(daily_stats.METRICS)
+    conn = db_connect()
+    try:
+        station = _arg_station()
+        return jsonify({m: daily_stats.records(conn, station, m, month) for m in metrics})
+    finally:
+        conn.close()
+
+@app.route("/api/stats/degreedays")
+def api_stats_degreedays():
+    base = request.args.get("base", 18.0, type=float)
+    conn = db_connect()
+    try:
+        return jsonify({"base": base, "months": daily_stats.degree_days(conn, _arg_station(), base, _arg_day("from"), _arg_day("to"))})
+    finally:
+        conn.close()
+
+@app.route("/api/stats/rain")
+def api_stats_rain():
+    by = "year" if request.args.get("by") == "year" else "month"
+    conn = db_connect()
+    try:
+        return jsonify({"by": by, "totals": daily_stats.rain_totals(conn, _arg_station(), by, _arg_day("from"), _arg_day("to"))})
+    finally:
+        conn.close()
+
+@app.route("/api/stats/thisday")
+def api_stats_thisday():
+    # MMDD, default oggi
+    mmdd = request.args.get("date", type=int) or (_yyyymmdd(time.time()) % 10000)
+    conn = db_connect()
+    try:
+        return jsonify({"date": mmdd, "years": daily_stats.this_day(conn, _arg_station(), mmdd)})
+    finally:
+        conn.close()
 
 # =========================
 # GW1100 UPLOAD
 # =========================
 @app.route("/ecowitt", methods=["POST"])
 def ecowitt_upload():
-    global latest_data
+    global latest_data, _latest_ts
     try:
         form = request.form.to_dict()
         if not form:
             logger.warning("[GW1100] Empty POST or not form-urlencoded")
             return "NO DATA", 400
 
-        ts = int(time.time())
-
-        tempf = safe_float(form.get("tempf", 0))
-        humidity = safe_float(form.get("humidity", 0))
-        wind_mph = safe_float(form.get("windspeedmph", 0))
-        winddir = safe_float(form.get("winddir", 0))
-
-        baromrelin = safe_float(form.get("baromrelin", 0))
-        pressure_hpa = inhg_to_hpa(baromrelin)
+        now = int(time.time())
+        ts = now
+        gw_ts = backfill.parse_dateutc(form.get("dateutc")) if USE_GATEWAY_TIME else None
+        if gw_ts is not None and (now - GATEWAY_TIME_MAX_AGE) <= gw_ts <= (now + 300):
+            ts = gw_ts
 
-        solarradiation = safe_float(form.get("solarradiation", 0))
-        uv = safe_float(form.get("uv", 0))
-
-        rainratein = safe_float(form.get("rainratein", 0))
-        eventrainin = safe_float(form.get("eventrainin", 0))
-        hourlyrainin = safe_float(form.get("hourlyrainin", 0))
-        last24hrainin = safe_float(form.get("last24hrainin", 0))
-        dailyrainin = safe_float(form.get("dailyrainin", 0))
-        weeklyrainin = safe_float(form.get("weeklyrainin", 0))
-        monthlyrainin = safe_float(form.get("monthlyrainin", 0))
-        yearlyrainin = safe_float(form.get("yearlyrainin", 0))
+        # tutte le chiavi del registro: colonne di readings + metriche ext presenti
+        r, ext = fields.parse(form)
 
         with data_lock:
-            latest_data["location"] = LOCATION
-            latest_data["time"] = time.strftime("%H:%M:%S")
-
-            latest_data["temperature"] = round(f_to_c(tempf), 2)
-            latest_data["humidity"] = int(round(humidity, 0))
-
-            latest_data["windspeed"] = round(mph_to_kmh(wind_mph), 2)
-            latest_data["winddir"] = round(winddir, 1)
-
-            latest_data["pressure"] = round(pressure_hpa, 2)
-
-            latest_data["solarradiation"] = round(solarradiation, 1)
-            latest_data["uv"] = round(uv, 1)
-
-            latest_data["rainratein"] = round(rainratein, 4)
-            latest_data["eventrainin"] = round(eventrainin, 4)
-            latest_data["hourlyrainin"] = round(hourlyrainin, 4)
-            latest_data["last24hrainin"] = round(last24hrainin, 4)
-            latest_data["dailyrainin"] = round(dailyrainin, 4)
-            latest_data["weeklyrainin"] = round(weeklyrainin, 4)
-            latest_data["monthlyrainin"] = round(monthlyrainin, 4)
-            latest_data["yearlyrainin"] = round(yearlyrainin, 4)
-
-            snap = dict(latest_data)
-
-        db_insert_reading(snap, ts)
-        db_upsert_rain_rollup(snap, ts)
+            # un invio in ritardo (ts piu' vecchio) va nel DB ma non sovrascrive latest
+            if ts >= _latest_ts:
+                _latest_ts = ts
+                latest_data.update(r)
+                latest_data.update(ext)
+                latest_data["location"] = LOCATION
+                latest_data["time"] = time.strftime("%H:%M:%S", time.localtime(ts))
+                snap = dict(latest_data)
+                is_latest = True
+            else:
+                snap = dict(latest_data, **r, **ext)
+                is_latest = False
+
+        # solo accodamento: il broker non rallenta mai la risposta al gateway
+        if mqtt_pub is not None and is_latest:
+            mqtt_pub.submit(snap, ts)
+
+        db_write_reading(snap, ext, ts, is_latest)
         db_cleanup_if_needed(ts)
 
         return "OK", 200
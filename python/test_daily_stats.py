@@ -0,0 +1,53 @@
+# test_daily_stats.py
+# Test di daily_stats su un DB in memoria: python3 -m pytest -q python/
+import sqlite3
+
+import daily_stats
+import fields
+import history_engine
+
+T0 = 1_700_000_040
+
+
+def _db():
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"""
+      CREATE TABLE readings (ts INTEGER NOT NULL, location TEXT,
+                             {", ".join(f"{c} REAL" for c in fields.CORE)})
+    """)
+    conn.execute("CREATE UNIQUE INDEX ux_readings_location_ts ON readings(location, ts)")
+    history_engine.ensure_sparse_index(conn)
+    conn.execute("CREATE TABLE rain_rollup_daily (location TEXT NOT NULL, day INTEGER NOT NULL, daily_mm REAL)")
+    return conn
+
+
+def _insert(conn, location, ts, temp):
+    row = {c: 0.0 for c in fields.CORE}
+    row["temperature"] = temp
+    conn.execute(f"INSERT INTO readings (ts, location, {', '.join(fields.CORE)}) "
+                 f"VALUES ({','.join('?' * (len(fields.CORE) + 2))})",
+                 (ts, location, *(row[c] for c in fields.CORE)))
+
+
+def test_stations_kept_apart():
+    # stazione locale e nodo mesh remoto negli stessi giorni: primo avvio,
+    # poi rebuild del solo nodo remoto (backfill): la locale resta intatta
+    conn = _db()
+    for i in range(10):
+        _insert(conn, "LOCAL", T0 + 60 * i, 10.0)
+        _insert(conn, "REMOTE", T0 + 60 * i, 30.0)
+    daily_stats.init(conn, "LOCAL")
+    day = daily_stats.summary(conn, "LOCAL")["temperature"]["last_day"]
+
+    def temp(location):
+        return daily_stats.daily(conn, location, "temperature", day, day)[0]
+
+    local = temp("LOCAL")
+    assert (local["min"], local["max"]) == (10.0, 10.0)
+    assert temp("REMOTE")["min"] == 30.0
+
+    _insert(conn, "REMOTE", T0 + 60 * 10, 40.0)
+    daily_stats.rebuild(conn, T0, T0 + 600, location="REMOTE")
+    assert temp("LOCAL") == local
+    assert temp("REMOTE")["max"] == 40.0
@@ -0,0 +1,247 @@
+# write_coalescer.py
+# Riduce le scritture su SD: il GW1100 invia ogni ~16 s, ma di notte solar,
+# uv e i contatori pioggia restano fermi per ore.
+#  - una riga in `readings` solo se almeno una metrica cambia oltre la sua
+#    deadband; le colonne invariate sono NULL ("come la riga precedente") e
+#    vengono ricostruite in lettura (history_engine / export_data)
+#  - almeno una riga completa ogni `keepalive` secondi (e al cambio giorno):
+#    e' il punto di partenza per ricostruire le colonne NULL
+#  - rain_rollup_daily solo quando i contatori pioggia cambiano
+#  - metriche ext (readings_ext): solo quelle cambiate oltre la deadband,
+#    tutte insieme alla riga completa di keepalive. Senza coalescing
+#    ExtFilter fa lo stesso per le sole ext (batterie, maxdailygust, ...
+#    cambiano di rado)
+#  - daily_stats accumulato in memoria e scritto insieme alla riga successiva
+# WriteMeter stima i byte scritti al giorno, con e senza coalescing.
+import threading
+import time
+
+import fields
+
+# colonne valore di `readings` (stesso ordine dello schema)
+COLUMNS = list(fields.CORE)
+RAIN_COLUMNS = list(fields.RAIN)
+
+# variazione minima da registrare (unita' di `readings`); assente -> qualunque variazione
+DEFAULT_DEADBAND = {
+    "temperature": 0.1,      # °C
+    "humidity": 1,           # %
+    "windspeed": 1.0,        # km/h
+    "winddir": 10.0,         # gradi (differenza circolare)
+    "pressure": 0.1,         # hPa
+    "solarradiation": 5.0,   # W/m²
+    "uv": 0.1,
+    "windgust": 1.0,         # km/h (ext)
+    "indoortemp": 0.1,       # °C (ext)
+}
+_EPS = 1e-9
+
+
+def _yyyymmdd(ts):
+    lt = time.localtime(ts)
+    return lt.tm_year * 10000 + lt.tm_mon * 100 + lt.tm_mday
+
+
+def _changed(col, old, new, deadband):
+    if old is None:
+        return True
+    diff = abs(float(new) - float(old))
+    if fields.is_circular(col):
+        diff %= 360.0
+        diff = min(diff, 360.0 - diff)
+    if diff == 0.0:
+        return False
+    return diff >= deadband.get(col, 0.0) - _EPS
+
+
+class WriteCoalescer:
+    """
+    Decide cosa scrivere per ogni lettura. Non e' thread-safe: il chiamante
+    serializza le letture (server.write_lock).
+    """
+
+    def __init__(self, deadband=None, keepalive=300):
+        self.deadband = dict(DEFAULT_DEADBAND if deadband is None else deadband)
+        self.keepalive = int(keepalive)
+        self._stored = {}        # colonna -> ultimo valore scritto
+        self._ext = {}           # metrica ext -> ultimo valore scritto
+        self._full = False       # l'ultima row() era una riga completa
+        self._last_ts = None     # ts dell'ultima lettura passata a row()
+        self._full_ts = None     # ts dell'ultima riga completa
+        self._full_day = None
+        self._rain = None        # (giorno, contatori) dell'ultimo upsert rollup
+        self._stats = {}         # (stazione, metrica, giorno) -> [n, sum, min, max]
+
+    def seen(self, ts):
+        """True se `ts` e' gia' stato passato a row() (re-invio della stessa lettura)."""
+        return ts == self._last_ts
+
+    def row(self, values, ts):
+        """
+        `values`: colonna -> valore. Ritorna la riga da inserire (colonne
+        invariate a None), oppure None se non c'e' niente da scrivere.
+        """
+        self._last_ts = ts
+        day = _yyyymmdd(ts)
+        if (self._full_ts is None or ts - self._full_ts >= self.keepalive
+                or ts < self._full_ts or day != self._full_day):
+            self._full_ts = ts
+            self._full_day = day
+            self._stored = {c: values[c] for c in COLUMNS}
+            self._full = True
+            return dict(self._stored)
+
+        self._full = False
+        out = {}
+        for c in COLUMNS:
+            v = values[c]
+            if _changed(c, self._stored.get(c), v, self.deadband):
+                self._stored[c] = v
+                out[c] = v
+            else:
+                out[c] = None
+        if all(v is None for v in out.values()):
+            return None
+        return out
+
+    def ext(self, values):
+        """
+        Metriche ext da scrivere per la lettura appena passata a row():
+        tutte se row() ha prodotto una riga completa, altrimenti le cambiate.
+        """
+        if self._full:
+            self._ext = dict(values)
+            return dict(values)
+        out = {}
+        for m, v in values.items():
+            if _changed(m, self._ext.get(m), v, self.deadband):
+                self._ext[m] = v
+                out[m] = v
+        return out
+
+    def rain_changed(self, values, ts):
+        key = (_yyyymmdd(ts), tuple(values[c] for c in RAIN_COLUMNS))
+        if key == self._rain:
+            return False
+        self._rain = key
+        return True
+
+    def add_stats(self, values, day, location):
+        for m, v in values.items():
+            if v is None:
+                continue
+            v = float(v)
+            s = self._stats.get((location, m, day))
+            if s is None:
+                self._stats[(location, m, day)] = [1, v, v, v]
+            else:
+                s[0] += 1
+                s[1] += v
+                s[2] = min(s[2], v)
+                s[3] = max(s[3], v)
+
+    def take_stats(self):
+        """[(stazione, metrica, giorno, n, sum, min, max)] accumulati; svuota il buffer."""
+        out = [(*k, *s) for k, s in self._stats.items()]
+        self._stats = {}
+        return out
+
+
+class ExtFilter:
+    """
+    Metriche ext da scrivere quando il coalescing e' spento: una metrica va
+    scritta se cambia (oltre `deadband`, se indicata) o se l'ultima scrittura
+    ha piu' di `keepalive` secondi. Il chiamante serializza (server.write_lock).
+    """
+
+    def __init__(self, keepalive=300, deadband=None):
+        self.keepalive = int(keepalive)
+        self.deadband = dict(deadband or {})
+        self._stored = {}        # metrica -> (valore, ts) dell'ultima scrittura
+
+    def take(self, values, ts):
+        out = {}
+        for m, v in values.items():
+            last = self._stored.get(m)
+            if (last is None or ts - last[1] >= self.keepalive or ts < last[1]
+                    or _changed(m, last[0], v, self.deadband)):
+                self._stored[m] = (v, ts)
+                out[m] = v
+        return out
+
+
+class WriteMeter:
+    """
+    Stima delle scritture per giorno. Modello: ogni commit in WAL scrive un
+    frame (pagina + 24 byte) per ogni pagina b-tree toccata; un INSERT in
+    readings tocca tabella + 2 indici, un upsert rollup 1 pagina, un upsert
+    daily_stats una pagina per metrica, ogni valore ext la pagina della sua
+    serie. "full" e' quanto avrebbe scritto la
+    stessa lettura senza coalescing.
+    """
+
+    KEEP_DAYS = 7
+
+    def __init__(self, page_size=4096, stats_metrics=7, logger=None):
+        self.frame = page_size + 24
+        self.stats_metrics = stats_metrics
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._days = {}
+
+    def _day(self, ts):
+        day = _yyyymmdd(ts)
+        d = self._days.get(day)
+        if d is None:
+            if self._days and self.logger is not None:
+                prev = max(self._days)
+                if prev < day:
+                    self._log(prev, self._days[prev])
+            d = self._days[day] = {"uploads": 0, "duplicates": 0, "rows": 0, "sparse_rows": 0, "skipped": 0,
+                                   "rollup_writes": 0, "stats_writes": 0, "ext_values": 0,
+                                   "frames": 0, "full_frames": 0}
+            for old in sorted(self._days)[:-self.KEEP_DAYS]:
+                del self._days[old]
+        return d
+
+    def record(self, ts, row_written, sparse, rollup_written, stats_rows, ext_written=0, ext_total=0):
+        with self._lock:
+            d = self._day(ts)
+            d["uploads"] += 1
+            d["full_frames"] += 3 + 1 + self.stats_metrics + ext_total
+            d["ext_values"] += ext_written
+            d["frames"] += ext_written
+            if row_written:
+                d["rows"] += 1
+                d["sparse_rows"] += 1 if sparse else 0
+                d["frames"] += 3
+            else:
+                d["skipped"] += 1
+            if rollup_written:
+                d["rollup_writes"] += 1
+                d["frames"] += 1
+            if stats_rows:
+                d["stats_writes"] += 1
+                d["frames"] += min(stats_rows, self.stats_metrics)
+
+    def record_duplicate(self, ts):
+        # re-invio di una lettura gia' scritta: nessuna scrittura
+        with self._lock:
+            d = self._day(ts)
+            d["uploads"] += 1
+            d["duplicates"] += 1
+
+    def _bytes(self, d):
+        return {"bytes": d["frames"] * self.frame, "full_bytes": d["full_frames"] * self.frame}
+
+    def _log(self, day, d):
+        b = self._bytes(d)
+        ratio = (b["bytes"] / b["full_bytes"] * 100.0) if b["full_bytes"] else 0.0
+        self.logger.info(
+            f"[DB] Writes {day}: {d['uploads']} uploads, {d['rows']} rows "
+            f"({d['sparse_rows']} sparse), est. {b['bytes'] / 1e6:.2f} MB "
+            f"vs {b['full_bytes'] / 1e6:.2f} MB without coalescing ({ratio:.1f}%)")
+
+    def snapshot(self):
+        with self._lock:
+            return [{"day": day, **d, **self._bytes(d)} for day, d in sorted(self._days.items())]
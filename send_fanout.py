@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# send_fanout.py
+# Un solo invio verso piu' radio e canali: legge /api/latest una volta,
+# costruisce ogni formato una volta (mesh_reports.Reports) e lo consegna a
+# tutti i TARGETS in parallelo. I target sulla stessa radio condividono una
+# connessione (un solo handshake) e partono in sequenza; radio diverse vanno
+# in thread separati. Ogni target ha il suo timeout: una radio bloccata non
+# ritarda le altre. Alla fine: riepilogo latenze per target.
+# Con USE_OUTBOX i formati non consegnati finiscono in mesh_outbox (li
+# invia `mesh_outbox.py --drain`); un invio riuscito scarta i report
+# ancora in coda per lo stesso target.
+#
+#   ./send_fanout.py                      # TARGETS qui sotto
+#   ./send_fanout.py --config fanout.json # lista target in JSON (stesso formato)
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from mesh_outbox import target_name
+from mesh_reports import FORMATS, SERVER_API, Reports, fetch_latest, open_interface, send_payload
+
+# =========================
+# CONFIG
+# =========================
+LOGFILE = "./meshtastic_fanout.log"
+DEFAULT_TIMEOUT = 30.0  # s, dall'inizio dell'invio
+USE_OUTBOX = True       # invii falliti -> data/mesh_outbox.db
+
+# interface: "serial" (device = porta) | "tcp" (device = host)
+# formats: "text" | "telemetry" | "compact"
+# want_ack: per i messaggi consegnati dall'outbox, registra l'ack del nodo
+# name: default target_name() ("serial:/dev/ttyUSB0:ch0"), lo stesso degli
+# script singoli: l'outbox sostituisce i report in coda per nome, un nome
+# diverso per la stessa radio/canale li lascerebbe partire due volte
+TARGETS = [
+    {"interface": "serial", "device": "/dev/ttyUSB0", "channel": 0, "formats": ["text"]},
+    {"interface": "serial", "device": "/dev/ttyUSB0", "channel": 1, "formats": ["telemetry", "compact"]},
+    # {"interface": "tcp", "device": "192.168.1.50", "channel": 0, "formats": ["text"], "timeout": 20},
+]
+
+# =========================
+# LOGGING
+# =========================
+logger = logging.getLogger("meshtastic_sender")
+logger.setLevel(logging.INFO)
+
+handler = RotatingFileHandler(LOGFILE, maxBytes=1_000_000, backupCount=5)
+formatter = logging.Formatter("[%(asctime)s] %(levelname)s - %(message)s")
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+console = logging.StreamHandler()
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+# =========================
+# TARGETS
+# =========================
+def load_targets(path=None):
+    targets = TARGETS
+    if path:
+        with open(path, encoding="utf-8") as f:
+            targets = json.load(f)
+    out, names = [], set()
+    for i, t in enumerate(targets):
+        kind = t.get("interface", "serial")
+        if kind not in ("serial", "tcp"):
+            raise ValueError(f"target {i}: unknown interface {kind!r}")
+        formats = t.get("formats") or ["text"]
+        bad = [f for f in formats if f not in FORMATS]
+        if bad:
+            raise ValueError(f"target {i}: unknown formats {bad}")
+        out.append({
+            "name": t.get("name") or target_name(kind, t["device"], int(t.get("channel", 0))),
+            "interface": kind,
+            "device": t["device"],
+            "channel": int(t.get("channel", 0)),
+            "formats": formats,
+            "timeout": float(t.get("timeout", DEFAULT_TIMEOUT)),
+            "want_ack": bool(t.get("want_ack", False)),
+        })
+        if out[-1]["name"] in names:
+            raise ValueError(f"target {i}: duplicate name {out[-1]['name']!r}")
+        names.add(out[-1]["name"])
+    return out
+
+
+# =========================
+# SEND
+# =========================
+def _device_worker(targets, reports, t0, results, done, sent, cancelled, opener):
+    """
+    Un thread per radio: una connessione, poi i target in sequenza. I formati
+    consegnati vanno subito in sent[nome]; un target scaduto (cancelled) non
+    invia piu' nulla.
+    """
+    kind, device = targets[0]["interface"], targets[0]["device"]
+    try:
+        iface = opener(kind, device)
+    except Exception as e:
+        for t in targets:
+            results[t["name"]] = {"status": "error", "error": f"connect: {e}", "total": time.monotonic() - t0}
+            done[t["name"]].set()
+        return
+    connected = time.monotonic() - t0
+    try:
+        for t in targets:
+            start = time.monotonic()
+            res = {"connect": connected, "sent": sent[t["name"]]}
+            try:
+                for fmt in t["formats"]:
+                    if cancelled[t["name"]].is_set():
+                        raise TimeoutError("cancelled")
+                    p = reports.payload(fmt)
+                    if p is None:
+                        logger.info(f"[{t['name']}] {fmt}: not available, skipped")
+                        continue
+                    send_payload(iface, p[0], p[1], t["channel"])
+                    res["sent"].append(fmt)
+                res["status"] = "ok"
+            except Exception as e:
+                res["status"] = "error"
+                res["error"] = str(e)
+            res["send"] = time.monotonic() - start
+            res["total"] = time.monotonic() - t0
+            results[t["name"]] = res
+            done[t["name"]].set()
+    finally:
+        try:
+            iface.close()
+        except Exception:
+            pass
+
+
+def fanout(targets, reports, opener=open_interface):
+    """
+    Invia a tutti i target; ritorna {nome: risultato}. Un target che non
+    finisce entro il suo timeout risulta "timeout" con i formati consegnati
+    fino a quel momento; il thread (daemon) viene abbandonato e non invia
+    altri formati per quel target.
+    """
+    by_device = {}
+    for t in targets:
+        by_device.setdefault((t["interface"], t["device"]), []).append(t)
+
+    results = {}
+    done = {t["name"]: threading.Event() for t in targets}
+    cancelled = {t["name"]: threading.Event() for t in targets}
+    sent = {t["name"]: [] for t in targets}
+    t0 = time.monotonic()
+    for (kind, device), group in by_device.items():
+        threading.Thread(
+            target=_device_worker, args=(group, reports, t0, results, done, sent, cancelled, opener),
+            name=f"fanout-{device}", daemon=True,
+        ).start()
+
+    out = {}
+    for t in targets:
+        left = t["timeout"] - (time.monotonic() - t0)
+        if done[t["name"]].wait(max(0.0, left)):
+            out[t["name"]] = results[t["name"]]
+        else:
+            # da qui il worker non invia altro: l'outbox riceve solo i formati
+            # non confermati (al piu' quello in volo potrebbe arrivare due volte)
+            cancelled[t["name"]].set()
+            out[t["name"]] = {"status": "timeout", "sent": list(sent[t["name"]]), "total": time.monotonic() - t0}
+    return out
+
+
+def summary(targets, results):
+    lines = [f"{'target':<20} {'device':<18} {'ch':>2}  {'status':<7} {'connect':>8} {'send':>7} {'total':>7}  sent"]
+    for t in targets:
+        r = results[t["name"]]
+        fmt = lambda k: f"{r[k]:.2f}s" if k in r else "-"
+        lines.append(
+            f"{t['name']:<20} {t['device']:<18} {t['channel']:>2}  {r['status']:<7} "
+            f"{fmt('connect'):>8} {fmt('send'):>7} {fmt('total'):>7}  "
+            f"{','.join(r.get('sent', []))} {r.get('error', '')}".strip()
+        )
+    return "\n".join(lines)
+
+
+def outbox_update(targets, results, reports):
+    """Accoda in outbox i formati non consegnati; ritorna i target accodati."""
+    import mesh_outbox
+
+    queued = []
+    for t in targets:
+        sent = set(results[t["name"]].get("sent", []))
+        unsent = []
+        for fmt in t["formats"]:
+            p = reports.payload(fmt)
+            if fmt not in sent and p is not None:
+                unsent.append((f"report:{fmt}", p[0], p[1]))
+        mesh_outbox.after_direct_send(t, [f"report:{f}" for f in sent], unsent, want_ack=t["want_ack"])
+        if unsent:
+            queued.append(t["name"])
+    return queued
+
+# =========================
+# MAIN
+# =========================
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Invio del report meteo a piu' radio/canali Meshtastic in parallelo")
+    ap.add_argument("--config", help="file JSON con la lista dei target (default: TARGETS nello script)")
+    ap.add_argument("--api", default=SERVER_API, help=f"endpoint latest (default {SERVER_API})")
+    args = ap.parse_args(argv)
+
+    targets = load_targets(args.config)
+    wanted = {f for t in targets for f in t["formats"]}
+
+    protos = None
+    if wanted - {"text"}:
+        from meshtastic_imports import load_meshtastic_protos
+        protos = load_meshtastic_protos()
+
+    d = fetch_latest(args.api)
+    logger.info("Fetched latest OK")
+    # tutti i formati costruiti qui, una volta: i thread leggono solo la cache
+    reports = Reports(d, protos).prepare(sorted(wanted))
+
+    results = fanout(targets, reports)
+    logger.info("Fan-out summary:\n" + summary(targets, results))
+
+    failed = [n for n, r in results.items() if r["status"] != "ok"]
+    lost = failed
+    if USE_OUTBOX:
+        try:
+            queued = outbox_update(targets, results, reports)
+            if queued:
+                logger.warning(f"[QUEUED] Outbox: {queued}")
+            lost = [n for n in failed if n not in queued]
+        except Exception as e:
+            logger.error(f"[ERROR] Outbox: {e}")
+    if any(r["status"] == "timeout" for r in results.values()):
+        # una radio bloccata puo' tenere vivi thread della libreria: uscita immediata
+        logger.error(f"[ERROR] Timed out: {failed}")
+        logging.shutdown()
+        os._exit(2 if lost else 0)
+    if lost:
+        logger.error(f"[ERROR] Failed: {lost}")
+        return 1
+    logger.info("[OK] Done")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
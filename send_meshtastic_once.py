@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 import logging
 from logging.handlers import RotatingFileHandler
-import requests
 import meshtastic.serial_interface
 
+from mesh_outbox import after_direct_send, target_name
+from mesh_reports import build_report, fetch_latest
+
 # =========================
 # CONFIG
 # =========================
@@ -12,6 +14,9 @@ SERIAL_PORT = "/dev/ttyUSB0"
 CHANNEL_INDEX = 0
 LOGFILE = "./meshtastic_send.log"
 
+# Se l'invio fallisce il report va in data/mesh_outbox.db (mesh_outbox.py --drain)
+USE_OUTBOX = True
+
 # =========================
 # LOGGING
 # =========================
@@ -27,68 +32,6 @@ console = logging.StreamHandler()
 console.setFormatter(formatter)
 logger.addHandler(console)
 
-# =========================
-# UTILS
-# =========================
-def safe_float(val):
-    try:
-        return float(val)
-    except:
-        return 0.0
-
-def safe_int(val):
-    try:
-        return int(round(float(val), 0))
-    except:
-        return 0
-
-def deg_to_cardinal_16(deg):
-    dirs = ["N","NNE","NE","ENE","E","ESE","SE","SSE",
-            "S","SSW","SW","WSW","W","WNW","NW","NNW"]
-    try:
-        return dirs[int((float(deg) + 11.25) / 22.5) % 16]
-    except:
-        return "--"
-
-# =========================
-# FETCH DATA
-# =========================
-def fetch_latest():
-    r = requests.get(SERVER_API, timeout=5)
-    r.raise_for_status()
-    return r.json()
-
-# =========================
-# BUILD TEXT REPORT
-# =========================
-def build_report(d):
-
-    location = d.get("location", "UNKNOWN")
-    t = d.get("time", "--:--:--")
-
-    temperature = safe_float(d.get("temperature"))
-    humidity = safe_int(d.get("humidity"))
-    windspeed = safe_float(d.get("windspeed"))       # km/h
-    winddir = safe_float(d.get("winddir"))           # deg
-    pressure = safe_float(d.get("pressure"))         # hPa
-
-    solarradiation = safe_float(d.get("solarradiation"))  # W/m²
-    uv = safe_float(d.get("uv"))                           # UV index
-
-    rain_mm = d.get("rain_mm") or {}
-    rainrate = safe_float(rain_mm.get("rainrate"))         # mm/h (già convertito nel server)
-
-    wind_cardinal = deg_to_cardinal_16(winddir)
-
-    # 4 righe
-    report = (
-        f"Map:{location}  {t}\n"
-        f"T: {temperature:.1f}°C  H: {humidity:d}%  P: {pressure:.0f} hPa\n"
-        f"W: {windspeed:.1f} km/h ({wind_cardinal})  R: {rainrate:.2f} mm/h\n"
-        f"SR: {solarradiation:.0f}  W/m² UV: {uv:.1f}"
-    )
-    return report
-
 # =========================
 # SEND
 # =========================
@@ -104,14 +47,25 @@ def send_meshtastic_text(report):
 # =========================
 if __name__ == "__main__":
     try:
-        d = fetch_latest()
+        d = fetch_latest(SERVER_API)
         logger.info("Dati ricevuti da server OK")
 
         report = build_report(d)
         logger.info(f"Report generato:\n{report}")
 
-        send_meshtastic_text(report)
-        logger.info(f"[OK] Messaggio inviato su Meshtastic CH={CHANNEL_INDEX}")
+        target = {"name": target_name("serial", SERIAL_PORT, CHANNEL_INDEX),
+                  "interface": "serial", "device": SERIAL_PORT, "channel": CHANNEL_INDEX}
+        try:
+            send_meshtastic_text(report)
+        except Exception as e:
+            if not USE_OUTBOX:
+                raise
+            after_direct_send(target, [], [("report:text", None, report)])
+            logger.warning(f"[QUEUED] Invio fallito ({e}), report in outbox")
+        else:
+            if USE_OUTBOX:
+                after_direct_send(target, ["report:text"], [])
+            logger.info(f"[OK] Messaggio inviato su Meshtastic CH={CHANNEL_INDEX}")
 
     except Exception as e:
         logger.error(f"[ERROR] Invio fallito: {e}")
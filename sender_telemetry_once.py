@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
-import json
 import logging
 from logging.handlers import RotatingFileHandler
 
-import requests
 import meshtastic.serial_interface
 
 from meshtastic_imports import load_meshtastic_protos
+from mesh_outbox import after_direct_send, target_name
+from mesh_reports import (
+    build_custom_weather_payload,
+    build_debug_text,
+    build_telemetry_payload_if_possible,
+    fetch_latest,
+    pick_custom_port,
+)
 
 # =========================
 # CONFIG
@@ -20,6 +26,9 @@ LOGFILE = "./meshtastic_telemetry_send.log"
 # Se True invia anche un messaggio testo per debug (con vento)
 SEND_DEBUG_TEXT = False
 
+# Se l'invio fallisce i payload vanno in data/mesh_outbox.db (mesh_outbox.py --drain)
+USE_OUTBOX = True
+
 # =========================
 # LOGGING
 # =========================
@@ -36,211 +45,12 @@ console.setFormatter(formatter)
 logger.addHandler(console)
 
 # =========================
-# UTILS
+# MAIN
 # =========================
-def safe_float(x):
-    try:
-        return float(x)
-    except Exception:
-        return 0.0
-
-def _set_first_field(obj, candidates, value):
-    """
-    Setta il primo campo disponibile in `candidates`.
-    Ritorna True se è riuscito.
-    """
-    for name in candidates:
-        if hasattr(obj, name):
-            try:
-                setattr(obj, name, value)
-                return True
-            except Exception:
-                try:
-                    setattr(obj, name, int(round(float(value), 0)))
-                    return True
-                except Exception:
-                    try:
-                        setattr(obj, name, float(value))
-                        return True
-                    except Exception:
-                        pass
-    return False
-
-def fetch_latest():
-    r = requests.get(SERVER_API, timeout=5)
-    r.raise_for_status()
-    return r.json()
-
-def pick_custom_port(portnums_pb2):
-    """
-    Usa PRIVATE_APP se esiste, altrimenti ricade su TEXT_MESSAGE_APP.
-    """
-    if hasattr(portnums_pb2.PortNum, "PRIVATE_APP"):
-        return portnums_pb2.PortNum.PRIVATE_APP, "PRIVATE_APP"
-    return portnums_pb2.PortNum.TEXT_MESSAGE_APP, "TEXT_MESSAGE_APP"
-
-def try_set_env_fields(env_obj, d):
-    """
-    Prova a impostare meteo base + anemometro su un oggetto env-like.
-    Tenta alias multipli perché i nomi cambiano tra versioni protobuf.
-    Ritorna True se almeno un campo viene impostato con successo.
-    """
-    ok = False
-
-    # temperatura
-    ok = _set_first_field(
-        env_obj,
-        ["temperature", "temperature_c", "temp_c", "temp"],
-        safe_float(d.get("temperature")),
-    ) or ok
-
-    # umidità
-    ok = _set_first_field(
-        env_obj,
-        ["relative_humidity", "humidity", "humidity_pct"],
-        safe_float(d.get("humidity")),
-    ) or ok
-
-    # pressione
-    ok = _set_first_field(
-        env_obj,
-        ["barometric_pressure", "pressure_hpa", "pressure"],
-        safe_float(d.get("pressure")),
-    ) or ok
-
-    # anemometro: velocità, direzione, raffica
-    windspeed_kmh = safe_float(d.get("windspeed"))
-    windspeed_mps = windspeed_kmh / 3.6
-    windgust_kmh = safe_float(d.get("windgust"))
-    windgust_mps = windgust_kmh / 3.6
-
-    # velocità vento
-    ok = _set_first_field(
-        env_obj,
-        [
-            "wind_speed_kmh", "windspeed", "windspeed_kmh",
-        ],
-        windspeed_kmh,
-    ) or ok
-    ok = _set_first_field(
-        env_obj,
-        [
-            "wind_speed", "windSpeed",
-            "wind_speed_m_s", "wind_speed_ms", "wind_m_s",
-            "windspeed_mps", "windSpeedMps",
-        ],
-        windspeed_mps,
-    ) or ok
-
-    # direzione vento in gradi
-    ok = _set_first_field(
-        env_obj,
-        [
-            "wind_direction", "windDirection",
-            "wind_direction_deg", "wind_direction_degrees",
-            "winddir", "wind_dir",
-            "wind_bearing", "wind_bearing_deg",
-        ],
-        safe_float(d.get("winddir")),
-    ) or ok
-
-    # raffica vento
-    ok = _set_first_field(
-        env_obj,
-        ["wind_gust_kmh", "gust", "gust_kmh"],
-        windgust_kmh,
-    ) or ok
-    ok = _set_first_field(
-        env_obj,
-        [
-            "wind_gust", "windGust",
-            "wind_gust_m_s", "wind_gust_ms",
-            "gust_mps", "gust_m_s",
-        ],
-        windgust_mps,
-    ) or ok
-
-    return ok
-
-def build_telemetry_payload_if_possible(d, telemetry_pb2):
-    """
-    Ritorna bytes protobuf se riesce a trovare un submessage 'environment-like'.
-    Se non possibile, ritorna None.
-    """
-    t = telemetry_pb2.Telemetry()
-
-    # caso classico
-    if hasattr(t, "environment"):
-        try:
-            if try_set_env_fields(t.environment, d):
-                logger.info("Telemetry: using t.environment")
-                return t.SerializeToString()
-        except Exception as e:
-            logger.warning(f"Telemetry: t.environment present but failed: {e}")
-
-    # fallback: cerca altri submessage potenzialmente corretti
-    for attr in dir(t):
-        if attr.startswith("_"):
-            continue
-        name = attr.lower()
-        if ("env" in name) or ("environment" in name) or ("sensor" in name):
-            try:
-                sub = getattr(t, attr)
-                if try_set_env_fields(sub, d):
-                    logger.info(f"Telemetry: using t.{attr}")
-                    return t.SerializeToString()
-            except Exception:
-                pass
-
-    logger.warning("Telemetry: no environment-like fields found; skipping TELEMETRY_APP send")
-    return None
-
-def build_custom_weather_payload(d):
-    """
-    Payload custom (JSON compatto) con meteo extra + anemometro:
-      - rain rate (mm/h)
-      - UV index
-      - solar W/m²
-      - T/H/P + ts
-      - vento (velocità/direzione/raffica)
-    """
-    rainrate = safe_float((d.get("rain_mm") or {}).get("rainrate"))  # mm/h
-    windspeed = safe_float(d.get("windspeed"))                       # km/h
-    winddir = safe_float(d.get("winddir"))                           # deg
-    windgust = safe_float(d.get("windgust"))                         # km/h
-
-    payload = {
-        "rg_mmph": rainrate,
-        "uv": safe_float(d.get("uv")),
-        "sr_wm2": safe_float(d.get("solarradiation")),
-
-        # opzionali utili per debug
-        "t_c": safe_float(d.get("temperature")),
-        "h_pct": safe_float(d.get("humidity")),
-        "p_hpa": safe_float(d.get("pressure")),
-        "ws_kmh": windspeed,
-        "wd_deg": winddir,
-        "wg_kmh": windgust,
-        "ts": d.get("time", "--:--:--"),
-    }
-
-    # JSON compatto
-    return json.dumps(payload, separators=(",", ":")).encode("utf-8"), payload
-
-def build_debug_text(payload_dict):
-    # Debug testo con anemometro
-    return (
-        f"WX | R {payload_dict['rg_mmph']:.2f}mm/h "
-        f"UV {payload_dict['uv']:.1f} "
-        f"SR {payload_dict['sr_wm2']:.0f}W/m² "
-        f"T {payload_dict['t_c']:.1f}C H {payload_dict['h_pct']:.0f}% P {payload_dict['p_hpa']:.0f}hPa "
-        f"W {payload_dict['ws_kmh']:.1f}km/h {payload_dict['wd_deg']:.0f}deg G {payload_dict['wg_kmh']:.1f}km/h"
-    )
-
 def main():
     portnums_pb2, telemetry_pb2 = load_meshtastic_protos()
 
-    d = fetch_latest()
+    d = fetch_latest(SERVER_API)
     logger.info("Fetched latest OK")
 
     # 1) Telemetry standard
@@ -250,37 +60,54 @@ def main():
     custom_bytes, custom_dict = build_custom_weather_payload(d)
     custom_port, custom_port_name = pick_custom_port(portnums_pb2)
 
-    iface = meshtastic.serial_interface.SerialInterface(devPath=SERIAL_PORT)
+    # (collapse_key outbox, portnum, payload, descrizione)
+    sends = []
+    if telemetry_payload is not None and hasattr(portnums_pb2.PortNum, "TELEMETRY_APP"):
+        sends.append(("report:telemetry", portnums_pb2.PortNum.TELEMETRY_APP, telemetry_payload,
+                      "TELEMETRY_APP (protobuf)"))
+    else:
+        logger.info("Skipped TELEMETRY_APP send (not supported by current protobufs)")
+    sends.append(("report:compact", custom_port, custom_bytes,
+                  f"CUSTOM weather payload on {custom_port_name} (len={len(custom_bytes)} bytes)"))
+
+    sent = []
     try:
-        if telemetry_payload is not None and hasattr(portnums_pb2.PortNum, "TELEMETRY_APP"):
-            iface.sendData(
-                telemetry_payload,
-                portNum=portnums_pb2.PortNum.TELEMETRY_APP,
-                channelIndex=CHANNEL_INDEX,
-                wantAck=False,
-            )
-            logger.info("Sent TELEMETRY_APP (protobuf)")
-        else:
-            logger.info("Skipped TELEMETRY_APP send (not supported by current protobufs)")
-
-        iface.sendData(
-            custom_bytes,
-            portNum=custom_port,
-            channelIndex=CHANNEL_INDEX,
-            wantAck=False,
-        )
-        logger.info(f"Sent CUSTOM weather payload on {custom_port_name} (len={len(custom_bytes)} bytes)")
-
-        if SEND_DEBUG_TEXT:
-            iface.sendText(build_debug_text(custom_dict), channelIndex=CHANNEL_INDEX)
-            logger.info("Sent debug text")
-    finally:
-        iface.close()
+        iface = meshtastic.serial_interface.SerialInterface(devPath=SERIAL_PORT)
+        try:
+            for key, port, payload, what in sends:
+                iface.sendData(
+                    payload,
+                    portNum=port,
+                    channelIndex=CHANNEL_INDEX,
+                    wantAck=False,
+                )
+                sent.append(key)
+                logger.info(f"Sent {what}")
+
+            if SEND_DEBUG_TEXT:
+                iface.sendText(build_debug_text(custom_dict), channelIndex=CHANNEL_INDEX)
+                logger.info("Sent debug text")
+        finally:
+            iface.close()
+    except Exception as e:
+        if not USE_OUTBOX:
+            raise
+        unsent = [(key, port, payload) for key, port, payload, _ in sends if key not in sent]
+        after_direct_send(_target(), sent, unsent)
+        logger.warning(f"[QUEUED] Send failed ({e}), {len(unsent)} payload(s) in outbox")
+        return False
+    if USE_OUTBOX:
+        after_direct_send(_target(), sent, [])
+    return True
+
+def _target():
+    return {"name": target_name("serial", SERIAL_PORT, CHANNEL_INDEX),
+            "interface": "serial", "device": SERIAL_PORT, "channel": CHANNEL_INDEX}
 
 if __name__ == "__main__":
     try:
-        main()
-        logger.info("[OK] Done")
+        if main():
+            logger.info("[OK] Done")
     except Exception as e:
         logger.error(f"[ERROR] {e}")
         raise